@@ -0,0 +1,71 @@
+"""
+Latency and memory comparison of the chess.com profile backends against the local stub server
+
+Usage: python -m benchmarks.chesscom_backends [--lookups 50] [--latency 0.05] [--backends json selenium]
+The selenium backends need Firefox and geckodriver (FIREFOX_BIN / GECKODRIVER_PATH)
+'selenium-classic' is the scraper with one WebDriver call per element and full page loads
+"""
+import argparse
+import asyncio
+import os
+import statistics
+from time import perf_counter
+
+from benchmarks.stubs import chesscom_app, start_server
+from utils.chesscom_api import make_backend
+from utils.memory import rss_mb
+
+
+async def run_backend(name, base_url, lookups):
+    if name == 'selenium-classic':
+        backend = make_backend('selenium', web_url=base_url, fast=False)
+    else:
+        backend = make_backend(name, api_url=base_url + '/pub', web_url=base_url)
+    baseline = rss_mb(os.getpid())
+    times = []
+    try:
+        for _ in range(lookups):
+            start = perf_counter()
+            await backend.fetch_profile('hikaru')
+            times.append(perf_counter() - start)
+        peak = rss_mb(os.getpid())
+        phases = backend.phase_summary() if hasattr(backend, 'phase_summary') else {}
+    finally:
+        await backend.close()
+
+    # First lookup includes session setup / browser launch, report it separately
+    first = times[0]
+    times.sort()
+    return {
+        'backend': name,
+        'first': first,
+        'p50': statistics.median(times),
+        'p95': times[int(len(times) * .95) - 1] if len(times) > 1 else times[0],
+        'rss': peak - baseline,
+        'phases': phases
+    }
+
+
+async def main(args):
+    runner, base_url = await start_server(chesscom_app(latency=args.latency))
+    try:
+        print(f"{'backend':<17} {'first (s)':>10} {'p50 (s)':>10} {'p95 (s)':>10} {'extra RSS (MB)':>15}")
+        for name in args.backends:
+            try:
+                result = await run_backend(name, base_url, args.lookups)
+            except Exception as e:
+                print(f'{name:<17} failed: {e!r}')
+                continue
+            print("{backend:<17} {first:>10.3f} {p50:>10.3f} {p95:>10.3f} {rss:>15.1f}".format(**result))
+            for phase, (samples, mean) in result['phases'].items():
+                print(f'    {phase:<10} mean {mean:.3f}s over {samples} lookups')
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lookups', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.05, help='simulated server latency in seconds')
+    parser.add_argument('--backends', nargs='+', default=['json', 'selenium', 'selenium-classic'])
+    asyncio.get_event_loop().run_until_complete(main(parser.parse_args()))
@@ -0,0 +1,132 @@
+"""
+Minimal stand-ins for the discord.py objects the cogs touch, so commands can be driven in-process
+"""
+import asyncio
+import itertools
+
+_ids = itertools.count(1)
+
+
+class FakeObject:
+    def __init__(self, name, id=None):
+        self.name = name
+        self.id = id if id is not None else next(_ids)
+
+    def __str__(self):
+        return self.name
+
+
+class FakeMessage:
+    def __init__(self, channel, content=None, embed=None):
+        self.id = next(_ids)
+        self.channel = channel
+        self.content = content
+        self.embed = embed
+        self.edits = 0
+        self.deleted = False
+        self.reactions = []
+        self.pinned = False
+        self.jump_url = f'https://discord.com/channels/bench/{channel.id}/{self.id}'
+
+    async def edit(self, content=None, embed=None, **kwargs):
+        await asyncio.sleep(self.channel.latency)
+        if content is not None:
+            self.content = content
+        if embed is not None:
+            self.embed = embed
+        self.edits += 1
+
+    async def delete(self):
+        await asyncio.sleep(self.channel.latency)
+        self.deleted = True
+
+    async def add_reaction(self, emoji):
+        self.reactions.append(emoji)
+
+    async def remove_reaction(self, emoji, member):
+        pass
+
+    async def clear_reactions(self):
+        self.reactions.clear()
+
+    async def pin(self):
+        self.pinned = True
+
+    async def unpin(self):
+        self.pinned = False
+
+
+class FakeChannel(FakeObject):
+    def __init__(self, name='bench', latency=0.0):
+        super().__init__(name)
+        self.latency = latency
+        self.messages = []
+
+    async def send(self, content=None, embed=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        message = FakeMessage(self, content, embed)
+        self.messages.append(message)
+        return message
+
+
+class FakeCommand:
+    def __init__(self, command):
+        self.name = command.name
+        self.qualified_name = command.qualified_name
+
+
+class FakeContext:
+    """
+    Looks enough like commands.Context for the cogs: send(), author, guild, channel, command and cog
+    """
+
+    def __init__(self, bot, cog=None, command=None, user='bench-user', guild='bench-guild', latency=0.0):
+        self.bot = bot
+        self.cog = cog
+        self.command = FakeCommand(command) if command is not None else None
+        self.author = FakeObject(user)
+        self.guild = FakeObject(guild)
+        self.channel = FakeChannel(latency=latency)
+        self.message = FakeMessage(self.channel)
+
+    async def send(self, content=None, embed=None, **kwargs):
+        return await self.channel.send(content, embed=embed, **kwargs)
+
+
+class FakeBot:
+    """
+    Enough of commands.Bot for the cogs to be constructed and unloaded outside of a gateway connection
+    """
+
+    def __init__(self, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.user = FakeObject('Gambit')
+        self.guilds = []
+
+    async def wait_for(self, event, check=None, timeout=None):
+        # Nobody reacts during a benchmark
+        await asyncio.sleep(0)
+        raise asyncio.TimeoutError()
+
+    async def wait_until_ready(self):
+        pass
+
+    def is_closed(self):
+        return False
+
+
+async def invoke(bot, cog, command, *args, **kwargs):
+    """
+    Run one command of a cog the way the bot would, including the perf hooks
+    :param kwargs: passed to FakeContext (user, guild, latency)
+    :return: the context, whose channel holds every message the command sent
+    """
+    from utils import perf
+
+    ctx = FakeContext(bot, cog, command, **kwargs)
+    await perf.before_invoke(ctx)
+    try:
+        await command.callback(cog, ctx, *args)
+    finally:
+        await perf.after_invoke(ctx)
+    return ctx
@@ -0,0 +1,133 @@
+"""
+Offline throughput benchmark: drives ChessComCog and LichessCog commands in-process against local stub servers
+
+Usage: python -m benchmarks.run [--users 10] [--commands 200] [--latency 0.05] [--discord-latency 0.02]
+                                [--scenarios stats compare listats ...] [--cold]
+
+Reports latency percentiles per command, commands per second with N concurrent users, the per-stage
+breakdown recorded by utils.perf and peak RSS. No tokens or network access are needed.
+"""
+import argparse
+import asyncio
+import contextlib
+import importlib
+import itertools
+import os
+import statistics
+import sys
+from time import perf_counter
+
+from benchmarks.fakes import FakeBot, invoke
+from benchmarks.stubs import chesscom_app, lichess_app, start_server
+from utils.memory import peak_rss_mb, rss_mb
+
+# name -> (cog module, cog class, command attribute, arguments)
+SCENARIOS = {
+    'stats': ('cogs.chesscom', 'ChessComCog', 'stats', ('hikaru',)),
+    'stats404': ('cogs.chesscom', 'ChessComCog', 'stats', ('nobody',)),
+    'compare': ('cogs.chesscom', 'ChessComCog', 'compareStats', ('hikaru', 'nobody', 'Hikaru')),
+    'listats': ('cogs.lichess', 'LichessCog', 'listats', ('drnykterstein',)),
+    'standings': ('cogs.lichess', 'LichessCog', 'arena_standings', ()),
+    'online': ('cogs.lichess', 'LichessCog', 'online', ()),
+    'flex': ('cogs.lichess', 'LichessCog', 'get_crosstable', ('DrNykterstein', 'penguingim1'))
+}
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def main(args):
+    chesscom, chesscom_url = await start_server(chesscom_app(latency=args.latency))
+    lichess, lichess_url = await start_server(lichess_app(latency=args.latency, standings_size=args.standings))
+
+    # Point the bot at the stubs and take pacing out of the picture before config is imported
+    os.environ.setdefault('DISCORD_TOKEN', 'benchmark')
+    os.environ.setdefault('ADMIN_LICHESS_TOKEN', 'benchmark')
+    os.environ['CHESSCOM_API_URL'] = chesscom_url + '/pub'
+    os.environ['CHESSCOM_WEB_URL'] = chesscom_url
+    os.environ['CHESSCOM_FALLBACK'] = ''
+    os.environ['LICHESS_URL'] = lichess_url
+    os.environ.setdefault('LICHESS_RATE', '100000')
+    os.environ.setdefault('LICHESS_BURST', '100000')
+    os.environ.setdefault('CHESSCOM_RATE', '100000')
+    os.environ.setdefault('CHESSCOM_BURST', '100000')
+
+    from utils.cache import profile_cache
+    from utils.lichess_api import lichess as lichess_client
+    from utils.perf import recorder
+
+    bot = FakeBot()
+    cogs = {}
+    plan = []
+    for name in args.scenarios:
+        module, cls, attr, arguments = SCENARIOS[name]
+        if (module, cls) not in cogs:
+            cogs[(module, cls)] = getattr(importlib.import_module(module), cls)(bot)
+        cog = cogs[(module, cls)]
+        plan.append((name, cog, getattr(type(cog), attr), arguments))
+
+    latencies = {name: [] for name in args.scenarios}
+    errors = {name: 0 for name in args.scenarios}
+    work = itertools.cycle(plan)
+    remaining = [args.commands]
+
+    async def user(number):
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            name, cog, command, arguments = next(work)
+            if args.cold:
+                profile_cache.clear()
+            start = perf_counter()
+            try:
+                await invoke(bot, cog, command, *arguments, user=f'user{number}', latency=args.discord_latency)
+            except Exception as e:
+                errors[name] += 1
+                if errors[name] == 1:
+                    print(f'{name} failed: {e!r}', file=sys.stderr)
+            latencies[name].append(perf_counter() - start)
+
+    baseline = rss_mb(os.getpid())
+    start = perf_counter()
+    # Keep the commands' own console logging out of the report
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        await asyncio.gather(*[user(i) for i in range(args.users)])
+    elapsed = perf_counter() - start
+    peak = max(rss_mb(os.getpid()), peak_rss_mb())
+
+    for cog in cogs.values():
+        if hasattr(cog, 'cog_unload'):
+            cog.cog_unload()
+        if hasattr(cog, 'close'):
+            await cog.close()
+    await lichess_client.close()
+    await chesscom.cleanup()
+    await lichess.cleanup()
+
+    print(f'{args.commands} commands, {args.users} concurrent users, {args.latency * 1000:.0f} ms upstream latency, '
+          f'{"cold" if args.cold else "warm"} cache')
+    print(f"{'command':<12} {'n':>5} {'errors':>7} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9}")
+    for name, times in latencies.items():
+        if not times:
+            continue
+        ordered = sorted(times)
+        print(f'{name:<12} {len(times):>5} {errors[name]:>7} {statistics.median(ordered) * 1000:>9.1f} '
+              f'{percentile(ordered, .95) * 1000:>9.1f} {percentile(ordered, .99) * 1000:>9.1f}')
+    print(f'\nThroughput: {args.commands / elapsed:.1f} commands/s over {elapsed:.2f}s')
+    print(f'Peak RSS: {peak:.1f} MB (baseline {baseline:.1f} MB)')
+
+    print('\nMean time per stage (ms):')
+    for (command, stage), histogram in sorted(recorder.stages.items()):
+        print(f'  {command:<16} {stage:<8} {histogram.total / histogram.count * 1000:>8.1f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10, help='concurrent users issuing commands')
+    parser.add_argument('--commands', type=int, default=200, help='total commands to run')
+    parser.add_argument('--latency', type=float, default=0.05, help='stub server latency in seconds')
+    parser.add_argument('--discord-latency', type=float, default=0.02, help='simulated Discord API latency')
+    parser.add_argument('--standings', type=int, default=50, help='players in the stub arena standings')
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--cold', action='store_true', help='clear the profile cache before every command')
+    asyncio.get_event_loop().run_until_complete(main(parser.parse_args()))
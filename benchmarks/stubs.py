@@ -0,0 +1,384 @@
+"""
+Local stand-ins for the sites the cogs talk to, so backends can be exercised without hitting the live sites
+"""
+import asyncio
+import datetime
+import json
+
+from aiohttp import web
+
+# Recorded (trimmed) chess.com payloads for a known player
+CHESSCOM_PLAYERS = {
+    'hikaru': {
+        'player': {
+            'avatar': 'https://images.chesscomfiles.com/uploads/v1/user/15448422.90503d66.200x200o.f323efa57fd0.jpeg',
+            'player_id': 15448422,
+            'url': 'https://www.chess.com/member/Hikaru',
+            'username': 'hikaru',
+            'title': 'GM',
+            'status': 'premium'
+        },
+        'stats': {
+            'chess_daily': {'last': {'rating': 2258}, 'record': {'win': 22, 'loss': 1, 'draw': 1}},
+            'chess960_daily': {'last': {'rating': 2035}, 'record': {'win': 9, 'loss': 4, 'draw': 0}},
+            'chess_rapid': {'last': {'rating': 2741}, 'record': {'win': 62, 'loss': 8, 'draw': 20}},
+            'chess_bullet': {'last': {'rating': 3286}, 'record': {'win': 14371, 'loss': 2375, 'draw': 1193}},
+            'chess_blitz': {'last': {'rating': 3218}, 'record': {'win': 23473, 'loss': 3770, 'draw': 3286}},
+            'tactics': {'highest': {'rating': 3374}, 'lowest': {'rating': 1002}},
+            'puzzle_rush': {'best': {'total_attempts': 54, 'score': 52}}
+        },
+        # What the rendered profile page shows for the same player
+        'page': {
+            'ratings': [('Bullet', '3286'), ('Blitz', '3218'), ('Rapid', '2741'), ('Daily', '2258'),
+                        ('Puzzles', '3374'), ('Puzzle Rush', '52'), ('Daily 960', '2035')],
+            'general': [('Games', '48,595'), ('Puzzles', '1,204'), ('Lessons', '3')]
+        }
+    }
+}
+
+MEMBER_PAGE = """<html><body>
+<div class="stat-section">{ratings}</div>
+<div class="sidebar">{general}</div>
+<div id="view-profile" data-username="{username}"></div>
+<img class="post-view-meta-image" alt="{username}" src="{avatar}">
+</body></html>"""
+
+ERROR_PAGE = '<html><body><div class="error-pages-wrapper">Page not found</div></body></html>'
+
+ECO_URLS = ['https://www.chess.com/openings/Sicilian-Defense-Najdorf-Variation-6.Bg5',
+            'https://www.chess.com/openings/Queens-Gambit-Declined-Exchange-Variation',
+            'https://www.chess.com/openings/Italian-Game-Two-Knights-Defense',
+            'https://www.chess.com/openings/Kings-Indian-Attack']
+
+
+def make_chesscom_games(username, count, opponent='opponent'):
+    """
+    :return: count deterministic games of username, as a chess.com month archive lists them
+    """
+    games = []
+    for i in range(count):
+        sides = [{'username': username, 'rating': 3000}, {'username': opponent, 'rating': 2900}]
+        if i % 2:
+            sides.reverse()
+        if i % 5 == 4:
+            sides[0]['result'], sides[1]['result'] = 'agreed', 'agreed'
+        else:
+            winner = (i // 2) % 2
+            sides[winner]['result'], sides[1 - winner]['result'] = 'win', ['resigned', 'timeout', 'checkmated'][i % 3]
+        games.append({'url': f'https://www.chess.com/game/live/{i}', 'pgn': '1. e4 c5 *', 'rated': True,
+                      'time_class': ['blitz', 'bullet', 'rapid'][i % 3], 'rules': 'chess960' if i % 7 == 6 else 'chess',
+                      'eco': ECO_URLS[i % len(ECO_URLS)], 'white': sides[0], 'black': sides[1]})
+    return games
+
+
+@web.middleware
+async def inject_failures(request, handler):
+    """
+    Answers the next requests with the (status, Retry-After) pairs queued in app['failures'] instead of the real
+    payloads, so retries and fallbacks can be exercised
+    """
+    if request.app['failures']:
+        status, retry_after = request.app['failures'].pop(0)
+        headers = {'Retry-After': str(retry_after)} if retry_after is not None else None
+        return web.json_response({'error': 'Injected failure'}, status=status, headers=headers)
+    return await handler(request)
+
+
+def chesscom_app(latency=0.0, players=CHESSCOM_PLAYERS, archives=None):
+    """
+    :param float latency: seconds to wait before answering each request
+    :param dict players: lowercase username -> recorded payloads
+    :param dict archives: lowercase username -> {(year, month): games}, the monthly game archives
+    :return: aiohttp app serving /pub/player/{user}, /pub/player/{user}/stats, the game archives and /member/{user}
+    """
+    archives = archives or {}
+
+    async def delay():
+        if latency:
+            await asyncio.sleep(latency)
+
+    async def player(request):
+        await delay()
+        data = players.get(request.match_info['user'].lower())
+        if data is None:
+            return web.json_response({'code': 0, 'message': 'User not found'}, status=404)
+        return web.json_response(data['player'])
+
+    async def stats(request):
+        await delay()
+        data = players.get(request.match_info['user'].lower())
+        if data is None:
+            return web.json_response({'code': 0, 'message': 'User not found'}, status=404)
+        return web.json_response(data['stats'])
+
+    async def member(request):
+        await delay()
+        data = players.get(request.match_info['user'].lower())
+        if data is None:
+            return web.Response(text=ERROR_PAGE, content_type='text/html')
+        page = data['page']
+        ratings = ''.join(f'<span class="stat-section-section-link-name">{mode}</span>'
+                          f'<span class="stat-section-user-rating">{rating}</span>' for mode, rating in page['ratings'])
+        general = ''.join(f'<span class="sidebar-ratings-label">{label}</span>'
+                          f'<span class="sidebar-ratings-rating">{value}</span>' for label, value in page['general'])
+        username = data['player']['url'].rsplit('/', 1)[-1]
+        return web.Response(text=MEMBER_PAGE.format(ratings=ratings, general=general, username=username,
+                                                    avatar=data['player']['avatar']),
+                            content_type='text/html')
+
+    async def archive_list(request):
+        await delay()
+        user = request.match_info['user'].lower()
+        if user not in archives:
+            return web.json_response({'code': 0, 'message': 'User not found'}, status=404)
+        return web.json_response({'archives': [f'http://{request.host}/pub/player/{user}/games/{year}/{month:02d}'
+                                               for year, month in sorted(archives[user])]})
+
+    async def archive(request):
+        await delay()
+        key = (int(request.match_info['year']), int(request.match_info['month']))
+        games = archives.get(request.match_info['user'].lower(), {}).get(key)
+        if games is None:
+            return web.json_response({'code': 0, 'message': 'Archive not found'}, status=404)
+        return web.json_response({'games': games})
+
+    app = web.Application(middlewares=[inject_failures])
+    # (status, Retry-After) answered to the next requests, see inject_failures
+    app['failures'] = []
+    app.router.add_get('/pub/player/{user}', player)
+    app.router.add_get('/pub/player/{user}/stats', stats)
+    app.router.add_get('/pub/player/{user}/games/archives', archive_list)
+    app.router.add_get('/pub/player/{user}/games/{year}/{month}', archive)
+    app.router.add_get('/member/{user}', member)
+    return app
+
+
+# Recorded (trimmed) lichess payloads
+LICHESS_USERS = {
+    'drnykterstein': {
+        'id': 'drnykterstein',
+        'username': 'DrNykterstein',
+        'online': True,
+        'perfs': {
+            'bullet': {'games': 6071, 'rating': 3244, 'rd': 45, 'prog': 9},
+            'blitz': {'games': 1044, 'rating': 3160, 'rd': 46, 'prog': -6},
+            'rapid': {'games': 7, 'rating': 2819, 'rd': 133, 'prog': 0, 'prov': True},
+            'classical': {'games': 0, 'rating': 1500, 'rd': 500, 'prog': 0, 'prov': True},
+            'puzzle': {'games': 155, 'rating': 2585, 'rd': 100, 'prog': 0},
+            'ultraBullet': {'games': 17, 'rating': 2220, 'rd': 257, 'prog': 0, 'prov': True},
+            'storm': {'runs': 4, 'score': 51},
+            'racer': {'runs': 7, 'score': 87}
+        }
+    },
+    'penguingim1': {
+        'id': 'penguingim1',
+        'username': 'penguingim1',
+        'online': False,
+        'perfs': {
+            'bullet': {'games': 31240, 'rating': 3079, 'rd': 45, 'prog': 11},
+            'blitz': {'games': 8010, 'rating': 2978, 'rd': 45, 'prog': 2},
+            'rapid': {'games': 32, 'rating': 2605, 'rd': 110, 'prog': 0},
+            'classical': {'games': 0, 'rating': 1500, 'rd': 500, 'prog': 0, 'prov': True},
+            'puzzle': {'games': 2, 'rating': 1500, 'rd': 300, 'prog': 0, 'prov': True},
+            'storm': {'runs': 1, 'score': 24},
+            'racer': {'runs': 0, 'score': 0}
+        }
+    }
+}
+
+LICHESS_ARENAS = [
+    {'id': 'Y8dh6Ezx', 'fullName': 'Niner Weekly Blitz Arena', 'status': 30, 'nbPlayers': 2,
+     'clock': {'limit': 180, 'increment': 0}, 'minutes': 60, 'startsAt': 1628377200000}
+]
+
+
+OPENINGS = ['Sicilian Defense: Najdorf Variation', "Queen's Gambit Declined", 'Italian Game: Two Knights Defense',
+            'French Defense', 'Caro-Kann Defense: Advance Variation']
+# Games the export endpoint returns for each known user
+GAMES_PER_USER = 200
+
+
+def make_games(user_id, count, start=1628377200000, opponent='opponent'):
+    """
+    :return: count deterministic finished games of user_id one minute apart, as the game export returns them
+    """
+    games = []
+    for i in range(count):
+        players = [{'user': {'id': user_id}}, {'user': {'id': opponent}}]
+        if i % 2:
+            players.reverse()
+        game = {'id': f'{user_id[:4]}{i:04d}', 'createdAt': start + i * 60000, 'status': 'mate',
+                'speed': ['blitz', 'bullet', 'rapid'][i % 3], 'players': {'white': players[0], 'black': players[1]},
+                'opening': {'eco': 'B90', 'name': OPENINGS[i % len(OPENINGS)]}}
+        if i % 5 == 4:
+            game['status'] = 'draw'
+        else:
+            game['winner'] = ['white', 'black'][(i // 2) % 2]
+        games.append(game)
+    return games
+
+
+def lichess_app(latency=0.0, users=LICHESS_USERS, arenas=LICHESS_ARENAS, standings_size=None):
+    """
+    :param float latency: seconds to wait before answering each request
+    :param dict users: lowercase id -> user payload (also used as the team roster)
+    :param list arenas: team arenas, most recent first
+    :param int standings_size: number of generated arena standings, defaults to one per user
+    :return: aiohttp app serving the lichess endpoints the bot uses, NDJSON ones streamed line by line
+    """
+    created = []
+
+    async def delay():
+        if latency:
+            await asyncio.sleep(latency)
+
+    async def ndjson(request, rows):
+        response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+        await response.prepare(request)
+        for row in rows:
+            await response.write(json.dumps(row).encode() + b'\n')
+        await response.write_eof()
+        return response
+
+    async def user(request):
+        await delay()
+        data = users.get(request.match_info['user'].lower())
+        if data is None:
+            return web.json_response({'error': 'Not found'}, status=404)
+        return web.json_response(data)
+
+    async def bulk_users(request):
+        await delay()
+        ids = (await request.text()).lower().split(',')[:300]
+        return web.json_response([users[user_id] for user_id in ids if user_id in users])
+
+    async def users_status(request):
+        await delay()
+        statuses = []
+        for user_id in request.query['ids'].lower().split(',')[:100]:
+            if user_id in users:
+                status = {'id': user_id, 'name': users[user_id]['username']}
+                if users[user_id]['online']:
+                    status['online'] = True
+                statuses.append(status)
+        return web.json_response(statuses)
+
+    async def team_users(request):
+        await delay()
+        return await ndjson(request, ({'id': u['id'], 'username': u['username'], 'online': u['online']}
+                                      for u in users.values()))
+
+    async def team_arenas(request):
+        await delay()
+        # Most recently created first
+        listed = [t for t in reversed(created) if t['kind'] == 'arena'] + arenas
+        return await ndjson(request, listed[:int(request.query.get('max', 100))])
+
+    async def team_swiss(request):
+        await delay()
+        listed = [t for t in reversed(created) if t['kind'] == 'swiss']
+        return await ndjson(request, listed[:int(request.query.get('max', 100))])
+
+    async def results(request):
+        await delay()
+        # Known users first, then generated players to fill large standings
+        names = [u['username'] for u in users.values()]
+        size = standings_size if standings_size is not None else len(names)
+        size = min(size, int(request.query.get('nb', size)))
+        names += [f'player{rank}' for rank in range(len(names) + 1, size + 1)]
+        rows = ({'rank': rank, 'score': max(0, 100 - rank), 'rating': 2000, 'username': names[rank - 1]}
+                for rank in range(1, size + 1))
+        return await ndjson(request, rows)
+
+    async def games(request):
+        await delay()
+        user_id = request.match_info['user'].lower()
+        since = int(request.query.get('since', 0))
+        exported = make_games(user_id, GAMES_PER_USER) if user_id in users else []
+        rows = [game for game in exported if game['createdAt'] >= since]
+        rows.sort(key=lambda game: game['createdAt'], reverse=request.query.get('sort') != 'dateAsc')
+        return await ndjson(request, rows[:int(request.query.get('max', len(rows)))])
+
+    async def tournament(request):
+        await delay()
+        tournament_id = request.match_info['id']
+        known = {arena['id']: arena for arena in arenas + created}
+        if tournament_id not in known:
+            return web.json_response({'error': 'Not found'}, status=404)
+        size = standings_size if standings_size is not None else len(users)
+        finished = tournament_id in app['finished']
+        return web.json_response({'id': tournament_id, 'fullName': known[tournament_id]['fullName'],
+                                  'nbPlayers': size, 'isStarted': True, 'isFinished': finished,
+                                  'secondsToFinish': 0 if finished else 600})
+
+    async def missing(request):
+        await delay()
+        return web.json_response({'error': 'Not found'}, status=404)
+
+    async def crosstable(request):
+        await delay()
+        user1, user2 = request.match_info['user1'].lower(), request.match_info['user2'].lower()
+        # Deterministic made up score from the pair of names
+        games = (len(user1) * 7 + len(user2) * 3) % 40 + 10
+        score1 = (len(user1) * 5) % games
+        return web.json_response({'users': {user1: score1 + .5, user2: games - score1 - .5}, 'nbGames': games})
+
+    async def create(request):
+        await delay()
+        form = await request.post()
+        tournament = {'id': f'T{len(created):07d}', 'fullName': f"{form.get('name', 'Tournament')} Arena"}
+        tournament.update(form)
+        # Listed by the team endpoints like lichess does: arenas start in ms, swiss at an ISO date
+        if 'startDate' in form:
+            tournament.update(kind='arena', startsAt=int(form['startDate']),
+                              clock={'limit': round(float(form['clockTime']) * 60),
+                                     'increment': int(form['clockIncrement'])})
+        elif 'startsAt' in form:
+            starts = datetime.datetime.fromtimestamp(int(form['startsAt']) / 1000, datetime.timezone.utc)
+            tournament.update(kind='swiss', startsAt=starts.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                              clock={'limit': int(form['clock.limit']), 'increment': int(form['clock.increment'])})
+        else:
+            tournament['kind'] = 'arena' if 'clockTime' in form else 'swiss'
+        # Injected failures: (status, whether the tournament is created anyway, i.e. only the answer is lost)
+        if app['create_failures']:
+            status, commit = app['create_failures'].pop(0)
+            if commit:
+                created.append(tournament)
+            return web.json_response({'error': 'Injected failure'}, status=status)
+        created.append(tournament)
+        return web.json_response(tournament)
+
+    app = web.Application(middlewares=[inject_failures])
+    app['created'] = created
+    # (status, Retry-After) answered to the next requests, see inject_failures
+    app['failures'] = []
+    # (status, created anyway) answered to the next tournament creations, see create
+    app['create_failures'] = []
+    # Ids of arenas reported as finished
+    app['finished'] = set()
+    app.router.add_get('/api/user/{user}', user)
+    app.router.add_get('/api/users/status', users_status)
+    app.router.add_post('/api/users', bulk_users)
+    app.router.add_get('/api/team/{team}/users', team_users)
+    app.router.add_get('/api/team/{team}/arena', team_arenas)
+    app.router.add_get('/api/team/{team}/swiss', team_swiss)
+    app.router.add_get('/api/games/user/{user}', games)
+    app.router.add_get('/api/tournament/{id}', tournament)
+    app.router.add_get('/api/tournament/{id}/results', results)
+    app.router.add_get('/api/swiss/{id}', missing)
+    app.router.add_get('/api/crosstable/{user1}/{user2}', crosstable)
+    app.router.add_post('/api/tournament', create)
+    app.router.add_post('/api/swiss/new/{team}', create)
+    return app
+
+
+async def start_server(app, host='127.0.0.1', port=0):
+    """
+    :return: (runner, base url) - call `await runner.cleanup()` when done
+    """
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f'http://{host}:{port}'
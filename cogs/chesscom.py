@@ -1,11 +1,19 @@
+import aiohttp
+import asyncio
 import discord
-from discord.ext import commands
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
+from discord.ext import commands, tasks
 from time import perf_counter
+import config
+from utils.aggregates import add_fields, total_games
+from utils.archives import ArchiveStore
+from utils.cache import profile_cache
+from utils.chesscom_api import ChessComClient, empty_stats, make_backend
+from utils.errors import User404Exception
+from utils.history import chesscom_ratings, history
+from utils.perf import stage, timed
+from utils.ratelimit import limiters
+from utils.resources import LazyResource
+from utils.webdriver_pool import PoolTimeout
 
 # Icon Emoji Setup
 ICONS = {  # Icons for chess.com ratings section
@@ -36,75 +44,97 @@ COMP_ICONS = [  # Player Icons for compare function (To be mapped to called user
     "<:OrangePawn:796081831530201128>"
 ]
 
-driver = webdriver.Firefox(firefox_binary=r'C:\Program Files (x86)\Mozilla Firefox\firefox.exe',
-                           executable_path=r'C:\Program Files (x86)\geckodriver.exe')
 
-
-class User404Exception(Exception):
-    def __init__(self, message="User does not exist"):
-        super().__init__(message)
+def unavailable(error):
+    """
+    :return: message for users about a lookup that failed for another reason than a missing user
+    """
+    if isinstance(error, PoolTimeout):
+        return str(error)
+    if not isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError)):
+        print(f'Unexpected chess.com error: {error!r}')
+    return 'Chess.com is not answering right now, please try again in a minute'
 
 
 class ChessComCog(commands.Cog):
+    site = 'chess.com'
+
     def __init__(self, bot):
         self.bot = bot
+        # Created on first use or warmed up after connecting, never at import time
+        self.backend = LazyResource('Chess.com backend', self.create_backend, lambda backend: backend.close())
+        # One chess.com API session for profiles and game archives
+        self.client = ChessComClient(config.CHESSCOM_API_URL, limiter=limiters['chesscom'])
+        self.archives = ArchiveStore(config.CHESSCOM_ARCHIVE_DIR, self.client)
+        # Only one process snapshots the tracked members' ratings
+        if config.PRIMARY_PROCESS and config.HISTORY_CHESSCOM_MEMBERS:
+            self.snapshot_members.change_interval(seconds=config.HISTORY_SNAPSHOT_INTERVAL)
+            self.snapshot_members.start()
+
+    async def create_backend(self):
+        backend = make_backend(config.CHESSCOM_BACKEND, fallback=config.CHESSCOM_FALLBACK,
+                               api_url=config.CHESSCOM_API_URL,
+                               client=self.client,
+                               web_url=config.CHESSCOM_WEB_URL,
+                               firefox_binary=config.FIREFOX_BINARY,
+                               executable_path=config.GECKDRIVER_PATH,
+                               workers=config.SELENIUM_WORKERS,
+                               max_pages=config.SELENIUM_MAX_PAGES,
+                               acquire_timeout=config.SELENIUM_ACQUIRE_TIMEOUT,
+                               fast=config.SELENIUM_FAST,
+                               limiter=limiters['chesscom'])
+        await backend.warm()
+        return backend
+
+    async def warm_up(self):
+        await self.backend.get()
+
+    def cog_unload(self):
+        self.snapshot_members.cancel()
+
+    async def close(self):
+        # Awaited by main.py once the cog is unloaded, so a reload doesn't leak the HTTP session or the browsers
+        await self.backend.close()
+        await self.client.close()
+
+    @tasks.loop(hours=1)
+    async def snapshot_members(self):
+        # A lookup records the member's ratings in the history, unless it was cached recently
+        for username in config.HISTORY_CHESSCOM_MEMBERS:
+            try:
+                await self.get_profile(username)
+            except Exception as e:  # One member failing shouldn't stop the loop
+                print(f'Rating snapshot of {username} failed: {e!r}')
+
+    @snapshot_members.before_loop
+    async def before_snapshot(self):
+        await self.bot.wait_until_ready()
+
+    # Helper function to retrieve a profile through the shared cache
+    async def get_profile(self, username):
+        async def load():
+            backend = await self.backend.get()
+            profile = await backend.fetch_profile(username)
+            # Every fresh lookup is also a rating history snapshot
+            history.record('chess.com', profile.username, chesscom_ratings(profile.stats))
+            return profile
+
+        return await profile_cache.get('chesscom', username, load)
+
+    # Helper function to replace a loading embed with an error
+    async def show_error(self, message, my_embed, start, username, title, description):
+        my_embed.title = title
+        my_embed.description = description
+        response_time = perf_counter() - start
+        my_embed.set_footer(text="Response time: {time:1.3} seconds".format(time=response_time))
 
-    # Helper function to retrieve, order, and return stats as dict
-    def get_ratings(self, username):
-
-        # Go to profile page
-        url = "https://www.chess.com/member/" + username
-        driver.get(url)
-
-        # Check if directed to error page
-        try:
-            driver.find_element_by_css_selector('.error-pages-wrapper')
-        except:
-            pass
-        else:
-            raise User404Exception(f"User '{username}' does not exist")
-
-        # Initialize default stats dict
-        stats = {
-            'Bullet': None,
-            'Blitz': None,
-            'Rapid': None,
-            'Daily': None,
-            'Puzzles': None,
-            'Puzzle Rush': None,
-            'Live 960': None,
-            'Daily 960': None,
-            'Bughouse': None,
-            'Crazyhouse': None,
-            '3 Check': None,
-            'King of the Hill': None
-        }
-
-        # Retrieve stats for all modes and ratings (Blitz, Crazyhouse, Puzzle Rush, etc.)
-        # Explicitly wait for up to .75 seconds for first search
-        try:
-            modes = WebDriverWait(driver, .75).until(
-                EC.presence_of_all_elements_located((By.CSS_SELECTOR, '.stat-section-section-link-name')))
-        except:  # TimeoutException thrown when existing user has no ratings
-            modes = []
-
-        ratings = driver.find_elements_by_css_selector('.stat-section-user-rating')
-
-        for i in range(len(modes)):
-            stats[modes[i].text] = ratings[i].text
-
-        return stats
-
-    # Helper function to retrive and return general info as dict
-    def get_general(self):
-        general = {}
-        categories = driver.find_elements_by_css_selector('.sidebar-ratings-label')
-        stats = driver.find_elements_by_css_selector('.sidebar-ratings-rating')
-
-        for i in range(len(categories)):
-            general[categories[i].text] = stats[i].text
+        # Replace loading message
+        await timed('edit', message.edit(embed=my_embed))
 
-        return general
+        print("{outcome:<12} {site:>12} {user:^24}  Response time = {time:1.3}".format(outcome=title,
+                                                                                       site='Chess.com',
+                                                                                       user=username,
+                                                                                       time=response_time))
 
     @commands.command(aliases=['rating', 'ratings', 'stat'])
     async def stats(self, ctx, username):
@@ -120,114 +150,71 @@ class ChessComCog(commands.Cog):
                             icon_url='https://images.chesscomfiles.com/uploads/v1/images_users/tiny_mce/SamCopeland/phpmeXx6V.png')
 
         # Send Loading Message
-        message = await ctx.send(embed=my_embed)
+        message = await timed('send', ctx.send(embed=my_embed))
 
         # (Try to) Go to profile page and get ratings
         try:
-            # Goes to user profile and returns dict of ratings (throws exception if username does not exist)
-            ratings = self.get_ratings(username)
-
+            # Fetches user profile and ratings (throws exception if username does not exist)
+            profile = await timed('fetch', self.get_profile(username))
 
         except User404Exception as e:  # If username does not exist
-
-            # Update embed with error message
-            my_embed.title = "Error 404"
-            my_embed.description = str(e)
-            response_time = perf_counter() - start
-            my_embed.set_footer(text="Response time: {time:1.3} seconds".format(time=response_time))
-
-            # Replace loading message
-            await message.edit(embed=my_embed)
-
-            print("{outcome:<12} {site:>12} {user:^24}  Response time = {time:1.3}".format(outcome='Error 404',
-                                                                                           site='Chess.com',
-                                                                                           user=username,
-                                                                                           time=response_time))
+            await self.show_error(message, my_embed, start, username, 'Error 404', str(e))
+            return
+        except Exception as e:  # Busy browsers, network or chess.com trouble: never leave the loading embed up
+            await self.show_error(message, my_embed, start, username, 'Error', unavailable(e))
             return
+
+        with stage('build'):
             # Set new field for each rating
-        for mode in ratings.keys():
-            if ratings[mode] is not None:
-                my_embed.add_field(name=f'{ICONS[mode]} {mode}  \u200b \u200b \u200b \u200b \u200b',
-                                   value=ratings[mode])
-
-        # Set description with general stats
-        general = self.get_general()
-        my_embed.description = ''
-        for section in (general.keys()):
-            my_embed.description += f'{GENERAL_ICONS[section]} **{section}** \u200b \u200b {general[section]}\n'
-
-        # Set description in case of user having no stats/ratings
-        if len(my_embed.fields) == 0:
-            my_embed.description = 'This user has no ratings...'
-
-        # Get profile picture and (case-sensitive) username
-        profile_pic = driver.find_element_by_css_selector('.post-view-meta-image ')
-        username = profile_pic.get_attribute("alt")
-        pic_url = profile_pic.get_attribute("src")
-        if pic_url[-3:] == 'svg':  # Link to default profile picture is not supported by discord, replace it
-            pic_url = 'https://cdn.discordapp.com/attachments/785212221444718633/785315817611984906/noavatar_l.png'
-
-        # Update embed
-        my_embed.title = f'Stats for {username}'
-        my_embed.set_thumbnail(url=pic_url)
+            ratings = profile.stats
+            for mode in ratings.keys():
+                if ratings[mode] is not None:
+                    my_embed.add_field(name=f'{ICONS[mode]} {mode}  \u200b \u200b \u200b \u200b \u200b',
+                                       value=ratings[mode])
+
+            # Set description with general stats
+            general = profile.general
+            my_embed.description = ''
+            for section in (general.keys()):
+                my_embed.description += f'{GENERAL_ICONS[section]} **{section}** \u200b \u200b {general[section]}\n'
+
+            # Set description in case of user having no stats/ratings
+            if len(my_embed.fields) == 0:
+                my_embed.description = 'This user has no ratings...'
+
+            # Get profile picture and (case-sensitive) username
+            username = profile.username
+            pic_url = profile.avatar
+
+            # Update embed
+            my_embed.title = f'Stats for {username}'
+            my_embed.set_thumbnail(url=pic_url)
         response_time = perf_counter() - start
         my_embed.set_footer(text="Response time: {time:1.3} seconds".format(time=response_time))
 
         # Replace earlier message
-        await message.edit(embed=my_embed)
+        await timed('edit', message.edit(embed=my_embed))
         print("{outcome:<12} {site:>12} {user:^24}  Response time = {time:1.3}".format(outcome='Success',
                                                                                        site='Chess.com', user=username,
                                                                                        time=response_time))
 
-    @commands.command(aliases=['compare'])
-    async def compareStats(self, ctx, *usernames):
-        start = perf_counter()
-        all_ratings = {
-            'Bullet': {},
-            'Blitz': {},
-            'Rapid': {},
-            'Daily': {},
-            'Puzzles': {},
-            'Puzzle Rush': {},
-            'Live 960': {},
-            'Daily 960': {},
-            'Bughouse': {},
-            'Crazyhouse': {},
-            '3 Check': {},
-            'King of the Hill': {}
-        }
-
-        my_embed = discord.Embed(
-            description="Retrieving data from chess.com...",
-            color=discord.Color.dark_green()
-        )
-        my_embed.set_author(name='Chess.com',
-                            icon_url='https://images.chesscomfiles.com/uploads/v1/images_users/tiny_mce/SamCopeland/phpmeXx6V.png')
-
-        message = await ctx.send(embed=my_embed)
+    # Helper function to (re)build the compare embed from the profiles retrieved so far
+    def fill_compare_embed(self, my_embed, usernames, profiles, errors):
+        all_ratings = {mode: {} for mode in empty_stats()}
 
-        user_icons = {}
+        # Key lists every requested user in argument order, whether retrieved, pending or failed
         my_embed.description = '**Key**\n'
-        usernames = list(usernames)
         for i in range(len(usernames)):
-            try:
-                user_ratings = self.get_ratings(usernames[i])
-                usernames[i] = driver.find_element_by_id("view-profile").get_attribute("data-username")
-                user_icons[usernames[i]] = COMP_ICONS[i]
-                my_embed.description += f'{COMP_ICONS[i]} = {usernames[i]}\n'
-
-                for rating in user_ratings:
-                    all_ratings[rating][usernames[i]] = user_ratings[rating]
-
-            except User404Exception as e:
-                my_embed.title = "Error 404"
-                my_embed.description = str(e)
-                response_time = perf_counter() - start
-                my_embed.set_footer(text="Response time: {time:1.3} seconds".format(time=response_time))
-                await message.edit(embed=my_embed)
-                # TODO: print(console log)
-                return
-
+            if i in profiles:
+                my_embed.description += f'{COMP_ICONS[i]} = {profiles[i].username}\n'
+                for rating in profiles[i].stats:
+                    all_ratings[rating][i] = profiles[i].stats[rating]
+            elif i in errors:
+                my_embed.description += f'{COMP_ICONS[i]} = ~~{usernames[i]}~~ ({errors[i]})\n'
+            else:
+                my_embed.description += f'{COMP_ICONS[i]} = {usernames[i]} (retrieving...)\n'
+
+        my_embed.clear_fields()
         for mode in all_ratings.keys():
             sorted_user_ratings = sorted(all_ratings[mode].items(),
                                          key=lambda x: int(x[1]) if x[1] is not None and x[1] != 'Unrated' else -1,
@@ -237,14 +224,107 @@ class ChessComCog(commands.Cog):
             for user_ratings in sorted_user_ratings:
                 if user_ratings[1] is None or user_ratings[1] == 'Unrated':
                     break
-                sorted_ratings += f'{user_icons[user_ratings[0]]} {user_ratings[1]}\n'
+                sorted_ratings += f'{COMP_ICONS[user_ratings[0]]} {user_ratings[1]}\n'
 
             if sorted_ratings != "":
                 my_embed.add_field(name=f' \u200b \n{ICONS[mode]} __{mode}__  \u200b \u200b \u200b \u200b \u200b',
                                    value=sorted_ratings)
 
-        my_embed.set_footer(text='Reponse time: {:1.3} seconds'.format(perf_counter() - start))
-        await message.edit(embed=my_embed)
+    @commands.command(aliases=['compare'])
+    async def compareStats(self, ctx, *usernames):
+        start = perf_counter()
+
+        # One icon per user, extra usernames are ignored
+        usernames = list(usernames[:len(COMP_ICONS)])
+
+        my_embed = discord.Embed(
+            description="Retrieving data from chess.com...",
+            color=discord.Color.dark_green()
+        )
+        my_embed.set_author(name='Chess.com',
+                            icon_url='https://images.chesscomfiles.com/uploads/v1/images_users/tiny_mce/SamCopeland/phpmeXx6V.png')
+
+        message = await timed('send', ctx.send(embed=my_embed))
+
+        profiles = {}  # Argument index -> Profile
+        errors = {}  # Argument index -> reason the user could not be shown
+        semaphore = asyncio.Semaphore(config.COMPARE_CONCURRENCY)
+
+        async def fetch(i):
+            async with semaphore:
+                try:
+                    profiles[i] = await timed('fetch', self.get_profile(usernames[i]))
+                except User404Exception:
+                    errors[i] = 'not found'
+                except PoolTimeout as e:
+                    errors[i] = str(e)
+                except Exception as e:  # One failed lookup should not take down the whole comparison
+                    errors[i] = 'unavailable'
+                    print(f'Error retrieving {usernames[i]} for compare: {e!r}')
+
+        # Fetch all users at once and update the embed as each one arrives
+        for lookup in asyncio.as_completed([fetch(i) for i in range(len(usernames))]):
+            await lookup
+            with stage('build'):
+                self.fill_compare_embed(my_embed, usernames, profiles, errors)
+
+            # Every user failed
+            if len(errors) == len(usernames):
+                my_embed.title = "Error 404" if set(errors.values()) == {'not found'} else "Error"
+
+            response_time = perf_counter() - start
+            my_embed.set_footer(text="Response time: {time:1.3} seconds".format(time=response_time))
+            await timed('edit', message.edit(embed=my_embed))
+
+        print("{outcome:<12} {site:>12} {user:^24}  Response time = {time:1.3}".format(
+            outcome='Success' if profiles else 'Error', site='Chess.com', user=' '.join(usernames),
+            time=perf_counter() - start))
+
+    @commands.command(aliases=['games'])
+    async def archive(self, ctx, username):
+        """
+        :note: Example command usage: #archive hikaru
+        :param ctx: command
+        :param string username: chess.com player
+        :return: embed Discord message with results by color, time control and opening over every game the player
+        has on chess.com, read from the locally stored monthly archives
+        """
+        start = perf_counter()
+
+        # Create the Loading Embed, downloading a long history for the first time takes a while
+        my_embed = discord.Embed(
+            description="Reading game archives from chess.com...",
+            color=discord.Color.dark_green()
+        )
+        my_embed.set_author(name='Chess.com', url="https://www.chess.com/member/" + username,
+                            icon_url='https://images.chesscomfiles.com/uploads/v1/images_users/tiny_mce/SamCopeland/phpmeXx6V.png')
+        message = await timed('send', ctx.send(embed=my_embed))
+
+        downloads = self.archives.downloads
+        try:
+            stats, months = await timed('fetch', self.archives.analyse(username))
+        except User404Exception as e:
+            await self.show_error(message, my_embed, start, username, 'Error 404', str(e))
+            return
+        except Exception as e:  # Network trouble, timeouts or a full disk: never leave the loading embed up
+            await self.show_error(message, my_embed, start, username, 'Error', unavailable(e))
+            return
+
+        with stage('build'):
+            my_embed.title = f'Game stats for {username}'
+            my_embed.description = 'Wins / draws / losses (score)'
+            add_fields(my_embed, stats)
+            response_time = perf_counter() - start
+            # Downloads counted across concurrent lookups, close enough to show how much came from disk
+            my_embed.set_footer(text="{games} games over {months} months, {downloaded} downloaded | "
+                                     "Response time: {time:1.3} seconds".format(
+                                         games=total_games(stats), months=months,
+                                         downloaded=self.archives.downloads - downloads, time=response_time))
+
+        await timed('edit', message.edit(embed=my_embed))
+        print("{outcome:<12} {site:>12} {user:^24}  Response time = {time:1.3}".format(outcome='Success',
+                                                                                       site='Chess.com', user=username,
+                                                                                       time=response_time))
 
 
 def setup(bot):
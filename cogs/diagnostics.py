@@ -0,0 +1,167 @@
+import discord
+from discord.ext import commands, tasks
+import config
+from utils.cache import profile_cache
+from utils.memory import process_memory
+from utils.perf import recorder
+from utils.ratelimit import limiters
+from utils.scheduler import scheduler
+
+
+class DiagnosticsCog(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.write_metrics.change_interval(seconds=config.PERF_METRICS_INTERVAL)
+        self.write_metrics.start()
+
+    def cog_unload(self):
+        self.write_metrics.cancel()
+
+    @tasks.loop(seconds=30)
+    async def write_metrics(self):
+        try:
+            recorder.write_prometheus(config.PERF_METRICS_PATH)
+        except OSError as e:
+            print(f'Could not write metrics to {config.PERF_METRICS_PATH}: {e}')
+        except Exception as e:  # An exception would stop the loop for good
+            print(f'Building metrics failed: {e!r}')
+
+    @commands.command(aliases=['cache'])
+    async def cachestats(self, ctx):
+        """
+        :param ctx: command
+        :return: embed Discord message with the shared profile cache counters
+        """
+        stats = profile_cache.stats()
+
+        stat_embed = discord.Embed(
+            title='Profile cache',
+            color=discord.Color.dark_grey()
+        )
+        stat_embed.add_field(name='Hits', value=stats['hits'])
+        stat_embed.add_field(name='Stale hits', value=stats['stale_hits'])
+        stat_embed.add_field(name='Negative hits', value=stats['negative_hits'])
+        stat_embed.add_field(name='Misses', value=stats['misses'])
+        stat_embed.add_field(name='Evictions', value=stats['evictions'])
+        stat_embed.add_field(name='Hit rate', value=f"{stats['hit_rate']:.1%}")
+        stat_embed.add_field(name='Refreshes', value=f"{stats['refreshes']} ({stats['refresh_errors']} failed)")
+        stat_embed.add_field(name='Upstream calls', value=f"{stats['upstream_calls']} ({stats['coalesced']} saved)")
+        stat_embed.add_field(name='Entries', value=stats['entries'])
+        stat_embed.add_field(name='Size', value=f"{stats['bytes'] / 1024:.1f} KB")
+
+        await ctx.send(embed=stat_embed)
+
+    @commands.command(aliases=['ratelimits'])
+    async def limits(self, ctx):
+        """
+        :param ctx: command
+        :return: embed Discord message with the upstream rate limiter metrics
+        """
+        stat_embed = discord.Embed(
+            title='Upstream rate limits',
+            color=discord.Color.dark_grey()
+        )
+        for limiter in limiters.values():
+            stats = limiter.stats()
+            stat_embed.add_field(name=stats['host'],
+                                 value=f"Rate: {stats['rate']:.2f}/s\n"
+                                       f"Queued: {stats['queued']} ({stats['queued_high']} priority)\n"
+                                       f"Requests: {stats['requests']}\n"
+                                       f"429s: {stats['throttles']}\n"
+                                       f"Time throttled: {stats['throttled_seconds']:.1f}s\n"
+                                       f"Paused for: {stats['paused_for']:.1f}s")
+
+        await ctx.send(embed=stat_embed)
+
+    @commands.command(aliases=['busy'])
+    async def queue(self, ctx):
+        """
+        :param ctx: command
+        :return: embed Discord message with the command scheduler's state and how long commands waited for a slot
+        """
+        stats = scheduler.stats()
+
+        stat_embed = discord.Embed(
+            title='Command queue',
+            color=discord.Color.dark_grey()
+        )
+        stat_embed.add_field(name='Running', value=f"{stats['running']} of {stats['slots']}")
+        stat_embed.add_field(name='Waiting', value=f"{stats['waiting']} ({stats['guilds_waiting']} servers)")
+        stat_embed.add_field(name='Started', value=stats['started'])
+        stat_embed.add_field(name='Had to wait', value=stats['queued'])
+        stat_embed.add_field(name='Refused', value=stats['rejected'])
+        # Most waited on first, embeds hold at most 25 fields
+        waits = sorted(recorder.queue_waits.items(), key=lambda item: -item[1].total)
+        for name, histogram in waits[:20]:
+            stat_embed.add_field(name=f'Wait for #{name}',
+                                 value="{p50:.3f} / {p95:.3f} / {p99:.3f}\n{count} calls".format(**histogram.summary()))
+
+        await ctx.send(embed=stat_embed)
+
+    @commands.command()
+    async def perf(self, ctx, command=None):
+        """
+        :note: Example command usage: #perf or #perf listats for the stage breakdown of one command
+        :param ctx: command
+        :param string command: optional command name to break down by stage
+        :return: embed Discord message with command latency percentiles and error counts
+        """
+        stat_embed = discord.Embed(
+            title='Command latency' if command is None else f'Latency of #{command}',
+            description='p50 / p95 / p99 in seconds over the most recent invocations',
+            color=discord.Color.dark_grey()
+        )
+
+        if command is None:
+            rows = [(name, histogram) for name, histogram in recorder.commands.items()]
+            rows += [(f'site: {name}', histogram) for name, histogram in recorder.sites.items()]
+        else:
+            rows = [(command, recorder.commands[command])] if command in recorder.commands else []
+            rows += [(f'stage: {stage}', histogram) for (name, stage), histogram in recorder.stages.items()
+                     if name == command]
+
+        # Embeds hold at most 25 fields
+        for name, histogram in rows[:24]:
+            summary = histogram.summary()
+            stat_embed.add_field(name=name,
+                                 value="{p50:.3f} / {p95:.3f} / {p99:.3f}\n{count} calls".format(**summary))
+
+        errors = [f'{name} {kind}: {count}' for (name, kind), count in recorder.errors.most_common(10)
+                  if command is None or name == command]
+        if errors:
+            stat_embed.add_field(name='Errors', value='\n'.join(errors), inline=False)
+        if not rows:
+            stat_embed.description = 'No commands recorded yet'
+
+        await ctx.send(embed=stat_embed)
+
+    @commands.command(aliases=['mem'])
+    async def memory(self, ctx):
+        """
+        :param ctx: command
+        :return: embed Discord message with the memory used by this process and what discord.py keeps cached
+        """
+        memory = process_memory()
+        stats = profile_cache.stats()
+
+        stat_embed = discord.Embed(
+            title='Memory',
+            description='Lean gateway mode' if config.LEAN_GATEWAY else 'Full gateway mode',
+            color=discord.Color.dark_grey()
+        )
+        stat_embed.add_field(name='RSS', value=f"{memory['rss']:.1f} MB")
+        stat_embed.add_field(name='RSS with browsers', value=f"{memory['rss_with_children']:.1f} MB")
+        stat_embed.add_field(name='Shards', value=f'{self.bot.shard_ids} of {self.bot.shard_count}'
+                             if config.SHARD_COUNT else 'unsharded')
+        stat_embed.add_field(name='Guilds', value=len(self.bot.guilds))
+        stat_embed.add_field(name='Cached users', value=len(self.bot.users))
+        stat_embed.add_field(name='Cached members', value=sum(len(guild.members) for guild in self.bot.guilds))
+        stat_embed.add_field(name='Cached messages', value=len(self.bot.cached_messages))
+        stat_embed.add_field(name='Profile cache', value=f"{stats['bytes'] / 1024:.1f} KB")
+
+        await ctx.send(embed=stat_embed)
+
+
+def setup(bot):
+    bot.add_cog(DiagnosticsCog(bot))
+    print("Diagnostics Cog successfully loaded")
@@ -0,0 +1,133 @@
+import datetime
+import time
+
+import discord
+from discord.ext import commands
+
+from utils.history import history
+from utils.lichess_api import mode_name
+from utils.perf import stage, timed
+
+SITES = {  # Accepted site names -> (site in the history, embed color)
+    'lichess': ('lichess', discord.Color.dark_blue()),
+    'lichess.org': ('lichess', discord.Color.dark_blue()),
+    'chess.com': ('chess.com', discord.Color.dark_green()),
+    'chesscom': ('chess.com', discord.Color.dark_green())
+}
+
+SPARKS = '▁▂▃▄▅▆▇█'
+
+
+def sparkline(values):
+    low, high = min(values), max(values)
+    if high == low:
+        return SPARKS[3] * len(values)
+    return ''.join(SPARKS[(value - low) * (len(SPARKS) - 1) // (high - low)] for value in values)
+
+
+def display_mode(site, mode):
+    # Lichess perfs are camelCase keys, chess.com modes are recorded by their display name
+    return mode_name(mode) if site == 'lichess' else mode
+
+
+class HistoryCog(commands.Cog):
+    """
+    Rating history answered from the local snapshot database, never from the live sites
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def resolve_mode(self, ctx, site, username, mode):
+        """
+        :return: recorded mode matching what the user typed (any case, spaces optional), None after replying
+        """
+        modes = await timed('fetch', history.modes(site, username))
+        if not modes:
+            await timed('send', ctx.send(f"No {site} rating history for {username} yet, "
+                                         f"it starts with their first lookup"))
+            return None
+        matches = {recorded.replace(' ', '').lower(): recorded for recorded in modes}
+        recorded = matches.get(mode.replace(' ', '').lower())
+        if recorded is None:
+            await timed('send', ctx.send("No {} history for {}, try one of: {}".format(
+                mode, username, ', '.join(sorted(display_mode(site, recorded) for recorded in modes)))))
+        return recorded
+
+    @commands.command()
+    async def history(self, ctx, username, mode, site='lichess'):
+        """
+        :note: Example command usage: #history DrNykterstein blitz or #history hikaru "puzzle rush" chess.com
+        :param ctx: command
+        :param string username: player
+        :param string mode: game mode as shown by #listats / #stats
+        :param string site: lichess (default) or chess.com
+        :return: embed Discord message with the most recent rating changes
+        """
+        if site.lower() not in SITES:
+            await timed('send', ctx.send(f"Unknown site '{site}', use lichess or chess.com"))
+            return
+        site, color = SITES[site.lower()]
+
+        recorded = await self.resolve_mode(ctx, site, username, mode)
+        if recorded is None:
+            return
+        snapshots = await timed('fetch', history.history(site, username, recorded))
+
+        with stage('build'):
+            lines = []
+            previous = None
+            for taken, rating in snapshots:
+                change = '' if previous is None else f'{rating - previous:+d}'
+                lines.append(f'{datetime.datetime.utcfromtimestamp(taken):%Y-%m-%d %H:%M}  {rating:>5}  {change:>5}')
+                previous = rating
+            ratings = [rating for _, rating in snapshots]
+
+            stat_embed = discord.Embed(
+                title=f'{display_mode(site, recorded)} history for {username}',
+                description=sparkline(ratings) + '\n```\n' + '\n'.join(lines) + '\n```',
+                color=color
+            )
+            stat_embed.add_field(name='Current', value=ratings[-1])
+            stat_embed.add_field(name='Peak', value=max(ratings))
+            stat_embed.add_field(name='Lowest', value=min(ratings))
+            stat_embed.set_footer(text=f'{site} | last {len(snapshots)} changes, times in UTC')
+
+        await timed('send', ctx.send(embed=stat_embed))
+
+    @commands.command(aliases=['week'])
+    async def weekly(self, ctx, username, site='lichess'):
+        """
+        :note: Example command usage: #weekly DrNykterstein or #weekly hikaru chess.com
+        :param ctx: command
+        :param string username: player
+        :param string site: lichess (default) or chess.com
+        :return: embed Discord message with the rating change of every mode over the last 7 days
+        """
+        if site.lower() not in SITES:
+            await timed('send', ctx.send(f"Unknown site '{site}', use lichess or chess.com"))
+            return
+        site, color = SITES[site.lower()]
+
+        changes = await timed('fetch', history.changes(site, username, time.time() - 7 * 24 * 3600))
+        if not changes:
+            await timed('send', ctx.send(f"No {site} rating history for {username} yet, "
+                                         f"it starts with their first lookup"))
+            return
+
+        stat_embed = discord.Embed(
+            title=f'Rating change this week for {username}',
+            color=color
+        )
+        with stage('build'):
+            # Embeds hold at most 25 fields
+            for mode, now, before in changes[:25]:
+                stat_embed.add_field(name=display_mode(site, mode), value=f'{before} → {now} ({now - before:+d})')
+        stat_embed.set_footer(text=f'{site} | since 7 days ago, or since the first snapshot if that is more recent')
+
+        await timed('send', ctx.send(embed=stat_embed))
+
+
+def setup(bot):
+    bot.add_cog(HistoryCog(bot))
+    print("History Cog successfully loaded")
@@ -1,17 +1,82 @@
 import discord
 from discord.ext import commands
+import aiohttp
+import asyncio
 import config
-import berserk
 import datetime
+import sys
+import traceback
 from time import perf_counter
+from utils.aggregates import add_fields, total_games
+from utils.cache import profile_cache
+from utils.club import CLUB_TEAM, presence, ratings
+from utils.errors import BusyException, User404Exception
+from utils.gamestats import game_stats
+from utils.history import history, lichess_ratings
+from utils.lichess_api import LichessError, lichess, mode_name
+from utils.paginator import LazyRows, Paginator, StaticRows
+from utils.perf import stage, timed
+from utils.schedule import ScheduleBatch, parse_recurrence
+from utils.tracker import EditThrottle, TournamentTracker
 
-session = berserk.TokenSession(config.ADMIN_LICHESS_TOKEN)
-lichess = berserk.Client(session=session)
+
+# Players in a #matrix, by default and at most
+MATRIX_DEFAULT = 8
+MATRIX_MAX = 10
 
 
 class LichessCog(commands.Cog):
+    site = 'lichess'
+
     def __init__(self, bot):
         self.bot = bot
+        # (channel id, tournament id) -> (tracker, task) for every #track running
+        self.trackers = {}
+        self.edit_throttle = EditThrottle(config.TRACK_EDIT_INTERVAL)
+
+    def cog_unload(self):
+        for tracker, task in self.trackers.values():
+            task.cancel()
+        presence.stop()
+        ratings.stop()
+        game_stats.stop()
+
+    async def close(self):
+        # Awaited by main.py once the cog is unloaded, the shared client opens a new session on its next request
+        await lichess.close()
+
+    async def warm_up(self):
+        # Only one process follows the club's presence, ratings and games unless a command there needs them
+        if config.PRIMARY_PROCESS:
+            presence.start()
+            ratings.start()
+            game_stats.start()
+        await lichess.warm()
+
+    async def cog_command_error(self, ctx, error):
+        # Surface lichess rate limiting as a reply instead of an unhandled exception
+        original = getattr(error, 'original', error)
+        if isinstance(original, LichessError) and original.status == 429:
+            await ctx.send('Lichess is rate limiting the bot right now, please try again in a minute')
+            return
+        if isinstance(error, BusyException):  # Answered by the bot's handler in main.py
+            return
+        # Expected mistakes (missing Officer role, bad arguments) get a reply, not a traceback
+        if isinstance(error, (commands.CheckFailure, commands.UserInputError)):
+            await ctx.send(str(error))
+            return
+        print(f'Ignoring exception in command {ctx.command}:', file=sys.stderr)
+        traceback.print_exception(type(error), error, error.__traceback__, file=sys.stderr)
+
+    # Helper function to retrieve a public profile through the shared cache
+    async def get_profile(self, username):
+        async def load():
+            profile = await lichess.get_public_data(username)
+            # Every fresh lookup is also a rating history snapshot
+            history.record('lichess', profile['id'], lichess_ratings(profile.get('perfs', {})))
+            return profile
+
+        return await profile_cache.get('lichess', username, load)
 
     @commands.command(aliases=['arena'])
     @commands.has_role("Officer")
@@ -32,10 +97,10 @@ class LichessCog(commands.Cog):
         d_time = datetime.datetime.fromisoformat(c_string)
 
         d_time = int(d_time.timestamp() * 1000)
-        lichess.tournaments.create_arena(clock_time, clock_increment, minutes, name=name, rated="false",
-                                         start_date=d_time, teamId='niner-chess-club')
+        await timed('fetch', lichess.create_arena(clock_time, clock_increment, minutes, name=name, rated="false",
+                                                  start_date=d_time, team_id='niner-chess-club'))
 
-        await ctx.send('Tournament created with name: ' + name)
+        await timed('send', ctx.send('Tournament created with name: ' + name))
 
     @commands.command(aliases=['swiss'])
     @commands.has_role("Officer")
@@ -58,9 +123,86 @@ class LichessCog(commands.Cog):
 
         dtime = int(dtime.timestamp())
         clocklimit_seconds = clock_limit * 60
-        lichess.tournaments.create_swiss("niner-chess-club", clocklimit_seconds, clock_increment, nb_rounds,
-                                         startsAt=dtime * 1000, name=name, rated="false")
-        await ctx.send('Tournament created with name: ' + name)
+        await timed('fetch', lichess.create_swiss("niner-chess-club", clocklimit_seconds, clock_increment, nb_rounds,
+                                                  starts_at=dtime * 1000, name=name, rated="false"))
+        await timed('send', ctx.send('Tournament created with name: ' + name))
+
+    @commands.command()
+    @commands.has_role("Officer")
+    async def schedule(self, ctx, name, *, spec):
+        """
+        :note: Example command usage: #schedule "Thursday Blitz" every Thursday 20:00 for 12 weeks, arena 3+0 60m
+        or #schedule Weekend every Saturday 18:00 for 8 weeks, swiss 5+3 7 rounds from 2021-09-04
+        :param ctx: command
+        :param string name: name of every tournament
+        :param string spec: recurrence, tournament kind, clock and length (minutes for arenas, rounds for swiss)
+        :return: embed Discord message summarising the created events, running it again only creates missing ones
+        """
+        start = perf_counter()
+        try:
+            recurrence = parse_recurrence(spec, config.SCHEDULE_MAX_EVENTS)
+        except ValueError as e:
+            await timed('send', ctx.send(str(e)))
+            return
+
+        batch = ScheduleBatch(recurrence, name, CLUB_TEAM, concurrency=config.SCHEDULE_CONCURRENCY,
+                              retries=config.SCHEDULE_RETRIES)
+        kind = 'arenas' if recurrence.kind == 'arena' else 'swiss tournaments'
+        stat_embed = discord.Embed(
+            title=f'Scheduling {len(batch.events)} {kind}',
+            description='Creating events on lichess.org',
+            color=discord.Color.dark_blue()
+        )
+        stat_embed.set_author(name='lichess.org',
+                              icon_url='https://lichess1.org/assets/_QubGrC/logo/lichess-favicon-256.png',
+                              url=f'https://lichess.org/team/{CLUB_TEAM}')
+        message = await timed('send', ctx.send(embed=stat_embed))
+
+        last_edit = perf_counter()
+
+        async def progress(batch):
+            nonlocal last_edit
+            # Without editing more than every 2 seconds
+            if perf_counter() - last_edit > 2 and batch.settled() < len(batch.events):
+                stat_embed.description = f'Settled {batch.settled()} of {len(batch.events)} events'
+                await timed('edit', message.edit(embed=stat_embed))
+                last_edit = perf_counter()
+
+        try:
+            await timed('fetch', batch.run(progress))
+        except (LichessError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # Without the team's current tournaments nothing can be created safely
+            stat_embed.description = f'Could not read the team\'s tournaments from lichess.org, nothing was created ({e})'
+            await timed('edit', message.edit(embed=stat_embed))
+            return
+
+        with stage('build'):
+            path = 'tournament' if recurrence.kind == 'arena' else 'swiss'
+            lines = []
+            for starts_at in batch.events:
+                when = f'{datetime.datetime.fromtimestamp(starts_at / 1000):%a %Y-%m-%d %H:%M}'
+                if starts_at in batch.created:
+                    lines.append(f'✅ {when} [{batch.created[starts_at]}](https://lichess.org/{path}/'
+                                 f'{batch.created[starts_at]})')
+                elif starts_at in batch.skipped:
+                    lines.append(f'☑️ {when} [{batch.skipped[starts_at]}](https://lichess.org/{path}/'
+                                 f'{batch.skipped[starts_at]}) already scheduled')
+                else:
+                    lines.append(f'❌ {when} {batch.failed.get(starts_at, ("Not created", False))[0]}')
+
+            stat_embed.title = f'Scheduled {name}'
+            # Descriptions hold at most 4096 characters
+            description = '\n'.join(lines)
+            stat_embed.description = description if len(description) <= 4096 else description[:4090] + '\n…'
+            stat_embed.add_field(name='Created', value=len(batch.created))
+            stat_embed.add_field(name='Already scheduled', value=len(batch.skipped))
+            stat_embed.add_field(name='Failed', value=len(batch.events) - len(batch.created) - len(batch.skipped))
+            response_time = perf_counter() - start
+            retry = 'Run the same command again to retry the failed events | ' if batch.failed else ''
+            stat_embed.set_footer(text="{retry}Response time: {time:.3} seconds".format(retry=retry,
+                                                                                       time=response_time))
+
+        await timed('edit', message.edit(embed=stat_embed))
 
     @commands.command()
     async def listats(self, ctx, username):
@@ -82,10 +224,22 @@ class LichessCog(commands.Cog):
                               url=f'https://lichess.org/@/{username}')
 
         # Send temporary Loading message
-        loading = await ctx.send(embed=stat_embed)
+        loading = await timed('send', ctx.send(embed=stat_embed))
 
         # Retrieve User Profile
-        profile = lichess.users.get_public_data(username)
+        try:
+            profile = await timed('fetch', self.get_profile(username))
+        except User404Exception as e:  # If username does not exist
+            stat_embed.title = "Error 404"
+            stat_embed.description = str(e)
+            response_time = perf_counter() - start
+            stat_embed.set_footer(text="Response time: {time:.3} seconds".format(time=response_time))
+            await timed('edit', loading.edit(embed=stat_embed))
+            print("{outcome:<12} {site:>12} {user:^24}  Response time = {time:1.3}".format(outcome='Error 404',
+                                                                                           site='lichess',
+                                                                                           user=username,
+                                                                                           time=response_time))
+            return
 
         # Get case-sensitive username
         username = profile['username']
@@ -93,23 +247,17 @@ class LichessCog(commands.Cog):
         # Get ratings
         gameModes = profile['perfs']
 
-        # storm does not have a rating field so is removed
-        for gameMode in list(gameModes.keys()):
-            # Change camelCase to Space Separated
-            mode = ''
-            for l in gameMode:
-                if l.isupper():
-                    mode += ' '
-                mode += l
-            mode = mode[0].upper() + mode[1:]
-            # Storm and Racer do not have rating fields, using score value in place
-            if mode != "Storm" and mode != "Racer":
-                # Generate field using proper mode name and corresponding rating
-                rating = gameModes[gameMode]['rating']
-                stat_embed.add_field(name=mode, value=rating)
-            else:
-                score = gameModes[gameMode]['score']
-                stat_embed.add_field(name=mode, value=score)
+        with stage('build'):
+            for gameMode in list(gameModes.keys()):
+                mode = mode_name(gameMode)
+                # Storm and Racer do not have rating fields, using score value in place
+                if mode != "Storm" and mode != "Racer":
+                    # Generate field using proper mode name and corresponding rating
+                    rating = gameModes[gameMode]['rating']
+                    stat_embed.add_field(name=mode, value=rating)
+                else:
+                    score = gameModes[gameMode]['score']
+                    stat_embed.add_field(name=mode, value=score)
 
         # Update embed
         stat_embed.title = f"Stats for {username}"
@@ -117,8 +265,8 @@ class LichessCog(commands.Cog):
         stat_embed.set_footer(text="Response time: {time:.3} seconds".format(time=response_time))
 
         # Replace embed
-        await loading.delete()
-        await ctx.send(embed=stat_embed)
+        await timed('delete', loading.delete())
+        await timed('send', ctx.send(embed=stat_embed))
         print(
             "{outcome:<12} {site:>12} {user:^24}  Response time = {time:1.3}".format(outcome='Success', site='lichess',
                                                                                      user=username, time=response_time))
@@ -126,30 +274,12 @@ class LichessCog(commands.Cog):
     @commands.command(aliases=['standings'])
     async def arena_standings(self, ctx):
         """
-        :note: embed field value can hold a maximum of 1024 characters
+        :note: standings are shown 20 per page (embed fields hold at most 1024 characters), flipped with reactions
         :return: embed Discord message
         """
         # Start timer
         start = perf_counter()
 
-        # Get tournament name
-        recent_name = lichess.tournaments.arenas_by_team('niner-chess-club', 1)[0]['fullName']
-
-        # Get tournament id
-        recent_id = lichess.tournaments.arenas_by_team('niner-chess-club', 1)[0]['id']
-
-        # Get tournament results information
-        standings = lichess.tournaments.stream_results(recent_id)
-        string_score = ''
-        string_usernames = ''
-        string_ranks = ''
-
-        # Get rankings, usernames, and scores for all users
-        for value in standings:
-            string_usernames += f'{value["username"]}\n'
-            string_ranks += f'{value["rank"]}\n'
-            string_score += f'{value["score"]}\n'
-
         # Make Loading Embed
         stat_embed = discord.Embed(
             description='Retrieving data from lichess.org',
@@ -157,37 +287,301 @@ class LichessCog(commands.Cog):
         )
 
         # Send loading message
-        loading = await ctx.send(embed=stat_embed)
+        loading = await timed('send', ctx.send(embed=stat_embed))
+
+        # Get the most recent tournament's name and id
+        arenas = await timed('fetch', lichess.arenas_by_team('niner-chess-club', 1))
+        if not arenas:
+            stat_embed.description = 'The club has not played any arenas yet'
+            await timed('edit', loading.edit(embed=stat_embed))
+            return
+        recent_name = arenas[0]['fullName']
+        recent_id = arenas[0]['id']
+
+        # Standings are streamed a page at a time, later pages only when someone flips to them
+        rows = LazyRows(lambda limit: lichess.stream_results(recent_id, limit))
+        response_time = None
+
+        def render(page, number, has_next):
+            page_embed = discord.Embed(
+                color=discord.Color.dark_blue(),
+                title=f'Standings for {recent_name}'
+            )
+            page_embed.set_author(name='lichess.org',
+                                  icon_url='https://lichess1.org/assets/_QubGrC/logo/lichess-favicon-256.png',
+                                  url=f'https://lichess.org/tournament/{recent_id}')
+
+            if not page:
+                page_embed.description = 'Nobody has played in this tournament yet'
+                return page_embed
+            page_embed.add_field(name='Rank', value='\n'.join(str(value['rank']) for value in page), inline=True)
+            page_embed.add_field(name='Username', value='\n'.join(value['username'] for value in page), inline=True)
+            page_embed.add_field(name='Score', value='\n'.join(str(value['score']) for value in page), inline=True)
+
+            footer = f'Page {number + 1}' + (', react for the next page' if has_next else '')
+            if number == 0:
+                # Get response time, of the first time the page was shown
+                nonlocal response_time
+                response_time = response_time or perf_counter() - start
+                footer += " | Response time: {time:.3} seconds".format(time=response_time)
+            page_embed.set_footer(text=footer)
+            return page_embed
+
+        paginator = Paginator(self.bot, rows, render)
+        with stage('fetch'):
+            stat_embed, _ = await paginator.render_page(0)
+
+        # Replace embed with the first page
+        await timed('edit', loading.edit(embed=stat_embed))
+
+        # Flip pages in the background so the command itself finishes now
+        self.bot.loop.create_task(paginator.navigate(loading, ctx.author.id))
+
+    @commands.command()
+    async def track(self, ctx, tournament_id):
+        """
+        :note: Example command usage: #track aBcD1234 - works for arenas and swiss tournaments
+        :param ctx: command
+        :param string tournament_id: lichess tournament id, from the end of the tournament's URL
+        :return: pinned embed Discord message with the live top standings, edited as they change
+        """
+        key = (ctx.channel.id, tournament_id)
+        if key in self.trackers:
+            tracker, task = self.trackers[key]
+            await timed('send', ctx.send(f'Already tracking {tournament_id} here: {tracker.message.jump_url}'))
+            return
+        # Every tracker polls lichess through the shared limiter, keep them from crowding out other commands
+        if len(self.trackers) >= config.TRACK_MAX:
+            await timed('send', ctx.send(f'Already tracking {len(self.trackers)} tournaments, '
+                                         f'#untrack one before tracking another'))
+            return
+        if sum(channel == ctx.channel.id for channel, _ in self.trackers) >= config.TRACK_MAX_PER_CHANNEL:
+            await timed('send', ctx.send(f'This channel already tracks {config.TRACK_MAX_PER_CHANNEL} tournaments, '
+                                         f'#untrack one before tracking another'))
+            return
 
         stat_embed = discord.Embed(
             description='Retrieving data from lichess.org',
-            color=discord.Color.dark_blue(),
-            title=f'Standings for {recent_name}'
+            color=discord.Color.dark_blue()
         )
+        message = await timed('send', ctx.send(embed=stat_embed))
+
+        # Ids of arenas and swiss tournaments don't overlap, try arenas first
+        kind = None
+        for candidate, lookup in (('arena', lichess.get_tournament), ('swiss', lichess.get_swiss)):
+            try:
+                await timed('fetch', lookup(tournament_id))
+            except LichessError as e:
+                if e.status != 404:
+                    raise
+                continue
+            kind = candidate
+            break
+
+        if kind is None:
+            stat_embed.title = "Error 404"
+            stat_embed.description = f"Tournament '{tournament_id}' does not exist"
+            await timed('edit', message.edit(embed=stat_embed))
+            return
+
+        try:
+            await timed('pin', message.pin())
+        except discord.HTTPException:  # Needs Manage Messages, the tracker works unpinned too
+            pass
+
+        tracker = TournamentTracker(tournament_id, kind, message, self.edit_throttle,
+                                    poll_interval=config.TRACK_POLL_INTERVAL, info_every=config.TRACK_INFO_EVERY)
+        task = self.bot.loop.create_task(tracker.run())
+        self.trackers[key] = (tracker, task)
+        task.add_done_callback(lambda done: self.tracking_done(key, tracker, done))
+
+    def tracking_done(self, key, tracker, task):
+        if self.trackers.get(key, (None, None))[1] is task:
+            del self.trackers[key]
+        # Channels hold at most 50 pins, don't leave finished trackers behind
+        self.bot.loop.create_task(self.unpin(tracker.message))
+        if not task.cancelled() and task.exception() is not None:
+            error = task.exception()
+            print(f'Tracking {key[1]} stopped:', file=sys.stderr)
+            traceback.print_exception(type(error), error, error.__traceback__, file=sys.stderr)
+
+    @staticmethod
+    async def unpin(message):
+        try:
+            await message.unpin()
+        except discord.HTTPException:  # Never pinned (missing Manage Messages) or already deleted
+            pass
 
-        stat_embed.set_author(name='lichess.org',
-                              icon_url='https://lichess1.org/assets/_QubGrC/logo/lichess-favicon-256.png',
-                              url=f'https://lichess.org/tournament/{recent_id}')
-
-        stat_embed.add_field(name='Rank', value=string_ranks, inline=True)
-        stat_embed.add_field(name='Username', value=string_usernames, inline=True)
-        stat_embed.add_field(name='Score', value=string_score, inline=True)
+    @commands.command()
+    async def untrack(self, ctx, tournament_id):
+        """
+        :param ctx: command
+        :param string tournament_id: tournament followed with #track in this channel
+        :return: Discord message confirming tracking stopped
+        """
+        entry = self.trackers.pop((ctx.channel.id, tournament_id), None)
+        if entry is None:
+            await timed('send', ctx.send(f'{tournament_id} is not being tracked in this channel'))
+            return
+        tracker, task = entry
+        task.cancel()
+        await timed('send', ctx.send(f'Stopped tracking {tournament_id} after {tracker.edits} updates'))
 
-        # Get response time
-        response_time = perf_counter() - start
-        stat_embed.set_footer(text="Response time: {time:.3} seconds".format(time=response_time))
+    @commands.command()
+    async def online(self, ctx):
+        """
+        :note: answered from the presence index refreshed in the background, 20 members per page
+        :param ctx: command
+        :return: embed Discord message
+        """
+        start = perf_counter()
 
-        # Replace embed
-        await loading.delete()
+        # Started with the bot in the primary process, on first use elsewhere
+        presence.start()
+        if not presence.ready.is_set():
+            stat_embed = discord.Embed(
+                description='Retrieving data from lichess.org',
+                color=discord.Color.dark_blue()
+            )
+            loading = await timed('send', ctx.send(embed=stat_embed))
+            try:
+                await timed('fetch', asyncio.wait_for(presence.ready.wait(), 15))
+            except asyncio.TimeoutError:
+                stat_embed.description = 'Lichess is not answering right now, please try again in a minute'
+                await timed('edit', loading.edit(embed=stat_embed))
+                return
+        else:
+            loading = None
+
+        with stage('build'):
+            members = presence.online()
+            age = presence.age
+
+        def render(page, number, has_next):
+            page_embed = discord.Embed(
+                title="Currently Online Members",
+                color=discord.Color.dark_blue()
+            )
+            page_embed.set_author(name='lichess.org',
+                                  icon_url='https://lichess1.org/assets/_QubGrC/logo/lichess-favicon-256.png',
+                                  url=f'https://lichess.org/team/niner-chess-club')
+            if page:
+                # Crossed swords for members in a game
+                page_embed.add_field(name="Online", inline=True,
+                                     value='\n'.join(name + (' ⚔' if playing else '') for name, playing in page))
+            else:
+                page_embed.description = 'Nobody is online right now'
+
+            footer = f'{len(members)} online | Updated {age:.0f} seconds ago'
+            if has_next or number:
+                footer = f'Page {number + 1} | ' + footer
+            if number == 0:
+                footer += " | Response time: {time:.3} seconds".format(time=perf_counter() - start)
+            page_embed.set_footer(text=footer)
+            return page_embed
+
+        paginator = Paginator(self.bot, StaticRows(members), render)
+        stat_embed, _ = await paginator.render_page(0)
+        if loading is None:
+            message = await timed('send', ctx.send(embed=stat_embed))
+        else:
+            message = loading
+            await timed('edit', loading.edit(embed=stat_embed))
+        self.bot.loop.create_task(paginator.navigate(message, ctx.author.id))
+
+    @commands.command(aliases=['lb'])
+    async def leaderboard(self, ctx, *, perf='blitz'):
+        """
+        :note: Example command usage: #leaderboard rapid or #lb ultra bullet - 20 members per page
+        :param ctx: command
+        :param string perf: any game mode #listats shows, blitz by default
+        :return: embed Discord message ranking club members, answered from the background rating index
+        """
+        start = perf_counter()
 
-        # Send final embed message
-        await ctx.send(embed=stat_embed)
+        # Started with the bot in the primary process, on first use elsewhere
+        ratings.start()
+        loading = None
+        if not ratings.ready.is_set():
+            stat_embed = discord.Embed(
+                description='Retrieving data from lichess.org',
+                color=discord.Color.dark_blue()
+            )
+            loading = await timed('send', ctx.send(embed=stat_embed))
+            try:
+                await timed('fetch', asyncio.wait_for(ratings.ready.wait(), 30))
+            except asyncio.TimeoutError:
+                stat_embed.description = 'Lichess is not answering right now, please try again in a minute'
+                await timed('edit', loading.edit(embed=stat_embed))
+                return
+
+        # Accept the display name in any case, e.g. "ultra bullet" for ultraBullet
+        perfs = {perf_key.lower(): perf_key for perf_key in ratings.perfs()}
+        perf_key = perfs.get(perf.replace(' ', '').lower())
+        if perf_key is None:
+            message = "Unknown game mode '{}', try one of: {}".format(
+                perf, ', '.join(mode_name(perf_key) for perf_key in perfs.values()))
+            if loading is not None:
+                await timed('delete', loading.delete())
+            await timed('send', ctx.send(message))
+            return
+
+        # Only the rows of pages someone looks at are built
+        rows = LazyRows(lambda limit: self.leaderboard_rows(perf_key, limit))
+
+        def render(page, number, has_next):
+            page_embed = discord.Embed(
+                title=f'Club leaderboard: {mode_name(perf_key)}',
+                color=discord.Color.dark_blue()
+            )
+            page_embed.set_author(name='lichess.org',
+                                  icon_url='https://lichess1.org/assets/_QubGrC/logo/lichess-favicon-256.png',
+                                  url=f'https://lichess.org/team/niner-chess-club')
+            first = number * 20 + 1
+            page_embed.add_field(name='Rank', value='\n'.join(str(rank) for rank in range(first, first + len(page))),
+                                 inline=True)
+            page_embed.add_field(name='Username', value='\n'.join(name for name, _, _ in page), inline=True)
+            # Provisional ratings get a question mark like on lichess
+            page_embed.add_field(name='Rating' if perf_key not in ('storm', 'racer') else 'Score', inline=True,
+                                 value='\n'.join(f"{rating}{'?' if provisional else ''}"
+                                                  for _, rating, provisional in page))
+
+            footer = f'Updated {ratings.age / 60:.0f} minutes ago'
+            if has_next or number:
+                footer = f'Page {number + 1} | ' + footer
+            if number == 0:
+                footer += " | Response time: {time:.3} seconds".format(time=perf_counter() - start)
+            page_embed.set_footer(text=footer)
+            return page_embed
+
+        paginator = Paginator(self.bot, rows, render)
+        with stage('build'):
+            stat_embed, _ = await paginator.render_page(0)
+        if loading is None:
+            message = await timed('send', ctx.send(embed=stat_embed))
+        else:
+            message = loading
+            await timed('edit', loading.edit(embed=stat_embed))
+        self.bot.loop.create_task(paginator.navigate(message, ctx.author.id))
+
+    @staticmethod
+    async def leaderboard_rows(perf_key, limit):
+        for row in ratings.top(perf_key, limit):
+            yield row
+
+    # Helper function to retrieve the all-time crosstable of two users through the shared cache
+    async def get_pair(self, user1, user2):
+        # Same entry whichever way round the pair is asked for
+        first, second = sorted((user1.lower(), user2.lower()))
+        return await profile_cache.get('crosstable', f'{first}/{second}',
+                                       lambda: lichess.get_crosstable(first, second))
 
-    @commands.command()
-    async def online(self, ctx):
+    @commands.command(aliases=['flex'])
+    async def get_crosstable(self, ctx, user1, user2):
         """
-        :note: embed field value can hold a maximum of 1024 characters
         :param ctx: command
+        :param string user1: first user
+        :param string user2: second user
         :return: embed Discord message
         """
         start = perf_counter()
@@ -200,34 +594,28 @@ class LichessCog(commands.Cog):
                               icon_url='https://lichess1.org/assets/_QubGrC/logo/lichess-favicon-256.png',
                               url=f'https://lichess.org/team/niner-chess-club')
 
-        # Send temporary Loading message
-        loading = await ctx.send(embed=stat_embed)
-
-        # Get all members from club
-        niners = lichess.teams.get_members('niner-chess-club')
-        online_members = ''
+        loading = await timed('send', ctx.send(embed=stat_embed))
 
-        # Iterate through each member and determine if online
-        for members in niners:
-            if members['online']:
-                online_members += f'{members["username"]}\n'
+        # Get crosstable from lichess, or from the cache when the pair was looked up recently
+        crosstable = await timed('fetch', self.get_pair(user1, user2))
 
-        stat_embed.add_field(name="Online", value=online_members, inline=True)
-        stat_embed.title = "Currently Online Members"
+        # Crosstable scores are keyed by lowercase user id
+        stat_embed.add_field(name=user1.capitalize(), value=crosstable['users'][user1.lower()], inline=True)
+        stat_embed.add_field(name=user2.capitalize(), value=crosstable['users'][user2.lower()], inline=True)
+        stat_embed.title = "Head to head match up"
         response_time = perf_counter() - start
         stat_embed.set_footer(text="Response time: {time:.3} seconds".format(time=response_time))
 
-        # Replace embed
-        await loading.delete()
-        await ctx.send(embed=stat_embed)
+        await timed('delete', loading.delete())
+        await timed('send', ctx.send(embed=stat_embed))
 
-    @commands.command(aliases=['flex'])
-    async def get_crosstable(self, ctx, user1, user2):
+    @commands.command()
+    async def matrix(self, ctx, *usernames):
         """
+        :note: Example command usage: #matrix DrNykterstein penguingim1 - without names, the club's top blitz players
         :param ctx: command
-        :param string user1: first user
-        :param string user2: second user
-        :return: embed Discord message
+        :param usernames: up to 10 lichess usernames
+        :return: embed Discord message with every player's all-time score against every other player
         """
         start = perf_counter()
 
@@ -238,20 +626,121 @@ class LichessCog(commands.Cog):
         stat_embed.set_author(name='lichess.org',
                               icon_url='https://lichess1.org/assets/_QubGrC/logo/lichess-favicon-256.png',
                               url=f'https://lichess.org/team/niner-chess-club')
+        loading = await timed('send', ctx.send(embed=stat_embed))
+
+        if not usernames:
+            ratings.start()
+            try:
+                await timed('fetch', asyncio.wait_for(ratings.ready.wait(), 30))
+            except asyncio.TimeoutError:
+                stat_embed.description = 'Lichess is not answering right now, please try again in a minute'
+                await timed('edit', loading.edit(embed=stat_embed))
+                return
+            usernames = [name for name, _, _ in ratings.top('blitz', MATRIX_DEFAULT)]
+
+        # Case-insensitive duplicates only count once, a 10x10 table is the most that stays readable
+        players = []
+        for username in usernames:
+            if username.lower() not in [player.lower() for player in players]:
+                players.append(username)
+        players = players[:MATRIX_MAX]
+        if len(players) < 2:
+            stat_embed.description = 'A matrix needs at least two players'
+            await timed('edit', loading.edit(embed=stat_embed))
+            return
+
+        semaphore = asyncio.Semaphore(config.MATRIX_CONCURRENCY)
+
+        async def fetch(i, j):
+            async with semaphore:
+                try:
+                    return i, j, await self.get_pair(players[i], players[j])
+                except (LichessError, aiohttp.ClientError, asyncio.TimeoutError):
+                    # Shown as unknown, the rest of the matrix is still worth having
+                    return i, j, None
+
+        pairs = [(i, j) for i in range(len(players)) for j in range(i + 1, len(players))]
+        crosstables = {}
+        last_edit = perf_counter()
+        with stage('fetch'):
+            for done in asyncio.as_completed([fetch(i, j) for i, j in pairs]):
+                i, j, crosstable = await done
+                crosstables[(i, j)] = crosstable
+                # Show progress on big uncached matrices, without editing more than every 2 seconds
+                if perf_counter() - last_edit > 2 and len(crosstables) < len(pairs):
+                    stat_embed.description = f'Retrieved {len(crosstables)} of {len(pairs)} pairs from lichess.org'
+                    await timed('edit', loading.edit(embed=stat_embed))
+                    last_edit = perf_counter()
+
+        with stage('build'):
+            width = min(14, max(len(player) for player in players))
+            lines = [' ' * (width + 3) + ''.join(f'{j + 1:>6}' for j in range(len(players))) + '  Total']
+            for i, player in enumerate(players):
+                cells = []
+                total = 0
+                for j, opponent in enumerate(players):
+                    if i == j:
+                        cells.append('·')
+                        continue
+                    crosstable = crosstables[(min(i, j), max(i, j))]
+                    if crosstable is None:
+                        cells.append('?')
+                    elif not crosstable.get('nbGames'):
+                        cells.append('-')
+                    else:
+                        score = crosstable['users'].get(player.lower(), 0)
+                        total += score
+                        cells.append(f'{score:g}')
+                lines.append(f'{i + 1:>2} {player[:width]:<{width}}' + ''.join(f'{cell:>6}' for cell in cells) +
+                             f'{total:>7g}')
+
+            stat_embed.title = 'Head to head matrix'
+            stat_embed.description = '```\n' + '\n'.join(lines) + '\n```'
+            response_time = perf_counter() - start
+            stat_embed.set_footer(text="All-time score of each row's player, - no games, ? unavailable | "
+                                       "Response time: {time:.3} seconds".format(time=response_time))
+
+        await timed('edit', loading.edit(embed=stat_embed))
 
-        loading = await ctx.send(embed=stat_embed)
-
-        # Get crosstable from lichess
-        crosstable = lichess.users.get_crosstable(user1=user1, user2=user2, matchup=True)
-
-        stat_embed.add_field(name=user1.capitalize(), value=crosstable['users'][user1], inline=True)
-        stat_embed.add_field(name=user2.capitalize(), value=crosstable['users'][user2], inline=True)
-        stat_embed.title = "Head to head match up"
-        response_time = perf_counter() - start
-        stat_embed.set_footer(text="Response time: {time:.3} seconds".format(time=response_time))
+    @commands.command()
+    async def clubstats(self, ctx, username=None):
+        """
+        :note: Example command usage: #clubstats or #clubstats DrNykterstein for one member
+        :param ctx: command
+        :param string username: optional club member, the whole club by default
+        :return: embed Discord message with results by color, time control and opening, from stored aggregates
+        """
+        start = perf_counter()
 
-        await loading.delete()
-        await ctx.send(embed=stat_embed)
+        # The primary process keeps the aggregates up to date, the others read what it saved
+        if game_stats.task is None:
+            game_stats.load()
+        if not game_stats.ready.is_set():
+            await timed('send', ctx.send('Club game stats are still being collected, please try again later'))
+            return
+        stats = game_stats.stats(username)
+        if stats is None:
+            await timed('send', ctx.send(f'{username} is not a member of the club'))
+            return
+
+        with stage('build'):
+            stat_embed = discord.Embed(
+                title='Club game stats' if username is None else f'Game stats for {username}',
+                description='Wins / draws / losses (score)',
+                color=discord.Color.dark_blue()
+            )
+            stat_embed.set_author(name='lichess.org',
+                                  icon_url='https://lichess1.org/assets/_QubGrC/logo/lichess-favicon-256.png',
+                                  url=f'https://lichess.org/team/niner-chess-club')
+            add_fields(stat_embed, stats, speed_name=mode_name)
+
+            updated = datetime.datetime.utcfromtimestamp(game_stats.loaded_mtime)
+            response_time = perf_counter() - start
+            stat_embed.set_footer(text="{games} games, updated {updated:%Y-%m-%d %H:%M} UTC | "
+                                       "Response time: {time:.3} seconds".format(games=total_games(stats),
+                                                                                 updated=updated, time=response_time))
+
+        await timed('send', ctx.send(embed=stat_embed))
 
 
 def setup(bot):
@@ -7,5 +7,106 @@ import os
 
 DISCORD_TOKEN = os.environ["DISCORD_TOKEN"]
 ADMIN_LICHESS_TOKEN = os.environ["ADMIN_LICHESS_TOKEN"]
-FIREFOX_BINARY = os.environ["FIREFOX_BIN"]
-GECKDRIVER_PATH = os.environ["GECKODRIVER_PATH"]
+FIREFOX_BINARY = os.environ.get("FIREFOX_BIN")
+GECKDRIVER_PATH = os.environ.get("GECKODRIVER_PATH")
+
+# Chess.com profile backend: "json" (public API) or "selenium" (scrapes the profile page with Firefox)
+# Set CHESSCOM_FALLBACK to an empty string to disable falling back to the scraper when the API errors
+CHESSCOM_BACKEND = os.environ.get("CHESSCOM_BACKEND", "json")
+CHESSCOM_FALLBACK = os.environ.get("CHESSCOM_FALLBACK", "selenium")
+# Chess.com hosts, overridable to point the bot at a local stub server
+CHESSCOM_API_URL = os.environ.get("CHESSCOM_API_URL", "https://api.chess.com/pub")
+CHESSCOM_WEB_URL = os.environ.get("CHESSCOM_WEB_URL", "https://www.chess.com")
+
+# Headless Firefox pool used by the selenium backend (workers defaults to the number of cores)
+SELENIUM_WORKERS = int(os.environ.get("SELENIUM_WORKERS", 0)) or None
+SELENIUM_MAX_PAGES = int(os.environ.get("SELENIUM_MAX_PAGES", 50))
+SELENIUM_ACQUIRE_TIMEOUT = float(os.environ.get("SELENIUM_ACQUIRE_TIMEOUT", 30))
+# Eager page loads, no images/fonts/css/trackers and single-script extraction; set to 0 for the classic scraper
+SELENIUM_FAST = os.environ.get("SELENIUM_FAST", "1") != "0"
+
+# Maximum number of chess.com profiles fetched at once by #compare
+COMPARE_CONCURRENCY = int(os.environ.get("COMPARE_CONCURRENCY", 5))
+# Maximum number of lichess crosstables fetched at once by #matrix
+MATRIX_CONCURRENCY = int(os.environ.get("MATRIX_CONCURRENCY", 6))
+
+# Shared profile cache: seconds a profile stays fresh per site, how long it may be served stale while it
+# refreshes in the background, how long unknown users are remembered, and the total size budget in bytes
+CACHE_TTL_CHESSCOM = float(os.environ.get("CACHE_TTL_CHESSCOM", 300))
+CACHE_TTL_LICHESS = float(os.environ.get("CACHE_TTL_LICHESS", 120))
+# Head to head results of a pair of lichess users (#flex, #matrix)
+CACHE_TTL_CROSSTABLE = float(os.environ.get("CACHE_TTL_CROSSTABLE", 1800))
+CACHE_STALE_TTL = float(os.environ.get("CACHE_STALE_TTL", 600))
+CACHE_NEGATIVE_TTL = float(os.environ.get("CACHE_NEGATIVE_TTL", 60))
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", 4 * 1024 * 1024))
+
+# Lichess host, overridable to point the bot at a local fake server
+LICHESS_URL = os.environ.get("LICHESS_URL", "https://lichess.org")
+
+# Upstream pacing: sustained requests per second and burst size per host
+LICHESS_RATE = float(os.environ.get("LICHESS_RATE", 4))
+LICHESS_BURST = int(os.environ.get("LICHESS_BURST", 8))
+CHESSCOM_RATE = float(os.environ.get("CHESSCOM_RATE", 5))
+CHESSCOM_BURST = int(os.environ.get("CHESSCOM_BURST", 10))
+
+# Command latency metrics are also written here in the Prometheus text format, every interval seconds
+PERF_METRICS_PATH = os.environ.get("PERF_METRICS_PATH", "metrics.prom")
+PERF_METRICS_INTERVAL = float(os.environ.get("PERF_METRICS_INTERVAL", 30))
+
+# Commands running at once overall and per server, commands allowed to wait per server and overall
+COMMAND_SLOTS = int(os.environ.get("COMMAND_SLOTS", 8))
+COMMAND_GUILD_SLOTS = int(os.environ.get("COMMAND_GUILD_SLOTS", 3))
+COMMAND_GUILD_QUEUE = int(os.environ.get("COMMAND_GUILD_QUEUE", 10))
+COMMAND_QUEUE_SIZE = int(os.environ.get("COMMAND_QUEUE_SIZE", 100))
+# Threads for blocking work (parsing, file writes), browsers have their own SELENIUM_WORKERS
+BLOCKING_WORKERS = int(os.environ.get("BLOCKING_WORKERS", 4))
+
+# Lean gateway mode: only the guild/message/reaction intents, no member cache and no guild chunking
+LEAN_GATEWAY = os.environ.get("LEAN_GATEWAY", "1") != "0"
+# Messages kept in discord.py's message cache (default 1000)
+MAX_MESSAGES = int(os.environ.get("MAX_MESSAGES", 200))
+
+# Set by launcher.py when shards are split across processes; SHARD_IDS is comma separated
+SHARD_COUNT = int(os.environ.get("SHARD_COUNT", 0)) or None
+SHARD_IDS = [int(shard) for shard in os.environ.get("SHARD_IDS", "").split(",") if shard] or None
+# Only the primary process runs club-wide background jobs, so they don't run once per shard process
+PRIMARY_PROCESS = os.environ.get("PRIMARY_PROCESS", "1") != "0"
+
+# #track polls a tournament's standings every poll interval, edits are spaced at least edit interval apart per channel
+TRACK_POLL_INTERVAL = float(os.environ.get("TRACK_POLL_INTERVAL", 5))
+TRACK_EDIT_INTERVAL = float(os.environ.get("TRACK_EDIT_INTERVAL", 10))
+# Tournament info (status, clock) is only refetched every info polls, standings are fetched on every poll
+TRACK_INFO_EVERY = int(os.environ.get("TRACK_INFO_EVERY", 6))
+# Share of the lichess limiter all trackers together may use, the rest stays for commands and background jobs.
+# A tracker makes 1 + 1 / TRACK_INFO_EVERY requests per poll, the overall cap is derived from that budget:
+# 4 requests/s * 0.5 / ((1 + 1 / 6) / 5 s) = 8 trackers at the defaults
+TRACK_BUDGET = float(os.environ.get("TRACK_BUDGET", 0.5))
+TRACK_MAX = int(os.environ.get("TRACK_MAX", 0)) or max(1, int(LICHESS_RATE * TRACK_BUDGET * TRACK_POLL_INTERVAL
+                                                               / (1 + 1 / TRACK_INFO_EVERY)))
+# Tournaments tracked at once per channel
+TRACK_MAX_PER_CHANNEL = int(os.environ.get("TRACK_MAX_PER_CHANNEL", 2))
+
+# #schedule creates at most this many events per command, a few at a time, retrying temporary failures
+SCHEDULE_MAX_EVENTS = int(os.environ.get("SCHEDULE_MAX_EVENTS", 52))
+SCHEDULE_CONCURRENCY = int(os.environ.get("SCHEDULE_CONCURRENCY", 4))
+SCHEDULE_RETRIES = int(os.environ.get("SCHEDULE_RETRIES", 3))
+
+# The club roster is refetched at most this often, members' online status is refreshed every presence interval
+ROSTER_REFRESH_INTERVAL = float(os.environ.get("ROSTER_REFRESH_INTERVAL", 3600))
+PRESENCE_REFRESH_INTERVAL = float(os.environ.get("PRESENCE_REFRESH_INTERVAL", 60))
+# Members' ratings for #leaderboard are refetched in bulk this often
+LEADERBOARD_REFRESH_INTERVAL = float(os.environ.get("LEADERBOARD_REFRESH_INTERVAL", 900))
+
+# Rating snapshots are kept in this SQLite database, buffered writes go out every flush interval
+HISTORY_DB_PATH = os.environ.get("HISTORY_DB_PATH", "ratings.db")
+HISTORY_FLUSH_INTERVAL = float(os.environ.get("HISTORY_FLUSH_INTERVAL", 5))
+# Chess.com members to snapshot every interval (comma separated), lichess members are snapshot with the leaderboard
+HISTORY_CHESSCOM_MEMBERS = [user for user in os.environ.get("HISTORY_CHESSCOM_MEMBERS", "").split(",") if user]
+HISTORY_SNAPSHOT_INTERVAL = float(os.environ.get("HISTORY_SNAPSHOT_INTERVAL", 3600))
+
+# #clubstats aggregates of every member's lichess games, refreshed from each member's checkpoint this often
+CLUBSTATS_PATH = os.environ.get("CLUBSTATS_PATH", "clubstats.json")
+CLUBSTATS_REFRESH_INTERVAL = float(os.environ.get("CLUBSTATS_REFRESH_INTERVAL", 6 * 3600))
+
+# #archive keeps downloaded chess.com monthly game archives (gzip compressed) under this directory
+CHESSCOM_ARCHIVE_DIR = os.environ.get("CHESSCOM_ARCHIVE_DIR", "archives")
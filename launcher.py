@@ -0,0 +1,111 @@
+"""
+Runs the bot as several processes, each an AutoShardedBot handling a slice of the shards
+
+Usage: python launcher.py [--processes 2] [--shards N] [--report 300]
+The shard count defaults to Discord's recommendation for the bot. Every process gets its own PERF_METRICS_PATH
+and only the first one runs club-wide background jobs (PRIMARY_PROCESS).
+"""
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+from time import monotonic
+
+import aiohttp
+
+import config
+from utils.memory import rss_mb
+
+DISCORD_API = 'https://discord.com/api/v8'
+# Longest wait before restarting a process that keeps crashing, in seconds
+RESTART_MAX_DELAY = 300
+
+
+async def recommended_shards():
+    headers = {'Authorization': f'Bot {config.DISCORD_TOKEN}'}
+    async with aiohttp.ClientSession(headers=headers) as session:
+        async with session.get(f'{DISCORD_API}/gateway/bot') as response:
+            response.raise_for_status()
+            return (await response.json())['shards']
+
+
+def split_shards(shard_count, processes):
+    """
+    :return: list of shard id lists, one per process, shards dealt round robin
+    """
+    processes = max(1, min(processes, shard_count))
+    return [list(range(shard_count))[i::processes] for i in range(processes)]
+
+
+def start(index, shard_ids, shard_count):
+    env = dict(os.environ)
+    env['SHARD_COUNT'] = str(shard_count)
+    env['SHARD_IDS'] = ','.join(map(str, shard_ids))
+    env['PRIMARY_PROCESS'] = '1' if index == 0 else '0'
+    metrics = os.path.splitext(config.PERF_METRICS_PATH)
+    env['PERF_METRICS_PATH'] = f'{metrics[0]}-{index}{metrics[1]}'
+    print(f'Starting process {index} with shards {shard_ids} of {shard_count}')
+    return subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')],
+                            env=env)
+
+
+async def supervise(args):
+    shard_count = args.shards or await recommended_shards()
+    slices = split_shards(shard_count, args.processes or os.cpu_count() or 1)
+    children = [start(i, shard_ids, shard_count) for i, shard_ids in enumerate(slices)]
+    started = [monotonic()] * len(children)
+    failures = [0] * len(children)  # Crashes in a row within a minute of starting, per process
+    restart_at = [None] * len(children)
+    stopping = False
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+        for child in children:
+            if child.poll() is None:
+                child.terminate()
+
+    # The dyno sends SIGTERM on shutdown, pass it on to every process
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    waited = 0
+    while True:
+        await asyncio.sleep(1)
+        waited += 1
+
+        # Restart a process that died on its own, keeping its shards. One that keeps dying right after starting
+        # (bad token, Discord outage) is restarted less and less often instead of hammering the gateway
+        for i, child in enumerate(children):
+            if stopping:
+                restart_at[i] = None
+                continue
+            if child.poll() in (None, 0, -signal.SIGTERM):
+                continue
+            if restart_at[i] is None:
+                failures[i] = failures[i] + 1 if monotonic() - started[i] < 60 else 0
+                delay = min(RESTART_MAX_DELAY, 5 * 2 ** failures[i]) if failures[i] else 0
+                restart_at[i] = monotonic() + delay
+                print(f'Process {i} exited with {child.returncode}, restarting in {delay} seconds')
+            if monotonic() >= restart_at[i]:
+                children[i] = start(i, slices[i], shard_count)
+                started[i] = monotonic()
+                restart_at[i] = None
+
+        if all(child.poll() is not None for child in children) and not any(restart_at):
+            break
+
+        if args.report and waited % args.report == 0:
+            for i, child in enumerate(children):
+                if child.poll() is None:
+                    print(f'Process {i} (pid {child.pid}, shards {slices[i]}): {rss_mb(child.pid):.1f} MB RSS')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=0, help='worker processes, defaults to the number of cores')
+    parser.add_argument('--shards', type=int, default=0, help="total shards, defaults to Discord's recommendation")
+    parser.add_argument('--report', type=int, default=300, help='seconds between memory reports, 0 to disable')
+    asyncio.get_event_loop().run_until_complete(supervise(parser.parse_args()))
@@ -1,37 +1,127 @@
+from time import perf_counter
+
+started = perf_counter()
+
 import config
 import discord
 from discord.ext import commands
 import os
+from utils import perf, scheduler
+from utils.errors import BusyException
+
+if config.LEAN_GATEWAY:
+    # No command needs the member list or presences, so don't have discord.py receive and cache them
+    intents = discord.Intents(messages=True, guilds=True, reactions=True)
+    options = {'member_cache_flags': discord.MemberCacheFlags.none(), 'chunk_guilds_at_startup': False}
+else:
+    intents = discord.Intents(messages=True, guilds=True, reactions=True, members=True, presences=True)
+    options = {}
+
+if config.SHARD_COUNT:
+    # Started by launcher.py with a slice of the shards
+    bot = commands.AutoShardedBot(command_prefix="#", intents=intents, max_messages=config.MAX_MESSAGES,
+                                  shard_count=config.SHARD_COUNT, shard_ids=config.SHARD_IDS, **options)
+else:
+    bot = commands.Bot(command_prefix="#", intents=intents, max_messages=config.MAX_MESSAGES, **options)
+
+# Every command waits for a slot from the fair scheduler, then is timed with its stages, see #perf and #queue
+async def before_invoke(ctx):
+    try:
+        await scheduler.before_invoke(ctx)
+        await perf.before_invoke(ctx)
+    except BaseException:
+        # discord.py skips the after hooks when a before hook fails, give the slot back if one was taken
+        await scheduler.after_invoke(ctx)
+        raise
+
+
+async def after_invoke(ctx):
+    await perf.after_invoke(ctx)
+    await scheduler.after_invoke(ctx)
+
+
+bot.before_invoke(before_invoke)
+bot.after_invoke(after_invoke)
+
+
+async def warm_up(cog):
+    try:
+        await cog.warm_up()
+    except Exception as e:  # The resource is retried on first use instead
+        print(f'Warm up of {type(cog).__name__} failed: {e!r}')
 
-intents = discord.Intents(messages=True, guilds=True, reactions=True, members=True, presences=True)
-bot = commands.Bot(command_prefix="#", intents=intents)
+
+def warm_up_cogs():
+    # Start heavy resources (browsers, HTTP sessions) in the background, commands wait on them if needed
+    for cog in bot.cogs.values():
+        if hasattr(cog, 'warm_up'):
+            bot.loop.create_task(warm_up(cog))
+
+
+def extension_cogs(name):
+    return [cog for cog in bot.cogs.values() if type(cog).__module__ == name]
+
+
+async def close_cogs(cogs):
+    # Unloading is synchronous, the cogs' sessions and browsers are closed here once they are out
+    for cog in cogs:
+        if hasattr(cog, 'close'):
+            try:
+                await cog.close()
+            except Exception as e:
+                print(f'Closing {type(cog).__name__} failed: {e!r}')
 
 
 @bot.event
 async def on_ready():
-    print('Successfully logged in and booted')
+    shards = f' (shards {bot.shard_ids} of {bot.shard_count})' if config.SHARD_COUNT else ''
+    print('Successfully logged in and booted{shards} in {time:.2f} seconds'.format(shards=shards,
+                                                                                 time=perf_counter() - started))
+    warm_up_cogs()
+
+
+@bot.event
+async def on_command_error(ctx, error):
+    perf.recorder.error(ctx.command.qualified_name if ctx.command else 'unknown', error)
+    if isinstance(error, BusyException):
+        await ctx.send(str(error))
+        return
+    # Fall through to discord.py's default handler, which prints unhandled errors
+    await commands.Bot.on_command_error(bot, ctx, error)
 
 
 @bot.command()
 async def load(ctx, extension):
     bot.load_extension(f'cogs.{extension}')
+    warm_up_cogs()
 
 
 @bot.command()
 async def unload(ctx, extension):
+    cogs = extension_cogs(f'cogs.{extension}')
     bot.unload_extension(f'cogs.{extension}')
+    await close_cogs(cogs)
 
 
 @bot.command()
 async def reload(ctx, extension):
+    cogs = extension_cogs(f'cogs.{extension}')
     bot.reload_extension(f'cogs.{extension}')
+    await close_cogs(cogs)
+    warm_up_cogs()
+
 
+def load_cogs():
+    names = [f'cogs.{filename[:-3]}' for filename in sorted(os.listdir('./cogs')) if filename.endswith('.py')]
 
-for filename in os.listdir('./cogs'):
-    if filename.endswith('.py'):
+    for name in names:
         try:
-            bot.load_extension(f'cogs.{filename[:-3]}')
+            bot.load_extension(name)
         except Exception as e:
-            print(f'Error loading cog {filename}:\n{e}')
+            print(f'Error loading cog {name[5:]}.py:\n{e}')
+
+    print('Cogs loaded in {time:.2f} seconds'.format(time=perf_counter() - started))
+
 
+load_cogs()
 bot.run(config.DISCORD_TOKEN)
@@ -0,0 +1,36 @@
+"""
+Tests run against the local stub servers of benchmarks/stubs.py, so they need no tokens or network access
+"""
+import contextlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# config.py requires the tokens, the stubs accept anything
+os.environ.setdefault('DISCORD_TOKEN', 'test')
+os.environ.setdefault('ADMIN_LICHESS_TOKEN', 'test')
+
+from benchmarks.stubs import start_server  # noqa: E402
+from utils.lichess_api import lichess  # noqa: E402
+
+
+@pytest.fixture
+def lichess_stub(monkeypatch):
+    """
+    :return: async context manager serving a stub lichess app and pointing the shared lichess client at it
+    """
+    @contextlib.asynccontextmanager
+    async def serve(app):
+        runner, url = await start_server(app)
+        monkeypatch.setattr(lichess, 'base_url', url)
+        # Pacing is tested with the limiter itself
+        monkeypatch.setattr(lichess, 'limiter', None)
+        try:
+            yield app
+        finally:
+            await lichess.close()
+            await runner.cleanup()
+
+    return serve
@@ -0,0 +1,80 @@
+import asyncio
+import datetime
+import os
+
+import pytest
+
+from benchmarks.stubs import chesscom_app, make_chesscom_games, start_server
+from utils.aggregates import total_games
+from utils.archives import ArchiveStore
+from utils.chesscom_api import ChessComClient
+from utils.errors import User404Exception
+
+
+def run(app, directory, test):
+    """
+    Serve the stub app and run test(store) against an archive store in directory
+    """
+    async def main():
+        runner, url = await start_server(app)
+        client = ChessComClient(url + '/pub')
+        try:
+            return await test(ArchiveStore(str(directory), client))
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    return asyncio.run(main())
+
+
+def player_archives():
+    now = datetime.datetime.utcnow()
+    return {'hikaru': {(2020, 1): make_chesscom_games('Hikaru', 30), (2020, 2): make_chesscom_games('Hikaru', 20),
+                       (now.year, now.month): make_chesscom_games('Hikaru', 10)}}
+
+
+def test_finished_months_are_downloaded_once(tmp_path):
+    # A copy of a month that is now over is dropped
+    os.makedirs(tmp_path / 'hikaru')
+    (tmp_path / 'hikaru' / '2019-05.current.json.gz').write_bytes(b'')
+
+    async def test(store):
+        first = await store.analyse('Hikaru')
+        second = await store.analyse('hikaru')
+        return first, second, store.downloads, store.hits, store.locks
+
+    (stats, months), (again, _), downloads, hits, locks = run(chesscom_app(archives=player_archives()), tmp_path, test)
+    assert months == 3
+    assert total_games(stats) == 60
+    assert again == stats
+    # The current month is downloaded every time, finished months come from their saved aggregate
+    assert (downloads, hits) == (4, 2)
+    assert not locks
+    assert '2019-05.current.json.gz' not in os.listdir(tmp_path / 'hikaru')
+
+
+def test_failed_download_cleans_up(tmp_path, monkeypatch):
+    downloads = []
+
+    async def test(store):
+        download = store.download
+
+        async def failing(username, year, month, path):
+            downloads.append(month)
+            if len(downloads) == 2:
+                raise asyncio.TimeoutError()
+            return await download(username, year, month, path)
+
+        monkeypatch.setattr(store, 'download', failing)
+        with pytest.raises(asyncio.TimeoutError):
+            await store.analyse('hikaru')
+        return store.locks
+
+    assert not run(chesscom_app(archives=player_archives()), tmp_path, test)
+    assert downloads == [1, 2]
+    assert not [name for name in os.listdir(tmp_path / 'hikaru') if name.endswith('.tmp')]
+
+
+def test_unknown_player(tmp_path):
+    with pytest.raises(User404Exception):
+        run(chesscom_app(), tmp_path, lambda store: store.analyse('nobody'))
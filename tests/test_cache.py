@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+import utils.cache
+from utils.cache import ProfileCache
+from utils.errors import User404Exception
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(utils.cache, 'monotonic', clock)
+    return clock
+
+
+class Loader:
+    """
+    Answers the queued results in order, raising the exceptions among them
+    """
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def get(cache, loader):
+    async def main():
+        value = await cache.get('lichess', 'Someone', loader)
+        await asyncio.sleep(0)  # Let a background refresh run
+        return value
+
+    return asyncio.run(main())
+
+
+def test_fresh_and_stale_hits(clock):
+    cache = ProfileCache({'lichess': 60}, stale_ttl=600)
+    loader = Loader({'rating': 1}, {'rating': 2})
+
+    assert get(cache, loader) == {'rating': 1}
+    assert get(cache, loader) == {'rating': 1}
+    assert loader.calls == 1
+    # Past the TTL the stale profile is served while it refreshes in the background
+    clock.now = 61
+    assert get(cache, loader) == {'rating': 1}
+    assert loader.calls == 2
+    assert get(cache, loader) == {'rating': 2}
+    assert cache.stats()['stale_hits'] == 1
+
+
+def test_unknown_users_are_cached_without_a_stale_window(clock):
+    cache = ProfileCache({}, negative_ttl=60, stale_ttl=600)
+    loader = Loader(User404Exception("User 'Someone' does not exist"), {'rating': 1})
+
+    for _ in range(2):
+        with pytest.raises(User404Exception, match='does not exist'):
+            get(cache, loader)
+    assert loader.calls == 1
+    clock.now = 61
+    assert get(cache, loader) == {'rating': 1}
+
+
+def test_cached_errors_are_raised_fresh(clock):
+    cache = ProfileCache({}, negative_ttl=60)
+    loader = Loader(User404Exception('missing'))
+    raised = []
+    for _ in range(3):
+        with pytest.raises(User404Exception) as error:
+            get(cache, loader)
+        raised.append(error.value)
+
+    assert len({id(error) for error in raised}) == 3
+    # The same traceback every time instead of one that keeps growing
+    depths = []
+    for error in raised:
+        depth, traceback = 0, error.__traceback__
+        while traceback is not None:
+            depth, traceback = depth + 1, traceback.tb_next
+        depths.append(depth)
+    assert depths[1] == depths[2]
@@ -0,0 +1,95 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+from benchmarks.stubs import chesscom_app, start_server
+from utils.chesscom_api import DEFAULT_AVATAR, FallbackBackend, JSONBackend, make_backend
+from utils.errors import User404Exception
+from utils.ratelimit import RateLimiter
+
+
+def run(app, test, fallback_app=None):
+    """
+    Serve the stub app(s) and run test(backend) against a JSON backend pointed at them
+    """
+    async def main():
+        runner, url = await start_server(app)
+        backend = make_backend('json', api_url=url + '/pub', limiter=RateLimiter('stub', rate=1000, burst=1000))
+        fallback_runner = None
+        if fallback_app is not None:
+            fallback_runner, fallback_url = await start_server(fallback_app)
+            backend = FallbackBackend(backend, JSONBackend(fallback_url + '/pub'))
+        try:
+            return await test(backend)
+        finally:
+            await backend.close()
+            await runner.cleanup()
+            if fallback_runner is not None:
+                await fallback_runner.cleanup()
+
+    return asyncio.run(main())
+
+
+def test_profile():
+    profile = run(chesscom_app(), lambda backend: backend.fetch_profile('HIKARU'))
+
+    # The case-sensitive name comes from the profile url
+    assert profile.username == 'Hikaru'
+    assert profile.avatar.startswith('https://images.chesscomfiles.com/')
+    assert profile.stats['Bullet'] == '3286'
+    assert profile.stats['Puzzles'] == '3374'
+    assert profile.stats['Puzzle Rush'] == '52'
+    # Not published by the API
+    assert profile.stats['Bughouse'] is None
+    # Wins, losses and draws of every published mode
+    assert profile.general == {'Games': '48,595'}
+
+
+def test_missing_user():
+    with pytest.raises(User404Exception):
+        run(chesscom_app(), lambda backend: backend.fetch_profile('nobody'))
+
+
+def test_svg_avatar_is_replaced():
+    players = {'svg': {'player': {'username': 'svg', 'avatar': 'https://example.com/avatar.svg'}, 'stats': {}}}
+    profile = run(chesscom_app(players=players), lambda backend: backend.fetch_profile('svg'))
+
+    assert profile.username == 'svg'
+    assert profile.avatar == DEFAULT_AVATAR
+    assert profile.general == {}
+
+
+def test_rate_limited_requests_are_retried():
+    app = chesscom_app()
+    app['failures'] = [(429, 0), (429, 0)]
+    profile = run(app, lambda backend: backend.fetch_profile('hikaru'))
+
+    assert profile.stats['Blitz'] == '3218'
+    assert not app['failures']
+
+
+def test_rate_limiting_gives_up_after_the_retries():
+    app = chesscom_app()
+    # Both requests of the lookup are answered 429 three times, once more than the default retries
+    app['failures'] = [(429, 0)] * 6
+    with pytest.raises(aiohttp.ClientResponseError) as raised:
+        run(app, lambda backend: backend.fetch_profile('hikaru'))
+    assert raised.value.status == 429
+
+
+def test_server_errors_fall_back():
+    primary = chesscom_app()
+    primary['failures'] = [(500, None)] * 2
+    profile = run(primary, lambda backend: backend.fetch_profile('hikaru'), fallback_app=chesscom_app())
+
+    assert profile.username == 'Hikaru'
+
+
+def test_missing_user_does_not_fall_back():
+    fallback = chesscom_app()
+    # The fallback would answer with a server error if it were asked
+    fallback['failures'] = [(500, None)] * 2
+    with pytest.raises(User404Exception):
+        run(chesscom_app(), lambda backend: backend.fetch_profile('nobody'), fallback_app=fallback)
+    assert len(fallback['failures']) == 2
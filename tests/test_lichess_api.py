@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+
+import utils.lichess_api
+from benchmarks.stubs import lichess_app, start_server
+from utils.errors import User404Exception
+from utils.lichess_api import LichessClient, LichessError
+from utils.ratelimit import RateLimiter
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(utils.lichess_api, 'backoff', lambda attempt: 0)
+
+
+def run(app, test, **kwargs):
+    """
+    Serve the app and run test(client) against a client pointed at it
+    :param kwargs: passed to LichessClient (retries, max_retry_wait, ...)
+    """
+    async def main():
+        runner, url = await start_server(app)
+        client = LichessClient('token', base_url=url, limiter=RateLimiter('stub', rate=1000, burst=1000), **kwargs)
+        try:
+            return await test(client)
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    return asyncio.run(main())
+
+
+def test_user():
+    user = run(lichess_app(), lambda client: client.get_public_data('DrNykterstein'))
+    assert user['username'] == 'DrNykterstein'
+
+
+def test_missing_user():
+    with pytest.raises(User404Exception):
+        run(lichess_app(), lambda client: client.get_public_data('nobody'))
+
+
+def test_server_errors_are_retried():
+    app = lichess_app()
+    app['failures'] = [(500, None), (502, None)]
+    user = run(app, lambda client: client.get_public_data('drnykterstein'))
+
+    assert user['id'] == 'drnykterstein'
+    assert not app['failures']
+
+
+def test_server_errors_give_up_after_the_retries():
+    app = lichess_app()
+    app['failures'] = [(503, None)] * 3
+    with pytest.raises(LichessError) as raised:
+        run(app, lambda client: client.get_public_data('drnykterstein'), retries=2)
+    assert raised.value.status == 503
+
+
+def test_posts_are_not_retried_on_server_errors():
+    app = lichess_app()
+    app['failures'] = [(500, None), (500, None)]
+    with pytest.raises(LichessError) as raised:
+        run(app, lambda client: client.create_arena(3, 0, 60, name='Blitz'))
+    assert raised.value.status == 500
+    # The creation may have gone through, it is never sent twice
+    assert len(app['failures']) == 1
+
+
+def test_rate_limited_requests_are_retried():
+    app = lichess_app()
+    app['failures'] = [(429, 0)]
+
+    async def test(client):
+        tournament = await client.create_arena(3, 0, 60, name='Blitz')
+        return tournament, client.limiter.throttles
+
+    tournament, throttles = run(app, test)
+    assert tournament['fullName'] == 'Blitz Arena'
+    assert throttles == 1
+    assert len(app['created']) == 1
+
+
+def test_long_rate_limit_pauses_are_not_waited_for():
+    app = lichess_app()
+    app['failures'] = [(429, 60), (429, 60)]
+    with pytest.raises(LichessError) as raised:
+        run(app, lambda client: client.get_public_data('drnykterstein'), max_retry_wait=10)
+    assert raised.value.status == 429
+    assert len(app['failures']) == 1
+
+
+def test_results_are_streamed():
+    app = lichess_app(standings_size=30)
+
+    async def test(client):
+        return [row async for row in client.stream_results('Y8dh6Ezx', limit=25)]
+
+    rows = run(app, test)
+    assert [row['rank'] for row in rows] == list(range(1, 26))
+    assert rows[0]['username'] == 'DrNykterstein'
+
+
+def test_stream_yields_lines_as_they_arrive():
+    # The second line is only sent once the first one has been read, keep-alive blank lines are skipped
+    first_read = asyncio.Event()
+
+    async def results(request):
+        response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+        await response.prepare(request)
+        await response.write(b'{"rank": 1}\n\n')
+        await first_read.wait()
+        await response.write(b'\n{"rank": 2}\n')
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_get('/api/tournament/{id}/results', results)
+
+    async def test(client):
+        rows = client.stream_results('stream')
+        first = await asyncio.wait_for(rows.__anext__(), 5)
+        first_read.set()
+        return [first] + [row async for row in rows]
+
+    assert run(app, test) == [{'rank': 1}, {'rank': 2}]
@@ -0,0 +1,47 @@
+import asyncio
+
+from utils.perf import Recorder, current, stage, timed
+
+
+def run_command(body):
+    """
+    :return: (stage -> seconds, wall time) of body run as a command
+    """
+    recorder = Recorder()
+
+    async def main():
+        timer = recorder.begin('command')
+        await body()
+        return dict(timer.stages), recorder.end(timer)
+
+    return asyncio.run(main())
+
+
+def test_sequential_stages_add_up():
+    async def body():
+        await timed('fetch', asyncio.sleep(0.05))
+        await timed('fetch', asyncio.sleep(0.05))
+
+    stages, _ = run_command(body)
+    assert stages['fetch'] >= 0.1
+
+
+def test_concurrent_stages_count_their_overlap_once():
+    async def body():
+        # Like the fan-out of #compare, each fetch runs in its own task with a copy of the context
+        await asyncio.gather(*(timed('fetch', asyncio.sleep(0.05)) for _ in range(4)))
+        with stage('build'):
+            pass
+
+    stages, total = run_command(body)
+    assert 0.05 <= stages['fetch'] <= total
+    assert set(stages) == {'fetch', 'build'}
+
+
+def test_stages_outside_a_command_are_ignored():
+    async def main():
+        with stage('build'):
+            pass
+        return current.get()
+
+    assert asyncio.run(main()) is None
@@ -0,0 +1,76 @@
+import asyncio
+import datetime
+
+import pytest
+
+import utils.schedule
+from benchmarks.stubs import lichess_app
+from utils.schedule import ScheduleBatch, parse_recurrence
+
+NOW = datetime.datetime(2021, 8, 31, 12, 0)
+SPEC = 'every Thursday 20:00 for 4 weeks, arena 3+0 60m'
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(utils.schedule, 'backoff', lambda attempt, base=1: 0)
+
+
+def run_batch(lichess_stub, app, batches):
+    async def main():
+        async with lichess_stub(app):
+            for batch in batches:
+                await batch.run()
+
+    asyncio.run(main())
+
+
+def new_batch():
+    # One creation at a time, so injected failures hit the events in order
+    return ScheduleBatch(parse_recurrence(SPEC, 52, NOW), 'Thursday Blitz', 'team', concurrency=1)
+
+
+def test_parse_recurrence():
+    recurrence = parse_recurrence(SPEC, 52, NOW)
+    assert recurrence.kind == 'arena'
+    assert recurrence.first == datetime.datetime(2021, 9, 2, 20, 0)
+    assert recurrence.step == datetime.timedelta(days=7)
+    assert (recurrence.count, recurrence.clock_limit, recurrence.clock_increment, recurrence.length) == (4, 180, 0, 60)
+    with pytest.raises(ValueError):
+        parse_recurrence('every Thursday 20:00 for 99 weeks, arena 3+0 60m', 52, NOW)
+
+
+def test_temporary_failures_are_retried_without_duplicates(lichess_stub):
+    app = lichess_app()
+    # The first answer is lost although lichess created the arena, the second creation really failed
+    app['create_failures'] = [(500, True), (503, False)]
+    batch = new_batch()
+    run_batch(lichess_stub, app, [batch])
+
+    assert len(batch.created) == 4
+    assert not batch.failed
+    # Found by listing the team's arenas instead of being created again
+    assert sorted(event['startsAt'] for event in app['created']) == batch.events
+
+
+def test_rejected_creations_are_not_retried(lichess_stub):
+    app = lichess_app()
+    app['create_failures'] = [(400, False)]
+    batch = new_batch()
+    run_batch(lichess_stub, app, [batch])
+
+    assert len(batch.created) == 3
+    message, retryable = batch.failed[batch.events[0]]
+    assert 'HTTP 400' in message and not retryable
+    assert len(app['created']) == 3
+
+
+def test_running_again_only_creates_missing_events(lichess_stub):
+    app = lichess_app()
+    app['create_failures'] = [(400, False)]
+    first, second = new_batch(), new_batch()
+    run_batch(lichess_stub, app, [first, second])
+
+    assert len(second.skipped) == 3
+    assert list(second.created) == [first.events[0]]
+    assert len(app['created']) == 4
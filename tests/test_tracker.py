@@ -0,0 +1,60 @@
+import asyncio
+
+import config
+from benchmarks.fakes import FakeBot, FakeContext
+from benchmarks.stubs import LICHESS_ARENAS, lichess_app
+
+
+def test_tracking_stops_and_unpins_when_the_arena_finishes(lichess_stub, monkeypatch):
+    monkeypatch.setattr(config, 'TRACK_POLL_INTERVAL', 0.01)
+    monkeypatch.setattr(config, 'TRACK_EDIT_INTERVAL', 0)
+    monkeypatch.setattr(config, 'TRACK_INFO_EVERY', 2)
+    from cogs.lichess import LichessCog
+
+    async def main():
+        app = lichess_app()
+        tournament_id = LICHESS_ARENAS[0]['id']
+        async with lichess_stub(app):
+            bot = FakeBot()
+            cog = LichessCog(bot)
+            ctx = FakeContext(bot)
+            await LichessCog.track.callback(cog, ctx, tournament_id)
+            tracker, task = cog.trackers[(ctx.channel.id, tournament_id)]
+            assert tracker.message.pinned
+
+            await asyncio.sleep(0.1)
+            assert not task.done()
+            app['finished'].add(tournament_id)
+            await asyncio.wait_for(task, 1)
+            await asyncio.sleep(0)  # The unpin is scheduled by the task's done callback
+
+            assert not cog.trackers
+            assert not tracker.message.pinned
+            assert tracker.message.embed.description == 'Final standings'
+
+    asyncio.run(main())
+
+
+def test_track_refuses_trackers_beyond_the_channel_cap(lichess_stub, monkeypatch):
+    monkeypatch.setattr(config, 'TRACK_MAX_PER_CHANNEL', 1)
+    from cogs.lichess import LichessCog
+
+    async def main():
+        app = lichess_app()
+        first, second = LICHESS_ARENAS[0]['id'], 'other'
+        app['created'].append({'id': second, 'fullName': 'Other Arena', 'kind': 'arena'})
+        async with lichess_stub(app):
+            bot = FakeBot()
+            cog = LichessCog(bot)
+            ctx = FakeContext(bot)
+            await LichessCog.track.callback(cog, ctx, first)
+            await LichessCog.track.callback(cog, ctx, second)
+
+            assert list(cog.trackers) == [(ctx.channel.id, first)]
+            assert ctx.channel.messages[-1].content.startswith('This channel already tracks 1 tournaments')
+            tasks = [task for _, task in cog.trackers.values()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run(main())
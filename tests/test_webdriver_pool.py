@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from utils.webdriver_pool import PoolTimeout, WebDriverPool
+
+
+class FakeDriver:
+    current_url = 'about:blank'
+
+    def quit(self):
+        pass
+
+
+def run(test, **kwargs):
+    async def main():
+        pool = WebDriverPool(FakeDriver, **kwargs)
+        try:
+            return await test(pool)
+        finally:
+            await pool.close()
+
+    return asyncio.run(main())
+
+
+def test_acquire_times_out_when_every_browser_is_busy():
+    async def test(pool):
+        async with pool.acquire():
+            with pytest.raises(PoolTimeout):
+                await pool._acquire()
+        return pool.stats()
+
+    stats = run(test, size=1, acquire_timeout=0.05)
+    assert stats['idle'] == 1
+    assert stats['waiting'] == 0
+
+
+def test_cancelled_waiters_leave_the_worker_queued():
+    async def test(pool):
+        async with pool.acquire():
+            waiter = asyncio.ensure_future(pool._acquire())
+            await asyncio.sleep(0.01)
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+        async with pool.acquire() as worker:
+            return worker.index, pool.stats()
+
+    index, stats = run(test, size=1, acquire_timeout=1)
+    assert index == 0
+    assert stats['idle'] == 0
+
+
+def test_worker_released_as_the_wait_times_out_is_not_lost():
+    async def test(pool):
+        held = await pool._acquire()
+        loop = asyncio.get_event_loop()
+        # Handed back in the same loop iteration as the waiter's timeout fires
+        loop.call_later(pool.acquire_timeout, pool._get_idle().put_nowait, held)
+        try:
+            worker = await pool._acquire()
+        except PoolTimeout:
+            worker = None
+        await asyncio.sleep(0.01)
+        # Either the waiter got the worker or it is back in the queue
+        return worker, pool._get_idle().qsize()
+
+    worker, idle = run(test, size=1, acquire_timeout=0.05)
+    assert (worker is not None) + idle == 1
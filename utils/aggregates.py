@@ -0,0 +1,58 @@
+"""
+Compact game aggregates shared by #clubstats (lichess) and #archive (chess.com): every counter is a
+[wins, draws, losses] triple keyed by color, speed (time control or variant) and opening family
+"""
+
+# Index of each counter in a [wins, draws, losses] triple
+WIN, DRAW, LOSS = 0, 1, 2
+
+
+def empty_stats():
+    return {'color': {}, 'speed': {}, 'opening': {}}
+
+
+def count(stats, color, outcome, speed, opening):
+    """
+    Fold one game into stats
+    """
+    for group, key in (('color', color), ('speed', speed), ('opening', opening)):
+        stats[group].setdefault(key, [0, 0, 0])[outcome] += 1
+
+
+def merge(total, stats):
+    for group in ('color', 'speed', 'opening'):
+        for key, counts in stats[group].items():
+            current = total[group].setdefault(key, [0, 0, 0])
+            for i in range(3):
+                current[i] += counts[i]
+    return total
+
+
+def total_games(stats):
+    return sum(sum(counts) for counts in stats['color'].values())
+
+
+def summary(counts):
+    wins, draws, losses = counts
+    played = wins + draws + losses
+    return f'{wins} / {draws} / {losses} ({(wins + draws / 2) / played:.0%})' if played else 'No games'
+
+
+def add_fields(embed, stats, speed_name=str.capitalize):
+    """
+    Add results by color, the 10 most played speeds and the 5 most played openings to a Discord embed
+    :param speed_name: turns a speed key into its display name
+    """
+    for color in ('white', 'black'):
+        embed.add_field(name=f'As {color}', value=summary(stats['color'].get(color, [0, 0, 0])))
+
+    # Most played first
+    by_games = lambda item: -sum(item[1])
+    for speed, counts in sorted(stats['speed'].items(), key=by_games)[:10]:
+        embed.add_field(name=speed_name(speed), value=summary(counts))
+    openings = sorted(stats['opening'].items(), key=by_games)[:5]
+    if openings:
+        embed.add_field(name='Most played openings', inline=False,
+                        value='\n'.join(f'{opening}: {sum(counts)} games, '
+                                        f'{(counts[0] + counts[1] / 2) / sum(counts):.0%}'
+                                        for opening, counts in openings))
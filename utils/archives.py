@@ -0,0 +1,252 @@
+import asyncio
+import codecs
+import datetime
+import gzip
+import json
+import mmap
+import os
+
+from utils.aggregates import DRAW, LOSS, WIN, count, empty_stats, merge
+from utils.errors import User404Exception
+from utils.scheduler import run_blocking
+
+# Results chess.com reports for a drawn game, anything but 'win' and these is a loss
+DRAWS = {'agreed', 'repetition', 'stalemate', 'insufficient', '50move', 'timevsinsufficient'}
+# Words that end an opening family's name in chess.com's opening URLs
+FAMILY_ENDS = {'Opening', 'Defense', 'Game', 'Gambit', 'Attack', 'System'}
+# Bumped when the saved month aggregates change shape, so they are rebuilt from the archives
+STATS_VERSION = 1
+
+
+def iter_games(stream, chunk_size=64 * 1024):
+    """
+    Yield the games of a month archive ({"games": [...]}) one by one from a binary file object,
+    holding no more than one chunk and one game in memory
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+
+    # Skip to the start of the games array
+    while '[' not in buffer:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        buffer += text.decode(chunk)
+    buffer = buffer[buffer.index('[') + 1:]
+
+    while True:
+        buffer = buffer.lstrip(' \t\r\n,')
+        if buffer.startswith(']'):
+            return
+        try:
+            game, end = decoder.raw_decode(buffer)
+        except ValueError:  # The next game isn't complete yet
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                return
+            buffer += text.decode(chunk)
+            continue
+        yield game
+        buffer = buffer[end:]
+
+
+def opening_family(eco_url):
+    """
+    :param string eco_url: e.g. https://www.chess.com/openings/Sicilian-Defense-Najdorf-Variation-6.Bg5
+    :return: e.g. Sicilian Defense
+    """
+    if not eco_url:
+        return 'Unknown'
+    words = eco_url.rstrip('/').rsplit('/', 1)[-1].split('-')
+    for i, word in enumerate(words):
+        if word in FAMILY_ENDS:
+            return ' '.join(words[:i + 1])
+    return ' '.join(words[:3])
+
+
+def month_stats(path, username):
+    """
+    Aggregate a compressed month archive, read through a memory map so the file is paged in by the OS
+    instead of copied into the process
+    """
+    stats = empty_stats()
+    with open(path, 'rb') as raw, mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ) as mapped, \
+            gzip.GzipFile(fileobj=mapped) as stream:
+        for game in iter_games(stream):
+            color = 'white' if game['white']['username'].lower() == username else 'black'
+            result = game[color]['result']
+            outcome = WIN if result == 'win' else DRAW if result in DRAWS else LOSS
+            # Variants are counted on their own, standard chess by time control
+            rules = game.get('rules', 'chess')
+            speed = game.get('time_class', 'unknown') if rules == 'chess' else rules
+            count(stats, color, outcome, speed, opening_family(game.get('eco')))
+    return stats
+
+
+class ArchiveStore:
+    """
+    chess.com monthly game archives cached on disk, gzip compressed, one directory per player
+
+    A finished month never changes, so once downloaded it is never fetched again and its aggregate is saved next
+    to it. Only the current month is downloaded on every analysis.
+    """
+
+    def __init__(self, directory, client, timeout=60):
+        """
+        :param client: ChessComClient shared with the profile backend, not closed by the store
+        :param float timeout: total seconds allowed for downloading one month
+        """
+        self.directory = directory
+        self.client = client
+        self.timeout = timeout
+        # username -> (lock, lookups holding or waiting on it), so two lookups of the same player don't write the
+        # same files. Dropped once nobody needs it
+        self.locks = {}
+        self.downloads = 0
+        self.hits = 0
+
+    async def months(self, username):
+        """
+        :return: list of (year, month) the player has games in, oldest first
+        """
+        archives = await self.client.get(f'/player/{username}/games/archives')
+        if archives is None:
+            raise User404Exception(f"User '{username}' does not exist")
+        return [tuple(int(part) for part in url.rstrip('/').rsplit('/', 2)[-2:]) for url in archives['archives']]
+
+    async def download(self, username, year, month, path):
+        """
+        Stream a month archive into a gzip file, renamed into place only once complete
+        Compressing and writing run on the blocking executor, only receiving runs on the event loop
+        :return: whether the month was downloaded, False if chess.com no longer has it
+        """
+        temporary = path + '.tmp'
+
+        async def save(response):
+            archive = await run_blocking(gzip.open, temporary, 'wb')
+            try:
+                async for chunk in response.content.iter_chunked(256 * 1024):
+                    await run_blocking(archive.write, chunk)
+            finally:
+                await run_blocking(archive.close)
+            return True
+
+        try:
+            saved = await self.client.get(f'/player/{username}/games/{year}/{month:02d}', save, timeout=self.timeout)
+        except BaseException:
+            await run_blocking(self.discard, temporary)
+            raise
+        if not saved:
+            return False
+        await run_blocking(os.replace, temporary, path)
+        self.downloads += 1
+        return True
+
+    def paths(self, username, year, month, current):
+        """
+        :return: (compressed archive, saved aggregate) of one month
+        """
+        name = f'{year}-{month:02d}' + ('.current' if current else '')
+        folder = os.path.join(self.directory, username)
+        return os.path.join(folder, name + '.json.gz'), os.path.join(folder, name + '.stats.json')
+
+    @staticmethod
+    def discard(path):
+        if os.path.exists(path):
+            os.remove(path)
+
+    @staticmethod
+    def load_summary(path):
+        """
+        :return: saved aggregate of a finished month, None if it has to be rebuilt
+        """
+        try:
+            with open(path) as saved:
+                stats = json.load(saved)
+        except (OSError, ValueError):
+            return None
+        return stats if stats.pop('version', None) == STATS_VERSION else None
+
+    @staticmethod
+    def parse(archive, summary, username):
+        """
+        Aggregate a month archive and, for a finished month, save the aggregate next to it (blocking)
+        """
+        stats = month_stats(archive, username)
+        if summary is not None:
+            temporary = summary + '.tmp'
+            with open(temporary, 'w') as saved:
+                json.dump(dict(stats, version=STATS_VERSION), saved, separators=(',', ':'))
+            os.replace(temporary, summary)
+        return stats
+
+    async def analyse(self, username):
+        """
+        :return: (aggregate of every game the player has on chess.com, number of months)
+        """
+        username = username.lower()
+        lock, users = self.locks.get(username, (None, 0))
+        lock = lock or asyncio.Lock()
+        self.locks[username] = (lock, users + 1)
+        try:
+            async with lock:
+                return await self._analyse(username)
+        finally:
+            lock, users = self.locks[username]
+            if users > 1:
+                self.locks[username] = (lock, users - 1)
+            else:
+                del self.locks[username]
+
+    def plan(self, username, months, now):
+        """
+        Prepare the player's folder and sort their months by what they need (blocking)
+        :return: list of (year, month, current, archive, summary, saved aggregate or None, archive on disk)
+        """
+        folder = os.path.join(self.directory, username)
+        os.makedirs(folder, exist_ok=True)
+        # The current month's copy is only replaced while the month lasts, drop those of months now over
+        current_name = f'{now.year}-{now.month:02d}.current.json.gz'
+        for name in os.listdir(folder):
+            if name.endswith('.current.json.gz') and name != current_name:
+                os.remove(os.path.join(folder, name))
+
+        planned = []
+        for year, month in months:
+            current = (year, month) >= (now.year, now.month)
+            archive, summary = self.paths(username, year, month, current)
+            stats = None if current else self.load_summary(summary)
+            planned.append((year, month, current, archive, summary, stats,
+                            stats is None and not current and os.path.exists(archive)))
+        return planned
+
+    async def _analyse(self, username):
+        months = await self.months(username)
+        planned = await run_blocking(self.plan, username, months, datetime.datetime.utcnow())
+
+        total = empty_stats()
+        parsing = []
+        try:
+            # Downloads run one after the other (chess.com asks for serial requests), each month is parsed in the
+            # blocking executor while the next one downloads
+            for year, month, current, archive, summary, stats, on_disk in planned:
+                if stats is not None:
+                    self.hits += 1
+                    merge(total, stats)
+                    continue
+                if not on_disk and not await self.download(username, year, month, archive):
+                    continue  # Listed but gone, e.g. every game was deleted
+                keep = None if current else summary
+                parsing.append(asyncio.ensure_future(run_blocking(self.parse, archive, keep, username)))
+            results = await asyncio.gather(*parsing)
+        except BaseException:
+            # Don't leave parses of earlier months running unobserved, nobody would see their results or errors
+            for future in parsing:
+                future.cancel()
+            await asyncio.gather(*parsing, return_exceptions=True)
+            raise
+
+        for stats in results:
+            merge(total, stats)
+        return total, len(months)
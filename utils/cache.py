@@ -0,0 +1,174 @@
+import asyncio
+import json
+from collections import OrderedDict
+from time import monotonic
+
+import config
+from utils.errors import User404Exception
+from utils.singleflight import SingleFlight
+
+
+class Entry:
+    """
+    Cached value (or exception type and message for negative entries) and its expiry times
+    """
+    __slots__ = ('value', 'error', 'error_message', 'size', 'fresh_until', 'stale_until')
+
+    def __init__(self, value, error, error_message, size, fresh_until, stale_until):
+        self.value = value
+        self.error = error
+        self.error_message = error_message
+        self.size = size
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+
+def estimate_size(value):
+    """
+    :return: rough size of a cached value in bytes, based on its JSON encoding
+    """
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return len(repr(value))
+
+
+class ProfileCache:
+    """
+    Bounded in-memory cache of user profiles keyed by (site, lowercased username)
+
+    - Entries are fresh for the site's TTL, after which they are served stale for up to stale_ttl seconds
+      while a single background refresh runs (stale-while-revalidate)
+    - Unknown users (User404Exception) are cached too, for negative_ttl seconds and never served stale
+    - Least recently used entries are evicted once the total estimated size exceeds max_bytes
+    """
+
+    def __init__(self, ttls, default_ttl=300, negative_ttl=60, stale_ttl=600, max_bytes=4 * 1024 * 1024,
+                 negative=(User404Exception,)):
+        """
+        :param dict ttls: site -> seconds a profile stays fresh
+        :param float default_ttl: ttl for sites missing from ttls
+        :param float negative_ttl: seconds an unknown user stays cached
+        :param float stale_ttl: seconds past expiry a profile may still be served while it refreshes
+        :param int max_bytes: total estimated size of all entries
+        :param tuple negative: exception types that are cached instead of retried
+        """
+        self.ttls = ttls
+        self.default_ttl = default_ttl
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+        self.max_bytes = max_bytes
+        self.negative = negative
+        self.entries = OrderedDict()
+        self.size = 0
+        self.refreshing = set()
+        # Misses and refreshes for the same key share one upstream call
+        self.flight = SingleFlight()
+        self.counters = dict.fromkeys(['hits', 'stale_hits', 'negative_hits', 'misses', 'evictions',
+                                       'refreshes', 'refresh_errors'], 0)
+
+    @staticmethod
+    def key(site, username):
+        return site, username.lower()
+
+    async def get(self, site, username, loader):
+        """
+        :param string site: e.g. 'chesscom' or 'lichess'
+        :param string username: username as typed, lookups are case-insensitive
+        :param loader: coroutine function returning the profile (or raising) on a miss
+        :return: cached or freshly loaded profile, re-raises cached negative results
+        """
+        key = self.key(site, username)
+        entry = self.entries.get(key)
+        now = monotonic()
+
+        if entry is not None and now < entry.stale_until:
+            self.entries.move_to_end(key)
+            if now < entry.fresh_until:
+                self.counters['negative_hits' if entry.error else 'hits'] += 1
+            else:
+                # Serve the stale entry right away and refresh it in the background
+                self.counters['stale_hits'] += 1
+                if key not in self.refreshing:
+                    self.refreshing.add(key)
+                    asyncio.ensure_future(self._refresh(key, loader))
+            return self._unwrap(entry)
+
+        self.counters['misses'] += 1
+        return self._unwrap(await self._load(key, loader))
+
+    def _unwrap(self, entry):
+        if entry.error is not None:
+            # A new exception every time, raising the same one would keep growing its traceback
+            raise entry.error(entry.error_message)
+        return entry.value
+
+    async def _load(self, key, loader):
+        return await self.flight.do(key, lambda: self._fetch(key, loader))
+
+    async def _fetch(self, key, loader):
+        try:
+            value = await loader()
+        except self.negative as e:
+            return self._store(key, None, e)
+        return self._store(key, value, None)
+
+    async def _refresh(self, key, loader):
+        try:
+            await self._load(key, loader)
+            self.counters['refreshes'] += 1
+        except Exception as e:  # Keep serving the stale entry, it will be retried on the next hit
+            self.counters['refresh_errors'] += 1
+            print(f'Background refresh of {key} failed: {e!r}')
+        finally:
+            self.refreshing.discard(key)
+
+    def _store(self, key, value, error):
+        ttl = self.negative_ttl if error is not None else self.ttls.get(key[0], self.default_ttl)
+        # An unknown user may sign up at any moment, so a negative entry is never served past its TTL
+        stale_ttl = self.stale_ttl if error is None else 0
+        now = monotonic()
+        if error is not None:
+            entry = Entry(None, type(error), str(error), estimate_size(str(error)), now + ttl, now + ttl + stale_ttl)
+        else:
+            entry = Entry(value, None, None, estimate_size(value), now + ttl, now + ttl + stale_ttl)
+
+        self.invalidate(*key)
+        self.entries[key] = entry
+        self.size += entry.size
+
+        # Evict least recently used entries, but never the one just stored
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.size
+            self.counters['evictions'] += 1
+        return entry
+
+    def invalidate(self, site, username):
+        entry = self.entries.pop(self.key(site, username), None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self):
+        """
+        :return: counters plus current entry count, estimated size in bytes and coalesced upstream calls
+        """
+        stats = dict(self.counters)
+        stats['entries'] = len(self.entries)
+        stats['bytes'] = self.size
+        lookups = stats['hits'] + stats['stale_hits'] + stats['negative_hits'] + stats['misses']
+        stats['hit_rate'] = (lookups - stats['misses']) / lookups if lookups else 0.0
+        stats['upstream_calls'] = self.flight.calls
+        stats['coalesced'] = self.flight.saved
+        return stats
+
+
+# Shared by every cog, lives outside the cogs so reloading one does not drop the cache
+profile_cache = ProfileCache(ttls={'chesscom': config.CACHE_TTL_CHESSCOM, 'lichess': config.CACHE_TTL_LICHESS,
+                                   'crosstable': config.CACHE_TTL_CROSSTABLE},
+                             negative_ttl=config.CACHE_NEGATIVE_TTL, stale_ttl=config.CACHE_STALE_TTL,
+                             max_bytes=config.CACHE_MAX_BYTES)
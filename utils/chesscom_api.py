@@ -0,0 +1,414 @@
+import asyncio
+from collections import deque, namedtuple
+from time import perf_counter
+
+import aiohttp
+
+from utils.errors import User404Exception
+from utils.perf import stage
+from utils.webdriver_pool import WebDriverPool
+
+CHESSCOM_API = 'https://api.chess.com/pub'
+CHESSCOM_WEB = 'https://www.chess.com'
+
+# Link to default profile picture (chess.com's own default is an svg, which discord does not support)
+DEFAULT_AVATAR = 'https://cdn.discordapp.com/attachments/785212221444718633/785315817611984906/noavatar_l.png'
+
+# Everything the cog needs to render a profile, regardless of which backend produced it
+Profile = namedtuple('Profile', ['username', 'avatar', 'stats', 'general'])
+
+# Maps the public API's stats keys to the mode names shown on the profile page
+JSON_MODES = {
+    'chess_bullet': 'Bullet',
+    'chess_blitz': 'Blitz',
+    'chess_rapid': 'Rapid',
+    'chess_daily': 'Daily',
+    'chess960_daily': 'Daily 960'
+}
+
+
+def empty_stats():
+    """
+    :return: default stats dict with every chess.com mode unrated, in display order
+    """
+    return {
+        'Bullet': None,
+        'Blitz': None,
+        'Rapid': None,
+        'Daily': None,
+        'Puzzles': None,
+        'Puzzle Rush': None,
+        'Live 960': None,
+        'Daily 960': None,
+        'Bughouse': None,
+        'Crazyhouse': None,
+        '3 Check': None,
+        'King of the Hill': None
+    }
+
+
+def fix_avatar(pic_url):
+    if not pic_url or pic_url[-3:] == 'svg':
+        return DEFAULT_AVATAR
+    return pic_url
+
+
+# Reads everything the embed needs from the rendered profile page in a single WebDriver call
+# Polls for the ratings section for up to `arguments[0]` ms, since it is rendered after DOMContentLoaded
+EXTRACT_SCRIPT = """
+const timeout = arguments[0];
+const done = arguments[arguments.length - 1];
+const started = Date.now();
+const texts = selector => Array.from(document.querySelectorAll(selector), element => element.textContent.trim());
+
+function extract() {
+    const missing = document.querySelector('.error-pages-wrapper') !== null;
+    const modes = texts('.stat-section-section-link-name');
+    if (!missing && modes.length === 0 && Date.now() - started < timeout) {
+        return setTimeout(extract, 25);
+    }
+    const pic = document.querySelector('.post-view-meta-image');
+    done({
+        missing: missing,
+        modes: modes,
+        ratings: texts('.stat-section-user-rating'),
+        labels: texts('.sidebar-ratings-label'),
+        values: texts('.sidebar-ratings-rating'),
+        username: pic ? pic.getAttribute('alt') : null,
+        avatar: pic ? pic.getAttribute('src') : null
+    });
+}
+extract();
+"""
+
+# Third party trackers and ad hosts the profile page pulls in, none of them are needed to read the stats
+BLOCKED_HOSTS = [
+    'www.googletagmanager.com',
+    'www.google-analytics.com',
+    'securepubads.g.doubleclick.net',
+    'cdn.cookielaw.org',
+    'static.hotjar.com',
+    'connect.facebook.net'
+]
+
+
+class ChessComClient:
+    """
+    Keep-alive session to chess.com's public API, shared by the profile backend and the game archives
+
+    Every request waits for the shared limiter, a 429 pauses every chess.com request and is retried
+    """
+
+    def __init__(self, api_url=CHESSCOM_API, timeout=10, limiter=None, retries=2):
+        self.api_url = api_url.rstrip('/')
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.limiter = limiter
+        self.retries = retries
+        self.session = None
+
+    def _get_session(self):
+        # Session is created lazily so the client can be built outside of a running event loop
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(timeout=self.timeout,
+                                                 headers={'User-Agent': 'Gambit-Discord-Bot'})
+        return self.session
+
+    async def get(self, path, handle=None, timeout=None):
+        """
+        :param handle: coroutine function given the response, its result is returned (parsed JSON by default)
+        :param float timeout: total seconds for this request instead of the client's default, e.g. for downloads
+        :return: result of handle, None on 404
+        """
+        attempt = 0
+        timeout = aiohttp.ClientTimeout(total=timeout) if timeout is not None else None
+        while True:
+            if self.limiter is not None:
+                await self.limiter.acquire()
+            async with self._get_session().get(self.api_url + path, timeout=timeout) as response:
+                # Rate limited: the limiter pauses every chess.com request, then try again
+                if response.status == 429 and self.limiter is not None and attempt < self.retries:
+                    self.limiter.throttled(response.headers.get('Retry-After'), attempt)
+                    attempt += 1
+                    continue
+                if response.status == 404:
+                    return None
+                response.raise_for_status()
+                if self.limiter is not None:
+                    self.limiter.succeeded()
+                if handle is None:
+                    return await response.json(content_type=None)
+                return await handle(response)
+
+    async def warm(self):
+        # Open the session and a keep-alive connection ahead of the first lookup
+        try:
+            async with self._get_session().head(self.api_url):
+                pass
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+
+class JSONBackend:
+    """
+    Fetches profiles from chess.com's public JSON API (https://www.chess.com/news/view/published-data-api)
+    Live 960, Bughouse, Crazyhouse, 3 Check and King of the Hill are not published there and stay unrated
+    """
+    name = 'json'
+
+    def __init__(self, api_url=CHESSCOM_API, timeout=10, limiter=None, retries=2, client=None):
+        """
+        :param client: ChessComClient to share, one is created (and closed with the backend) if None
+        """
+        self.owns_client = client is None
+        self.client = client or ChessComClient(api_url, timeout=timeout, limiter=limiter, retries=retries)
+
+    async def _get_json(self, path):
+        return await self.client.get(path)
+
+    async def warm(self):
+        await self.client.warm()
+
+    async def fetch_profile(self, username):
+        player, player_stats = await asyncio.gather(self._get_json(f'/player/{username.lower()}'),
+                                                    self._get_json(f'/player/{username.lower()}/stats'))
+        if player is None:
+            raise User404Exception(f"User '{username}' does not exist")
+        player_stats = player_stats or {}
+
+        with stage('parse'):
+            stats = empty_stats()
+            games = 0
+            for key, mode in JSON_MODES.items():
+                if key in player_stats:
+                    stats[mode] = str(player_stats[key]['last']['rating'])
+                    record = player_stats[key].get('record', {})
+                    games += record.get('win', 0) + record.get('loss', 0) + record.get('draw', 0)
+
+            # Only the best ever tactics rating and puzzle rush score are published
+            if 'highest' in player_stats.get('tactics', {}):
+                stats['Puzzles'] = str(player_stats['tactics']['highest']['rating'])
+            if 'best' in player_stats.get('puzzle_rush', {}):
+                stats['Puzzle Rush'] = str(player_stats['puzzle_rush']['best']['score'])
+
+            general = {'Games': f'{games:,}'} if games else {}
+
+            # 'username' is always lowercase, the profile url keeps the case-sensitive name
+            username = player.get('url', '').rsplit('/', 1)[-1] or player['username']
+
+        return Profile(username=username, avatar=fix_avatar(player.get('avatar')), stats=stats, general=general)
+
+    async def close(self):
+        if self.owns_client:
+            await self.client.close()
+
+
+class SeleniumBackend:
+    """
+    Scrapes the rendered chess.com/member/<user> page with a pool of headless Firefox instances
+    Selenium is only imported once this backend is used, so it stays an optional dependency
+
+    In fast mode the browsers use the eager page load strategy, skip images, fonts, stylesheets and trackers,
+    and the whole profile is read with one injected script instead of a round trip per element
+    """
+    name = 'selenium'
+
+    def __init__(self, web_url=CHESSCOM_WEB, firefox_binary=None, executable_path=None, headless=True,
+                 workers=None, max_pages=50, acquire_timeout=30, fast=True, limiter=None):
+        self.web_url = web_url.rstrip('/')
+        self.firefox_binary = firefox_binary
+        self.executable_path = executable_path
+        self.headless = headless
+        self.fast = fast
+        self.limiter = limiter
+        self.pool = WebDriverPool(self.new_driver, size=workers, max_pages=max_pages,
+                                  acquire_timeout=acquire_timeout)
+        # Most recent per-phase timings in seconds, see phase_summary()
+        self.phases = {}
+
+    def new_driver(self):
+        from selenium import webdriver
+        from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
+
+        options = webdriver.FirefoxOptions()
+        options.headless = self.headless
+        kwargs = {'options': options}
+        if self.fast:
+            # Return from driver.get() at DOMContentLoaded instead of waiting for every subresource
+            capabilities = DesiredCapabilities.FIREFOX.copy()
+            capabilities['pageLoadStrategy'] = 'eager'
+            kwargs['desired_capabilities'] = capabilities
+
+            options.set_preference('permissions.default.image', 2)
+            options.set_preference('permissions.default.stylesheet', 2)
+            options.set_preference('browser.display.use_document_fonts', 0)
+            options.set_preference('gfx.downloadable_fonts.enabled', False)
+            options.set_preference('privacy.trackingprotection.enabled', True)
+            # Resolving the tracker hosts to localhost makes their requests fail immediately
+            options.set_preference('network.dns.localDomains', ','.join(BLOCKED_HOSTS))
+        if self.firefox_binary:
+            kwargs['firefox_binary'] = self.firefox_binary
+        if self.executable_path:
+            kwargs['executable_path'] = self.executable_path
+        driver = webdriver.Firefox(**kwargs)
+        driver.set_script_timeout(5)
+        return driver
+
+    def record(self, phase, seconds):
+        self.phases.setdefault(phase, deque(maxlen=200)).append(seconds)
+
+    def phase_summary(self):
+        """
+        :return: dict of phase -> (samples, mean seconds) over the most recent lookups
+        """
+        return {phase: (len(times), sum(times) / len(times)) for phase, times in self.phases.items() if times}
+
+    # Retrieve, order, and return stats as dict
+    def get_ratings(self, driver, username):
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.webdriver.support import expected_conditions as EC
+
+        # Go to profile page
+        driver.get(f'{self.web_url}/member/{username}')
+
+        # Check if directed to error page
+        if driver.find_elements_by_css_selector('.error-pages-wrapper'):
+            raise User404Exception(f"User '{username}' does not exist")
+
+        stats = empty_stats()
+
+        # Retrieve stats for all modes and ratings (Blitz, Crazyhouse, Puzzle Rush, etc.)
+        # Explicitly wait for up to .75 seconds for first search
+        try:
+            modes = WebDriverWait(driver, .75).until(
+                EC.presence_of_all_elements_located((By.CSS_SELECTOR, '.stat-section-section-link-name')))
+        except:  # TimeoutException thrown when existing user has no ratings
+            modes = []
+
+        ratings = driver.find_elements_by_css_selector('.stat-section-user-rating')
+
+        for i in range(len(modes)):
+            stats[modes[i].text] = ratings[i].text
+
+        return stats
+
+    # Retrieve and return general info as dict
+    def get_general(self, driver):
+        general = {}
+        categories = driver.find_elements_by_css_selector('.sidebar-ratings-label')
+        stats = driver.find_elements_by_css_selector('.sidebar-ratings-rating')
+
+        for i in range(len(categories)):
+            general[categories[i].text] = stats[i].text
+
+        return general
+
+    def scrape_profile(self, driver, username):
+        if self.fast:
+            return self.extract_profile(driver, username)
+
+        start = perf_counter()
+        stats = self.get_ratings(driver, username)
+        general = self.get_general(driver)
+
+        # Get profile picture and (case-sensitive) username
+        profile_pic = driver.find_element_by_css_selector('.post-view-meta-image ')
+        profile = Profile(username=profile_pic.get_attribute('alt'),
+                          avatar=fix_avatar(profile_pic.get_attribute('src')),
+                          stats=stats, general=general)
+        self.record('total', perf_counter() - start)
+        return profile
+
+    def extract_profile(self, driver, username):
+        # Navigate
+        start = perf_counter()
+        driver.get(f'{self.web_url}/member/{username}')
+        loaded = perf_counter()
+
+        # Pull everything in one round trip, waiting up to .75 seconds for the ratings to render
+        page = driver.execute_async_script(EXTRACT_SCRIPT, 750)
+        extracted = perf_counter()
+
+        if page['missing']:
+            raise User404Exception(f"User '{username}' does not exist")
+
+        stats = empty_stats()
+        for mode, rating in zip(page['modes'], page['ratings']):
+            stats[mode] = rating
+        general = dict(zip(page['labels'], page['values']))
+        profile = Profile(username=page['username'] or username, avatar=fix_avatar(page['avatar']),
+                          stats=stats, general=general)
+        done = perf_counter()
+
+        self.record('navigate', loaded - start)
+        self.record('extract', extracted - loaded)
+        self.record('parse', done - extracted)
+        self.record('total', done - start)
+        return profile
+
+    async def fetch_profile(self, username):
+        # WebDriver calls block, the pool runs them in its own threads off the event loop
+        if self.limiter is not None:
+            await self.limiter.acquire()
+        async with self.pool.acquire() as worker:
+            return await self.pool.run(worker, self.scrape_profile, username)
+
+    async def warm(self):
+        await self.pool.warm()
+
+    async def close(self):
+        await self.pool.close()
+
+
+class FallbackBackend:
+    """
+    Tries the primary backend first and only falls back on network/server errors
+    A missing user is a valid answer and is never retried on the fallback
+    """
+
+    def __init__(self, primary, fallback):
+        self.primary = primary
+        self.fallback = fallback
+        self.name = f'{primary.name}+{fallback.name}'
+
+    async def fetch_profile(self, username):
+        try:
+            return await self.primary.fetch_profile(username)
+        except User404Exception:
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f'{self.primary.name} backend failed for {username} ({e!r}), falling back to {self.fallback.name}')
+            return await self.fallback.fetch_profile(username)
+
+    async def warm(self):
+        # The fallback is only started if it is ever needed
+        await self.primary.warm()
+
+    async def close(self):
+        await self.primary.close()
+        await self.fallback.close()
+
+
+def make_backend(name, fallback=None, **kwargs):
+    """
+    :param string name: 'json' or 'selenium'
+    :param string fallback: optional backend name to fall back on when the primary one errors
+    :param kwargs: passed to the backend constructors (api_url, client, web_url, firefox_binary, limiter, ...)
+    :return: backend with async fetch_profile(username), warm() and close()
+    """
+    backends = {
+        'json': lambda: JSONBackend(**{k: v for k, v in kwargs.items()
+                                       if k in ('api_url', 'timeout', 'limiter', 'retries', 'client')}),
+        'selenium': lambda: SeleniumBackend(**{k: v for k, v in kwargs.items()
+                                               if k in ('web_url', 'firefox_binary', 'executable_path', 'headless',
+                                                        'workers', 'max_pages', 'acquire_timeout', 'fast',
+                                                        'limiter')})
+    }
+    backend = backends[name]()
+    if fallback and fallback != name:
+        backend = FallbackBackend(backend, backends[fallback]())
+    return backend
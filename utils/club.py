@@ -0,0 +1,200 @@
+import asyncio
+from bisect import bisect_left, insort
+from time import monotonic
+
+import aiohttp
+
+import config
+from utils.history import history, lichess_ratings
+from utils.lichess_api import LichessError, lichess
+
+CLUB_TEAM = 'niner-chess-club'
+# Ids per bulk request, the most lichess accepts
+STATUS_BATCH = 100
+USERS_BATCH = 300
+
+
+class ClubRoster:
+    """
+    Member list of a lichess team, streamed from lichess at most once per max_age
+    """
+
+    def __init__(self, team_id, max_age):
+        self.team_id = team_id
+        self.max_age = max_age
+        self.members = {}  # id -> username
+        self.refreshed = None
+        self.lock = asyncio.Lock()
+
+    async def get(self):
+        """
+        :return: dict of member id -> username, refetched when older than max_age
+        """
+        async with self.lock:
+            if self.refreshed is None or monotonic() - self.refreshed > self.max_age:
+                members = {}
+                async for member in lichess.get_members(self.team_id):
+                    members[member['id']] = member['username']
+                self.members = members
+                self.refreshed = monotonic()
+        return self.members
+
+
+class BackgroundIndex:
+    """
+    Index of club data refreshed in the background, so commands answer from memory instead of going to lichess
+    Subclasses implement refresh()
+    """
+
+    def __init__(self, name, roster, interval):
+        """
+        :param string name: shown when a refresh fails
+        :param ClubRoster roster: members to follow
+        :param float interval: seconds between refreshes
+        """
+        self.name = name
+        self.roster = roster
+        self.interval = interval
+        self.refreshed = None
+        self.refreshes = 0
+        self.errors = 0
+        self.task = None
+        self.ready = asyncio.Event()
+
+    async def refresh(self):
+        raise NotImplementedError
+
+    async def run(self):
+        while True:
+            try:
+                await self.refresh()
+                self.refreshed = monotonic()
+                self.refreshes += 1
+                self.ready.set()
+            except (LichessError, aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                # The previous data keeps being served, its age shows it is stale
+                self.errors += 1
+                print(f'{self.name} refresh failed: {e!r}')
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """
+        Start refreshing in the background, does nothing if already running
+        """
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+        return self.task
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    @property
+    def age(self):
+        """
+        :return: seconds since the last successful refresh, None before the first one
+        """
+        return None if self.refreshed is None else monotonic() - self.refreshed
+
+
+class PresenceIndex(BackgroundIndex):
+    """
+    Online status of every club member, refreshed through the bulk status endpoint
+    """
+
+    def __init__(self, roster, interval):
+        super().__init__('Presence', roster, interval)
+        self.statuses = {}  # id -> status as returned by lichess
+
+    async def refresh(self):
+        ids = list(await self.roster.get())
+        batches = [ids[i:i + STATUS_BATCH] for i in range(0, len(ids), STATUS_BATCH)]
+        statuses = {}
+        for batch in await asyncio.gather(*[lichess.get_users_status(batch) for batch in batches]):
+            for status in batch:
+                statuses[status['id']] = status
+        self.statuses = statuses
+
+    def online(self):
+        """
+        :return: list of (username, playing) for members online right now, alphabetical
+        """
+        members = [(status['name'], status.get('playing', False))
+                   for status in self.statuses.values() if status.get('online')]
+        return sorted(members, key=lambda member: member[0].lower())
+
+
+class RatingIndex(BackgroundIndex):
+    """
+    Club leaderboards: for every perf a list of (-rating, id, provisional) kept sorted as ratings change,
+    so the top k of a perf is a slice instead of a lookup per member
+    """
+
+    def __init__(self, roster, interval):
+        super().__init__('Leaderboard', roster, interval)
+        self.boards = {}  # perf -> sorted entries, best first
+        self.entries = {}  # (perf, id) -> the member's entry in boards[perf]
+        self.usernames = {}  # id -> username
+        self.changes = 0  # Entries moved by refreshes
+
+    async def refresh(self):
+        ids = list(await self.roster.get())
+        batches = [ids[i:i + USERS_BATCH] for i in range(0, len(ids), USERS_BATCH)]
+        seen = set()
+        for batch in await asyncio.gather(*[lichess.get_users(batch) for batch in batches]):
+            for user in batch:
+                # Every refresh doubles as a rating history snapshot of the whole club
+                history.record('lichess', user['id'], self.update(user))
+                seen.add(user['id'])
+        # Members who left the team or closed their account
+        for user_id in [user_id for user_id in self.usernames if user_id not in seen]:
+            self.remove_user(user_id)
+
+    def update(self, user):
+        """
+        Move the user's entries to their current ratings, leaving unchanged ones alone
+        :return: dict of perf -> rating for the perfs the user has played
+        """
+        user_id = user['id']
+        self.usernames[user_id] = user['username']
+        perfs = user.get('perfs', {})
+        # Unplayed perfs (the default 1500) stay off the leaderboards
+        played = lichess_ratings(perfs)
+        for perf, value in played.items():
+            entry = (-value, user_id, bool(perfs[perf].get('prov')))
+            if self.entries.get((perf, user_id)) != entry:
+                self.remove(perf, user_id)
+                insort(self.boards.setdefault(perf, []), entry)
+                self.entries[(perf, user_id)] = entry
+                self.changes += 1
+        for perf in self.boards:
+            if perf not in played:
+                self.remove(perf, user_id)
+        return played
+
+    def remove(self, perf, user_id):
+        entry = self.entries.pop((perf, user_id), None)
+        if entry is not None:
+            board = self.boards[perf]
+            del board[bisect_left(board, entry)]
+
+    def remove_user(self, user_id):
+        for perf in self.boards:
+            self.remove(perf, user_id)
+        del self.usernames[user_id]
+
+    def perfs(self):
+        return sorted(perf for perf, board in self.boards.items() if board)
+
+    def top(self, perf, k=None):
+        """
+        :return: list of (username, rating, provisional) for the k best members in perf, all of them if k is None
+        """
+        return [(self.usernames[user_id], -rating, provisional)
+                for rating, user_id, provisional in self.boards.get(perf, [])[:k]]
+
+
+roster = ClubRoster(CLUB_TEAM, config.ROSTER_REFRESH_INTERVAL)
+presence = PresenceIndex(roster, config.PRESENCE_REFRESH_INTERVAL)
+ratings = RatingIndex(roster, config.LEADERBOARD_REFRESH_INTERVAL)
@@ -0,0 +1,15 @@
+from discord.ext.commands import CommandError
+
+
+class User404Exception(Exception):
+    def __init__(self, message="User does not exist"):
+        super().__init__(message)
+
+
+class BusyException(CommandError):
+    """
+    Raised before a command runs when its server already has too many commands waiting
+    """
+
+    def __init__(self, message="The bot is busy, please try again in a moment"):
+        super().__init__(message)
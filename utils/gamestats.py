@@ -0,0 +1,120 @@
+import asyncio
+import json
+import os
+
+import aiohttp
+
+import config
+from utils.aggregates import DRAW, LOSS, WIN, count, empty_stats, merge
+from utils.club import BackgroundIndex, roster
+from utils.lichess_api import LichessError, lichess
+from utils.scheduler import run_blocking
+
+
+async def outcomes(games, user_id):
+    """
+    Pipeline stage: one game from the export -> (created at, color, outcome, speed, opening family)
+    Aborted games come out with only their creation time, so the checkpoint still moves past them
+    """
+    async for game in games:
+        if game.get('status') in ('aborted', 'noStart'):
+            yield game['createdAt'], None, None, None, None
+            continue
+        white = game['players']['white'].get('user', {}).get('id')
+        color = 'white' if white == user_id else 'black'
+        winner = game.get('winner')
+        outcome = DRAW if winner is None else WIN if winner == color else LOSS
+        # "Sicilian Defense: Najdorf Variation" counts as the Sicilian Defense
+        opening = game.get('opening', {}).get('name', 'Unknown').split(':')[0]
+        yield game['createdAt'], color, outcome, game.get('speed', 'unknown'), opening
+
+
+class ClubGameStats(BackgroundIndex):
+    """
+    Win/draw/loss by color, time control and opening for every club member, folded game by game out of their
+    lichess game exports. Each member's checkpoint (creation time of their last counted game) is kept with
+    the aggregates so a refresh only streams games played since.
+    """
+
+    def __init__(self, roster, interval, path, max_games=5000):
+        """
+        :param string path: JSON file the aggregates and checkpoints are saved to
+        :param int max_games: games streamed per member per refresh, the rest follow on the next refresh
+        """
+        super().__init__('Club game stats', roster, interval)
+        self.path = path
+        self.max_games = max_games
+        self.members = {}  # id -> compact aggregate (see utils/aggregates.py) plus the member's checkpoint
+        self.club = empty_stats()
+        self.loaded_mtime = None
+        self.games = 0  # Games folded in since the bot started
+
+    def load(self):
+        """
+        Read the aggregates saved by the last refresh (possibly by another process), if the file changed
+        """
+        try:
+            mtime = os.path.getmtime(self.path)
+            if mtime == self.loaded_mtime:
+                return
+            with open(self.path) as saved:
+                self.members = json.load(saved)
+        except (OSError, ValueError):
+            return
+        self.loaded_mtime = mtime
+        self.club = self.total()
+        self.ready.set()
+
+    def save(self):
+        # Written to a temporary file first so a crash never leaves a half written file behind
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as saved:
+            json.dump(self.members, saved, separators=(',', ':'))
+        os.replace(temporary, self.path)
+        self.loaded_mtime = os.path.getmtime(self.path)
+
+    def total(self):
+        total = empty_stats()
+        for stats in self.members.values():
+            merge(total, stats)
+        return total
+
+    async def update_member(self, user_id):
+        """
+        Stream the member's games since their checkpoint, oldest first, and fold them into their aggregate
+        """
+        stats = self.members.setdefault(user_id, dict(empty_stats(), since=0))
+        games = lichess.stream_games(user_id, since=stats['since'] + 1, max=self.max_games)
+        async for created, color, outcome, speed, opening in outcomes(games, user_id):
+            stats['since'] = created
+            if color is None:
+                continue
+            count(stats, color, outcome, speed, opening)
+            self.games += 1
+
+    async def refresh(self):
+        self.load()
+        members = await self.roster.get()
+        # One export at a time, lichess asks clients not to download games in parallel
+        for done, user_id in enumerate(members, 1):
+            try:
+                await self.update_member(user_id)
+            except (LichessError, aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                # Games counted before the failure are kept, the rest follow on the next refresh
+                print(f'{self.name}: updating {user_id} failed: {e!r}')
+            if done % 25 == 0:
+                await run_blocking(self.save)
+        # Members who left the team
+        for user_id in [user_id for user_id in self.members if user_id not in members]:
+            del self.members[user_id]
+        await run_blocking(self.save)
+        self.club = self.total()
+
+    def stats(self, user_id=None):
+        """
+        :return: compact aggregate of the whole club, or of one member (None if they aren't tracked)
+        """
+        return self.club if user_id is None else self.members.get(user_id.lower())
+
+
+game_stats = ClubGameStats(roster, config.CLUBSTATS_REFRESH_INTERVAL, config.CLUBSTATS_PATH)
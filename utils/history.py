@@ -0,0 +1,195 @@
+import asyncio
+import atexit
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ratings (
+    site TEXT NOT NULL,
+    user TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    taken INTEGER NOT NULL,
+    rating INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ratings_lookup ON ratings (site, user, mode, taken);
+"""
+
+# Latest rating per mode of a user, next to the one they had at a given time (or their first if newer)
+CHANGE_QUERY = """
+SELECT m.mode,
+       (SELECT rating FROM ratings WHERE site = :site AND user = :user AND mode = m.mode
+        ORDER BY taken DESC LIMIT 1),
+       COALESCE((SELECT rating FROM ratings WHERE site = :site AND user = :user AND mode = m.mode AND taken <= :since
+                 ORDER BY taken DESC LIMIT 1),
+                (SELECT rating FROM ratings WHERE site = :site AND user = :user AND mode = m.mode
+                 ORDER BY taken LIMIT 1))
+FROM (SELECT DISTINCT mode FROM ratings WHERE site = :site AND user = :user) m
+ORDER BY m.mode
+"""
+
+
+def lichess_ratings(perfs):
+    """
+    :param dict perfs: perfs of lichess user data
+    :return: dict of perf key -> rating (score for Storm and Racer) for the perfs that have been played
+    """
+    ratings = {}
+    for perf, stats in perfs.items():
+        value = stats.get('rating', stats.get('score'))
+        if value is not None and (stats.get('games') or stats.get('runs')):
+            ratings[perf] = value
+    return ratings
+
+
+def chesscom_ratings(stats):
+    """
+    :param dict stats: Profile.stats, mode -> rating string or None
+    :return: dict of mode -> rating for the rated modes
+    """
+    ratings = {}
+    for mode, value in stats.items():
+        try:
+            ratings[mode] = int(str(value).replace(',', ''))
+        except ValueError:  # Unrated (None) or not a number
+            pass
+    return ratings
+
+
+class RatingHistory:
+    """
+    Timestamped rating snapshots per (site, user, mode) in SQLite
+
+    Recording is cheap and never blocks: snapshots are buffered and written in one transaction every
+    flush interval (or as soon as batch_size are waiting) on a single database thread. Only ratings that
+    changed since the last snapshot of the same (site, user, mode) are written.
+    """
+
+    def __init__(self, path, flush_interval=5, batch_size=500):
+        """
+        :param string path: database file, created if missing
+        :param float flush_interval: seconds between writes of buffered snapshots
+        :param int batch_size: buffered snapshots that trigger a write right away
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.pending = []
+        self.last = {}  # (site, user, mode) -> last recorded rating
+        self.connection = None
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='history')
+        self.flusher = None
+        self.written = 0
+        self.skipped = 0
+
+    def _connect(self):
+        if self.connection is None:
+            # Launcher processes share the file, wait for each other's writes instead of failing
+            self.connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.executescript(SCHEMA)
+        return self.connection
+
+    def _write(self, rows):
+        with self.lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany('INSERT INTO ratings (site, user, mode, taken, rating) VALUES (?, ?, ?, ?, ?)',
+                                       rows)
+
+    def _query(self, sql, params):
+        with self.lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    def record(self, site, user, ratings, taken=None):
+        """
+        Buffer a snapshot of a user's ratings
+        :param dict ratings: mode -> rating
+        :param int taken: unix time of the snapshot, now by default
+        """
+        taken = int(taken or time.time())
+        user = user.lower()
+        for mode, rating in ratings.items():
+            key = (site, user, mode)
+            if self.last.get(key) == rating:
+                self.skipped += 1
+                continue
+            self.last[key] = rating
+            self.pending.append((site, user, mode, taken, rating))
+
+        if len(self.pending) >= self.batch_size:
+            asyncio.ensure_future(self.flush())
+        elif self.pending and (self.flusher is None or self.flusher.done()):
+            self.flusher = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        """
+        Write every buffered snapshot in one transaction
+        """
+        rows, self.pending = self.pending, []
+        if not rows:
+            return
+        try:
+            await asyncio.get_event_loop().run_in_executor(self.executor, self._write, rows)
+        except sqlite3.Error as e:
+            # Keep them for the next flush, e.g. when another process held the database for too long
+            print(f'Writing {len(rows)} rating snapshots failed: {e!r}')
+            self.pending = rows + self.pending
+            return
+        self.written += len(rows)
+
+    async def history(self, site, user, mode, limit=15):
+        """
+        :return: list of (unix time, rating) of the most recent snapshots, oldest first
+        """
+        await self.flush()
+        rows = await asyncio.get_event_loop().run_in_executor(
+            self.executor, self._query,
+            'SELECT taken, rating FROM ratings WHERE site = ? AND user = ? AND mode = ? ORDER BY taken DESC LIMIT ?',
+            (site, user.lower(), mode, limit))
+        return rows[::-1]
+
+    async def modes(self, site, user):
+        """
+        :return: modes with at least one snapshot for the user
+        """
+        await self.flush()
+        rows = await asyncio.get_event_loop().run_in_executor(
+            self.executor, self._query, 'SELECT DISTINCT mode FROM ratings WHERE site = ? AND user = ?',
+            (site, user.lower()))
+        return [mode for mode, in rows]
+
+    async def changes(self, site, user, since):
+        """
+        :param int since: unix time to compare against
+        :return: list of (mode, latest rating, rating at since) for every mode of the user
+        """
+        await self.flush()
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor, self._query, CHANGE_QUERY, {'site': site, 'user': user.lower(), 'since': int(since)})
+
+    def close(self):
+        """
+        Write what is still buffered and close the database, blocking
+        """
+        rows, self.pending = self.pending, []
+        if rows:
+            self._write(rows)
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+history = RatingHistory(config.HISTORY_DB_PATH, flush_interval=config.HISTORY_FLUSH_INTERVAL)
+# Snapshots taken in the last few seconds before shutdown are still written
+atexit.register(history.close)
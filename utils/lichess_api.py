@@ -0,0 +1,264 @@
+import asyncio
+import json
+
+import aiohttp
+
+import config
+from utils.errors import User404Exception
+from utils.ratelimit import HIGH, NORMAL, backoff, limiters
+
+LICHESS_URL = 'https://lichess.org'
+
+
+def mode_name(game_mode):
+    """
+    :param string game_mode: lichess perf key, e.g. ultraBullet
+    :return: display name, e.g. Ultra Bullet
+    """
+    # Change camelCase to Space Separated
+    mode = ''
+    for l in game_mode:
+        if l.isupper():
+            mode += ' '
+        mode += l
+    return mode[0].upper() + mode[1:]
+
+
+class LichessError(Exception):
+    def __init__(self, status, message="Lichess request failed"):
+        self.status = status
+        super().__init__(f'{message} (HTTP {status})')
+
+
+class LichessClient:
+    """
+    Asyncio lichess.org API client sharing one keep-alive connection pool between every command
+
+    GET requests are retried on connection errors, timeouts and 5xx/429 responses with exponential backoff,
+    POST requests only when lichess answered 429 (the request was rejected and can safely be repeated)
+    Every attempt first waits for the shared rate limiter, a 429 pauses the limiter for everyone
+    """
+
+    def __init__(self, token=None, base_url=LICHESS_URL, timeout=10, retries=3, connections=20, limiter=None,
+                 max_retry_wait=10):
+        """
+        :param string token: personal API token, sent as a bearer token
+        :param string base_url: lichess host, overridable for a local fake server
+        :param float timeout: seconds to connect and read each response chunk
+        :param int retries: attempts after the first one before giving up
+        :param int connections: size of the connection pool
+        :param limiter: RateLimiter every request waits on, None to disable pacing
+        :param float max_retry_wait: after a 429, give up instead of retrying if lichess wants a longer pause
+        """
+        self.token = token
+        self.base_url = base_url.rstrip('/')
+        self.timeout = aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout)
+        self.retries = retries
+        self.connections = connections
+        self.limiter = limiter
+        self.max_retry_wait = max_retry_wait
+        self.session = None
+
+    def _get_session(self):
+        # Session is created lazily so the client can be built outside of a running event loop
+        if self.session is None or self.session.closed:
+            headers = {'User-Agent': 'Gambit-Discord-Bot'}
+            if self.token:
+                headers['Authorization'] = f'Bearer {self.token}'
+            connector = aiohttp.TCPConnector(limit=self.connections, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(connector=connector, headers=headers, timeout=self.timeout)
+        return self.session
+
+    async def _request(self, method, path, params=None, data=None, accept='application/json', priority=NORMAL):
+        """
+        :return: open response with a 2xx status, the caller must release it
+        """
+        attempt = 0
+        while True:
+            if self.limiter is not None:
+                await self.limiter.acquire(priority)
+            try:
+                response = await self._get_session().request(method, self.base_url + path, params=params,
+                                                             data=data, headers={'Accept': accept})
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if method != 'GET' or attempt >= self.retries:
+                    raise
+            else:
+                if response.status < 400:
+                    if self.limiter is not None:
+                        self.limiter.succeeded()
+                    return response
+                response.release()
+
+                if response.status == 429:
+                    pause = None
+                    if self.limiter is not None:
+                        pause = self.limiter.throttled(response.headers.get('Retry-After'), attempt)
+                    if attempt >= self.retries or (pause or 0) > self.max_retry_wait:
+                        raise LichessError(429, "Lichess is rate limiting requests")
+                    if pause is not None:
+                        # The limiter holds every request back until the pause is over
+                        attempt += 1
+                        continue
+                elif method != 'GET' or response.status < 500 or attempt >= self.retries:
+                    raise LichessError(response.status)
+
+            await asyncio.sleep(backoff(attempt))
+            attempt += 1
+
+    async def _get_json(self, path, params=None):
+        response = await self._request('GET', path, params=params)
+        async with response:
+            return await response.json(content_type=None)
+
+    async def _post(self, path, data):
+        # Tournament creation is Officer only, it skips ahead of queued stats lookups
+        response = await self._request('POST', path, data=data, priority=HIGH)
+        async with response:
+            return await response.json(content_type=None)
+
+    async def _stream(self, path, params=None):
+        """
+        Yields one object per NDJSON line as they arrive, without buffering the whole body
+        """
+        response = await self._request('GET', path, params=params, accept='application/x-ndjson')
+        async with response:
+            async for line in response.content:
+                line = line.strip()
+                if line:  # Lichess sends empty lines as keep-alives
+                    yield json.loads(line)
+
+    # Users
+
+    async def get_public_data(self, username):
+        try:
+            return await self._get_json(f'/api/user/{username}')
+        except LichessError as e:
+            if e.status == 404:
+                raise User404Exception(f"User '{username}' does not exist")
+            raise
+
+    async def get_crosstable(self, user1, user2, matchup=False):
+        params = {'matchup': 'true'} if matchup else None
+        return await self._get_json(f'/api/crosstable/{user1}/{user2}', params=params)
+
+    async def get_users(self, ids):
+        """
+        :param list ids: at most 300 user ids
+        :return: list of public user data, including perfs, for the ids that exist
+        """
+        # A read despite being a POST, so it waits its turn behind other lookups
+        response = await self._request('POST', '/api/users', data=','.join(ids))
+        async with response:
+            return await response.json(content_type=None)
+
+    async def get_users_status(self, ids):
+        """
+        :param list ids: at most 100 user ids
+        :return: list of {id, name, online, playing, ...}, the flags are only present when true
+        """
+        return await self._get_json('/api/users/status', params={'ids': ','.join(ids)})
+
+    def stream_games(self, username, since=None, max=None):
+        """
+        :param int since: only games created at or after this time, in milliseconds since the epoch
+        :param int max: most games to export
+        :return: async generator of the user's games without moves, oldest first, with their opening
+        """
+        params = {'sort': 'dateAsc', 'opening': 'true', 'moves': 'false', 'tags': 'false', 'clocks': 'false',
+                  'evals': 'false'}
+        if since:
+            params['since'] = since
+        if max:
+            params['max'] = max
+        return self._stream(f'/api/games/user/{username}', params=params)
+
+    # Teams
+
+    def get_members(self, team_id):
+        """
+        :return: async generator of team members
+        """
+        return self._stream(f'/api/team/{team_id}/users')
+
+    # Tournaments
+
+    async def arenas_by_team(self, team_id, max=100):
+        return [arena async for arena in self._stream(f'/api/team/{team_id}/arena', params={'max': max})]
+
+    async def swiss_by_team(self, team_id, max=100):
+        return [swiss async for swiss in self._stream(f'/api/team/{team_id}/swiss', params={'max': max})]
+
+    def stream_results(self, tournament_id, limit=None):
+        """
+        :return: async generator of standings, best rank first
+        """
+        params = {'nb': limit} if limit else None
+        return self._stream(f'/api/tournament/{tournament_id}/results', params=params)
+
+    async def get_tournament(self, tournament_id):
+        """
+        :return: arena info, including isFinished and nbPlayers
+        """
+        return await self._get_json(f'/api/tournament/{tournament_id}')
+
+    async def get_swiss(self, swiss_id):
+        """
+        :return: swiss info, status is 'finished' once the last round is over
+        """
+        return await self._get_json(f'/api/swiss/{swiss_id}')
+
+    def stream_swiss_results(self, swiss_id, limit=None):
+        """
+        :return: async generator of swiss standings, best rank first (points instead of score)
+        """
+        params = {'nb': limit} if limit else None
+        return self._stream(f'/api/swiss/{swiss_id}/results', params=params)
+
+    async def create_arena(self, clock_time, clock_increment, minutes, name=None, rated=None, start_date=None,
+                           team_id=None):
+        """
+        :param int start_date: start time in milliseconds since the epoch
+        :param string team_id: restrict entry to members of this team
+        """
+        data = {'clockTime': clock_time, 'clockIncrement': clock_increment, 'minutes': minutes}
+        if name is not None:
+            data['name'] = name
+        if rated is not None:
+            data['rated'] = str(rated).lower()
+        if start_date is not None:
+            data['startDate'] = start_date
+        if team_id is not None:
+            data['conditions.teamMember.teamId'] = team_id
+        return await self._post('/api/tournament', data)
+
+    async def create_swiss(self, team_id, clock_limit, clock_increment, nb_rounds, name=None, rated=None,
+                           starts_at=None):
+        """
+        :param int clock_limit: initial clock time in seconds
+        :param int starts_at: start time in milliseconds since the epoch
+        """
+        data = {'clock.limit': clock_limit, 'clock.increment': clock_increment, 'nbRounds': nb_rounds}
+        if name is not None:
+            data['name'] = name
+        if rated is not None:
+            data['rated'] = str(rated).lower()
+        if starts_at is not None:
+            data['startsAt'] = starts_at
+        return await self._post(f'/api/swiss/new/{team_id}', data)
+
+    async def warm(self):
+        # Open the session and a keep-alive connection ahead of the first command
+        try:
+            async with self._get_session().head(self.base_url):
+                pass
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+
+# Shared by every cog so all lichess traffic goes through one connection pool
+lichess = LichessClient(config.ADMIN_LICHESS_TOKEN, base_url=config.LICHESS_URL, limiter=limiters['lichess'])
@@ -0,0 +1,59 @@
+import os
+import sys
+
+
+def rss_mb(pid):
+    """
+    :return: resident memory of pid and all of its descendants in MB (Linux only, 0 elsewhere)
+    """
+    if not os.path.isdir('/proc'):
+        return 0.0
+    children = {}
+    rss = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/status') as status:
+                fields = dict(line.split(':', 1) for line in status if ':' in line)
+        except OSError:
+            continue
+        children.setdefault(int(fields['PPid']), []).append(int(entry))
+        rss[int(entry)] = int(fields.get('VmRSS', '0 kB').split()[0])
+
+    total = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        total += rss.get(current, 0)
+        stack.extend(children.get(current, []))
+    return total / 1024
+
+
+def peak_rss_mb():
+    """
+    :return: peak resident memory of this process in MB (0 on Windows)
+    """
+    try:
+        import resource  # Unix only
+    except ImportError:  # Windows
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kB everywhere else
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def process_memory():
+    """
+    :return: dict with this process' own RSS and the RSS including child processes (browsers) in MB
+    """
+    own = 0.0
+    try:
+        with open(f'/proc/{os.getpid()}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    own = int(line.split()[1]) / 1024
+    except OSError:
+        # Peak rather than current RSS, the best available without /proc
+        own = peak_rss_mb()
+    return {'rss': own, 'rss_with_children': max(own, rss_mb(os.getpid()))}
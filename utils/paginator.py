@@ -0,0 +1,134 @@
+import asyncio
+
+import discord
+
+PREVIOUS = '◀️'
+NEXT = '▶️'
+
+
+class LazyRows:
+    """
+    Rows of a streamed listing, pulled from upstream only as far as the pages being shown need
+    """
+
+    def __init__(self, open_stream):
+        """
+        :param open_stream: function taking a row limit (None for all rows) and returning an async iterator
+        """
+        self.open_stream = open_stream
+        self.rows = []
+        self.complete = False
+        self.stream = None
+        self.limit = None
+        self.received = 0
+
+    async def load(self, count):
+        """
+        Make sure at least count rows are loaded, or every row if there are fewer
+        """
+        while len(self.rows) < count and not self.complete:
+            if self.stream is None:
+                # The first page only asks for the rows it shows, later pages share one open-ended stream
+                self.limit = None if self.rows else count
+                self.received = 0
+                self.stream = self.open_stream(self.limit).__aiter__()
+            try:
+                row = await self.stream.__anext__()
+            except StopAsyncIteration:
+                self.stream = None
+                self.complete = self.limit is None or self.received < self.limit
+                continue
+            self.received += 1
+            # A new stream starts over from the top, skip what the first page already has
+            if self.received > len(self.rows):
+                self.rows.append(row)
+
+    async def close(self):
+        stream, self.stream = self.stream, None
+        if stream is not None and hasattr(stream, 'aclose'):
+            await stream.aclose()
+
+
+class StaticRows:
+    """
+    Rows already in memory, for paging through something that doesn't need to be streamed
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.complete = True
+
+    async def load(self, count):
+        pass
+
+    async def close(self):
+        pass
+
+
+class Paginator:
+    """
+    Embed pages flipped with reactions, each page rendered when it is first shown
+    """
+
+    def __init__(self, bot, rows, render, page_size=20, timeout=120):
+        """
+        :param rows: LazyRows or StaticRows to page through
+        :param render: function taking (rows on the page, page number, whether there is a next page) returning an embed
+        :param int page_size: rows per page
+        :param int timeout: seconds without navigation before the reactions are removed
+        """
+        self.bot = bot
+        self.rows = rows
+        self.render = render
+        self.page_size = page_size
+        self.timeout = timeout
+        self.page = 0
+
+    async def render_page(self, number):
+        start = number * self.page_size
+        # One row past the page tells whether there is a next page
+        await self.rows.load(start + self.page_size + 1)
+        has_next = len(self.rows.rows) > start + self.page_size
+        return self.render(self.rows.rows[start:start + self.page_size], number, has_next), has_next
+
+    async def navigate(self, message, author_id):
+        """
+        Flip pages on reactions from the command's author until the timeout
+        Uses the raw reaction event, the message may not be in discord.py's (small) message cache
+        """
+        try:
+            if not self.rows.rows[self.page_size:]:
+                return
+            await message.add_reaction(PREVIOUS)
+            await message.add_reaction(NEXT)
+
+            def check(payload):
+                return payload.message_id == message.id and payload.user_id == author_id and \
+                    str(payload.emoji) in (PREVIOUS, NEXT)
+
+            while True:
+                try:
+                    payload = await self.bot.wait_for('raw_reaction_add', check=check, timeout=self.timeout)
+                except asyncio.TimeoutError:
+                    break
+
+                try:  # So the same arrow can be clicked again, needs Manage Messages
+                    await message.remove_reaction(payload.emoji, discord.Object(payload.user_id))
+                except discord.HTTPException:
+                    pass
+
+                number = self.page + 1 if str(payload.emoji) == NEXT else self.page - 1
+                if number < 0:
+                    continue
+                embed, _ = await self.render_page(number)
+                if not self.rows.rows[number * self.page_size:]:  # Past the last page
+                    continue
+                self.page = number
+                await message.edit(embed=embed)
+
+            try:
+                await message.clear_reactions()
+            except discord.HTTPException:
+                pass
+        finally:
+            await self.rows.close()
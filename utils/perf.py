@@ -0,0 +1,182 @@
+import contextvars
+import os
+from collections import Counter, deque
+from contextlib import contextmanager
+from time import perf_counter
+
+# Timer of the command currently running in this task, set by the bot's before_invoke hook
+current = contextvars.ContextVar('perf_command', default=None)
+
+
+class Histogram:
+    """
+    Rolling window of the most recent samples, enough for p50/p95/p99 without unbounded growth
+    """
+
+    def __init__(self, size=1000):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def percentile(self, q):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def summary(self):
+        return {'count': self.count, 'p50': self.percentile(.5), 'p95': self.percentile(.95),
+                'p99': self.percentile(.99)}
+
+
+class CommandTimer:
+    """
+    Wall time of one command invocation and the time spent in each of its stages
+
+    Concurrent blocks of the same stage (e.g. the fetches of #compare run side by side) count once for the time
+    they overlap, so a stage never adds up to more than the command's wall time
+    """
+
+    def __init__(self, command, site):
+        self.command = command
+        self.site = site
+        self.start = perf_counter()
+        self.stages = Counter()
+        self.running = Counter()  # stage -> blocks of it in progress
+        self.opened = {}  # stage -> start of the span its running blocks cover
+
+    def enter(self, name):
+        if not self.running[name]:
+            self.opened[name] = perf_counter()
+        self.running[name] += 1
+
+    def exit(self, name):
+        self.running[name] -= 1
+        if not self.running[name]:
+            self.stages[name] += perf_counter() - self.opened.pop(name)
+
+
+class Recorder:
+    def __init__(self):
+        self.commands = {}  # command -> Histogram of total latency
+        self.sites = {}  # site -> Histogram of total latency
+        self.stages = {}  # (command, stage) -> Histogram
+        self.site_stages = {}  # (site, stage) -> Histogram
+        self.queue_waits = {}  # command -> Histogram of time spent waiting for the scheduler
+        self.errors = Counter()  # (command, error type) -> count
+
+    @staticmethod
+    def _histogram(table, key):
+        if key not in table:
+            table[key] = Histogram()
+        return table[key]
+
+    def begin(self, command, site=None):
+        timer = CommandTimer(command, site)
+        current.set(timer)
+        return timer
+
+    def end(self, timer):
+        total = perf_counter() - timer.start
+        self._histogram(self.commands, timer.command).add(total)
+        if timer.site:
+            self._histogram(self.sites, timer.site).add(total)
+        for stage, seconds in timer.stages.items():
+            self._histogram(self.stages, (timer.command, stage)).add(seconds)
+            if timer.site:
+                self._histogram(self.site_stages, (timer.site, stage)).add(seconds)
+        current.set(None)
+        return total
+
+    def queue_wait(self, command, seconds):
+        # Kept apart from the command latency, which starts once the command is allowed to run
+        self._histogram(self.queue_waits, command).add(seconds)
+
+    def error(self, command, error):
+        # Unwrap CommandInvokeError so errors are counted by what actually went wrong
+        original = getattr(error, 'original', error)
+        # No command for e.g. CommandNotFound, a string key keeps the table sortable
+        self.errors[(command or 'unknown', type(original).__name__)] += 1
+
+    def prometheus(self):
+        """
+        :return: all metrics in the Prometheus text exposition format
+        """
+        lines = []
+
+        def summary(metric, help_text, table, labels):
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} summary')
+            for key, histogram in sorted(table.items()):
+                key = key if isinstance(key, tuple) else (key,)
+                label = ','.join(f'{name}="{value}"' for name, value in zip(labels, key))
+                for q in (.5, .95, .99):
+                    lines.append(f'{metric}{{{label},quantile="{q}"}} {histogram.percentile(q):.6f}')
+                lines.append(f'{metric}_sum{{{label}}} {histogram.total:.6f}')
+                lines.append(f'{metric}_count{{{label}}} {histogram.count}')
+
+        summary('gambit_command_seconds', 'Command latency', self.commands, ['command'])
+        summary('gambit_command_stage_seconds', 'Time spent per stage of a command', self.stages,
+                ['command', 'stage'])
+        summary('gambit_site_seconds', 'Command latency per upstream site', self.sites, ['site'])
+        summary('gambit_site_stage_seconds', 'Time spent per stage per upstream site', self.site_stages,
+                ['site', 'stage'])
+        summary('gambit_queue_wait_seconds', 'Time commands waited for a free slot', self.queue_waits, ['command'])
+
+        lines.append('# HELP gambit_command_errors_total Command errors by type')
+        lines.append('# TYPE gambit_command_errors_total counter')
+        for (command, kind), count in sorted(self.errors.items()):
+            lines.append(f'gambit_command_errors_total{{command="{command}",type="{kind}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        # Write then rename so a scraper never reads a half written file
+        temp = path + '.tmp'
+        with open(temp, 'w') as file:
+            file.write(self.prometheus())
+        os.replace(temp, path)
+
+
+recorder = Recorder()
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a block as a stage of the running command, e.g. `with stage('build'):`
+    Does nothing outside of a command
+    """
+    timer = current.get()
+    if timer is None:
+        yield
+        return
+    timer.enter(name)
+    try:
+        yield
+    finally:
+        timer.exit(name)
+
+
+async def timed(name, awaitable):
+    """
+    Await something as a stage of the running command, e.g. `await timed('send', ctx.send(embed=embed))`
+    """
+    with stage(name):
+        return await awaitable
+
+
+# Hooks registered on the bot in main.py
+
+async def before_invoke(ctx):
+    recorder.begin(ctx.command.qualified_name, getattr(ctx.cog, 'site', None))
+
+
+async def after_invoke(ctx):
+    timer = current.get()
+    if timer is not None:
+        recorder.end(timer)
@@ -0,0 +1,138 @@
+import asyncio
+import heapq
+import itertools
+import random
+from time import monotonic
+
+import config
+
+# Priority lanes, lower is served first
+HIGH = 0
+NORMAL = 1
+
+
+def backoff(attempt, base=0.5, cap=30):
+    """
+    :return: seconds to wait before retry number `attempt`, exponential with full jitter
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class RateLimiter:
+    """
+    Token bucket for one upstream host with a priority queue of waiters
+
+    - Requests wait for a token; HIGH priority waiters (e.g. Officer tournament creation) always go first
+    - A 429 pauses the whole host for Retry-After (or an exponential backoff with jitter) and halves the rate,
+      which then creeps back up towards the configured rate with every successful response
+    """
+
+    def __init__(self, host, rate, burst, min_rate=0.2, default_pause=None):
+        """
+        :param string host: upstream host name, only used for reporting
+        :param float rate: requests per second once recovered
+        :param int burst: bucket size, requests that may go out back to back
+        :param float min_rate: floor the adaptive rate never drops below
+        :param float default_pause: seconds to pause after a 429 without Retry-After, exponential backoff if None
+        """
+        self.host = host
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate
+        self.default_pause = default_pause
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+        self.blocked_until = 0
+        self.waiters = []
+        self.counter = itertools.count()
+        self.timer = None
+        self.throttles = 0  # 429 responses
+        self.throttled_seconds = 0.0  # total time requests spent waiting for a token
+        self.requests = 0
+
+    def _refill(self, now):
+        # No tokens accrue while the host is paused after a 429
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def _schedule(self):
+        now = monotonic()
+        self._refill(now)
+
+        while self.waiters:
+            priority, _, future = self.waiters[0]
+            if future.done():  # Cancelled while waiting
+                heapq.heappop(self.waiters)
+                continue
+            if now < self.blocked_until or self.tokens < 1:
+                break
+            heapq.heappop(self.waiters)
+            self.tokens -= 1
+            future.set_result(None)
+
+        if self.waiters and self.timer is None:
+            delay = max(self.blocked_until - now, (1 - self.tokens) / self.rate, 0.001)
+            self.timer = asyncio.get_event_loop().call_later(delay, self._on_timer)
+
+    def _on_timer(self):
+        self.timer = None
+        self._schedule()
+
+    async def acquire(self, priority=NORMAL):
+        """
+        Wait until a request to this host may be sent
+        """
+        start = monotonic()
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.counter), future))
+        self._schedule()
+        await future
+        self.requests += 1
+        self.throttled_seconds += monotonic() - start
+
+    def throttled(self, retry_after=None, attempt=0):
+        """
+        Call when the host answered 429, pauses every waiter and slows the rate down
+        :param retry_after: value of the Retry-After header in seconds, if any
+        :return: seconds until the host may be contacted again
+        """
+        self.throttles += 1
+        self.rate = max(self.min_rate, self.rate / 2)
+        try:
+            pause = float(retry_after)
+        except (TypeError, ValueError):
+            pause = self.default_pause if self.default_pause is not None else backoff(attempt + 1, base=1)
+        self.blocked_until = max(self.blocked_until, monotonic() + pause)
+        # One request may go out as soon as the pause ends, the rest follow at the reduced rate
+        self.tokens = 1
+        self.updated = self.blocked_until
+        return self.blocked_until - monotonic()
+
+    def succeeded(self):
+        """
+        Call after a successful response, recovers the rate additively
+        """
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def stats(self):
+        return {
+            'host': self.host,
+            'rate': self.rate,
+            'queued': sum(not future.done() for _, _, future in self.waiters),
+            'queued_high': sum(not future.done() and priority == HIGH for priority, _, future in self.waiters),
+            'requests': self.requests,
+            'throttles': self.throttles,
+            'throttled_seconds': self.throttled_seconds,
+            'paused_for': max(0.0, self.blocked_until - monotonic())
+        }
+
+
+# One limiter per upstream host, shared by every cog
+limiters = {
+    # Lichess asks clients to wait a full minute after a 429
+    'lichess': RateLimiter('lichess.org', rate=config.LICHESS_RATE, burst=config.LICHESS_BURST, default_pause=60),
+    'chesscom': RateLimiter('chess.com', rate=config.CHESSCOM_RATE, burst=config.CHESSCOM_BURST)
+}
@@ -0,0 +1,62 @@
+import asyncio
+from time import perf_counter
+
+
+class LazyResource:
+    """
+    Expensive resource (browser pool, HTTP session, ...) created on first use or warmed up in the background
+    Every caller waiting for it shares the same creation, a failed creation is retried on the next use
+    """
+
+    def __init__(self, name, factory, closer=None):
+        """
+        :param string name: shown in the startup log
+        :param factory: coroutine function creating the resource
+        :param closer: coroutine function taking the resource and tearing it down
+        """
+        self.name = name
+        self.factory = factory
+        self.closer = closer
+        self.task = None
+        self.ready_after = None
+
+    def _failed(self):
+        return self.task.done() and (self.task.cancelled() or self.task.exception() is not None)
+
+    async def _create(self):
+        start = perf_counter()
+        value = await self.factory()
+        self.ready_after = perf_counter() - start
+        print(f'{self.name} ready in {self.ready_after:.2f} seconds')
+        return value
+
+    def warm(self):
+        """
+        Start creating the resource in the background if that hasn't happened yet
+        :return: task resolving to the resource
+        """
+        if self.task is None or self._failed():
+            self.task = asyncio.ensure_future(self._create())
+        return self.task
+
+    async def get(self):
+        """
+        :return: the resource, waiting for it if it is still being created
+        """
+        # Shielded so a cancelled command doesn't cancel the creation for everyone else
+        return await asyncio.shield(self.warm())
+
+    @property
+    def ready(self):
+        return self.task is not None and self.task.done() and not self._failed()
+
+    async def close(self):
+        task, self.task = self.task, None
+        if task is None or task.cancelled():
+            return
+        try:
+            value = await task
+        except Exception:  # Never created, nothing to tear down
+            return
+        if self.closer is not None:
+            await self.closer(value)
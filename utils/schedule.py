@@ -0,0 +1,179 @@
+import asyncio
+import datetime
+import re
+from collections import namedtuple
+
+import aiohttp
+
+from utils.lichess_api import LichessError, lichess
+from utils.ratelimit import backoff
+
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+# every Thursday 20:00 for 12 weeks, arena 3+0 60m [from 2021-09-02]
+# every day at 18:30 for 5 days, swiss 5+3 7 rounds
+SPEC = re.compile(r'every\s+(?P<day>[a-z]+?)s?\s+(?:at\s+)?(?P<time>\d{1,2}:\d{2})\s+'
+                  r'for\s+(?P<count>\d+)\s+(?:weeks?|days?|times?)\s*,?\s*'
+                  r'(?P<kind>arena|swiss)\s+(?P<limit>\d+(?:\.\d+)?)\s*\+\s*(?P<increment>\d+)\s+'
+                  r'(?P<length>\d+)\s*(?P<unit>m|mins?|minutes|rounds?)'
+                  r'(?:\s+from\s+(?P<start>\d{4}-\d{2}-\d{2}))?$', re.IGNORECASE)
+
+# clock_limit in seconds, length in minutes for an arena and in rounds for a swiss
+Recurrence = namedtuple('Recurrence', ['kind', 'first', 'step', 'count', 'clock_limit', 'clock_increment', 'length'])
+
+
+def parse_recurrence(spec, max_events, now=None):
+    """
+    :param string spec: e.g. every Thursday 20:00 for 12 weeks, arena 3+0 60m - optionally ending with from <date>
+    :param int max_events: most events one spec may create
+    :param now: local time the first event has to be after, now by default
+    :return: Recurrence, times are local like #arena and #swiss
+    :raises ValueError: explaining what is wrong with the spec
+    """
+    match = SPEC.match(' '.join(spec.split()))
+    if match is None:
+        raise ValueError('Could not read the schedule, write it like: '
+                         'every Thursday 20:00 for 12 weeks, arena 3+0 60m (or swiss 5+3 7 rounds)')
+
+    day = match['day'].lower()
+    if day != 'day' and day not in WEEKDAYS:
+        raise ValueError(f"Unknown day '{match['day']}'")
+    count = int(match['count'])
+    if not 1 <= count <= max_events:
+        raise ValueError(f'A schedule creates between 1 and {max_events} events')
+    kind = match['kind'].lower()
+    rounds = match['unit'].lower().startswith('round')
+    if rounds != (kind == 'swiss'):
+        raise ValueError('Arenas last a number of minutes (60m), swiss tournaments a number of rounds (7 rounds)')
+    try:
+        hour, minute = map(int, match['time'].split(':'))
+        start = datetime.date.fromisoformat(match['start']) if match['start'] else None
+        now = now or datetime.datetime.now()
+        first = datetime.datetime.combine(start or now.date(), datetime.time(hour, minute))
+    except ValueError as e:
+        raise ValueError(f'Invalid date or time: {e}')
+
+    # First matching day from the start date on that is still ahead
+    step = datetime.timedelta(days=1 if day == 'day' else 7)
+    if day != 'day':
+        first += datetime.timedelta(days=(WEEKDAYS.index(day) - first.weekday()) % 7)
+    while first <= now:
+        first += step
+    return Recurrence(kind, first, step, count, round(float(match['limit']) * 60), int(match['increment']),
+                      int(match['length']))
+
+
+def occurrences(recurrence):
+    return [recurrence.first + i * recurrence.step for i in range(recurrence.count)]
+
+
+def retryable(error):
+    # Rate limiting and lichess or network trouble may pass, a rejected form will be rejected again
+    if isinstance(error, LichessError):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+class ScheduleBatch:
+    """
+    Creates every event of a recurrence for a team, a few at a time through the shared lichess limiter
+
+    Idempotent: an event the team already has (same start and clock) is never created twice. The team's
+    tournaments are listed before each round, so a create that timed out but went through is found instead of
+    repeated, and running the same #schedule again only creates what is still missing.
+    """
+
+    def __init__(self, recurrence, name, team_id, concurrency=4, retries=3):
+        """
+        :param string name: tournament name, lichess picks one if None
+        :param int concurrency: creations in flight at once
+        :param int retries: rounds of retries for events that failed with a temporary error
+        """
+        self.recurrence = recurrence
+        self.name = name
+        self.team_id = team_id
+        self.concurrency = concurrency
+        self.retries = retries
+        self.events = [int(start.timestamp() * 1000) for start in occurrences(recurrence)]
+        self.created = {}  # start in ms -> id of the tournament created by this batch
+        self.skipped = {}  # start in ms -> id of the tournament the team already had
+        self.failed = {}  # start in ms -> (error message, worth retrying)
+
+    def key(self, starts_at):
+        return starts_at, self.recurrence.clock_limit, self.recurrence.clock_increment
+
+    async def existing(self):
+        """
+        :return: dict of (start in ms, clock limit, increment) -> id of the team's tournaments of this kind
+        """
+        if self.recurrence.kind == 'arena':
+            events = await lichess.arenas_by_team(self.team_id, max=200)
+        else:
+            events = await lichess.swiss_by_team(self.team_id, max=200)
+        found = {}
+        for event in events:
+            starts_at = event.get('startsAt')
+            if isinstance(starts_at, str):  # Swiss give an ISO date instead of milliseconds
+                starts_at = int(datetime.datetime.fromisoformat(starts_at.replace('Z', '+00:00')).timestamp() * 1000)
+            clock = event.get('clock', {})
+            found[(starts_at, clock.get('limit'), clock.get('increment'))] = event['id']
+        return found
+
+    async def create(self, starts_at):
+        recurrence = self.recurrence
+        if recurrence.kind == 'arena':
+            tournament = await lichess.create_arena(f'{recurrence.clock_limit / 60:g}', recurrence.clock_increment,
+                                                    recurrence.length, name=self.name, rated='false',
+                                                    start_date=starts_at, team_id=self.team_id)
+        else:
+            tournament = await lichess.create_swiss(self.team_id, recurrence.clock_limit, recurrence.clock_increment,
+                                                    recurrence.length, name=self.name, rated='false',
+                                                    starts_at=starts_at)
+        return tournament['id']
+
+    async def run(self, progress=None):
+        """
+        :param progress: coroutine function called with the batch every time an event is settled
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def create(starts_at):
+            async with semaphore:
+                try:
+                    self.created[starts_at] = await self.create(starts_at)
+                    self.failed.pop(starts_at, None)
+                except (LichessError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    self.failed[starts_at] = (str(e) or type(e).__name__, retryable(e))
+            if progress is not None:
+                await progress(self)
+
+        pending = self.events
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(backoff(attempt, base=1))
+                try:
+                    existing = await self.existing()
+                except (LichessError, aiohttp.ClientError, asyncio.TimeoutError):
+                    continue  # Creating blind could duplicate events, wait for the next round
+            else:
+                existing = await self.existing()
+
+            todo = []
+            for starts_at in pending:
+                found = existing.get(self.key(starts_at))
+                if found is None:
+                    todo.append(starts_at)
+                # Already there on the first look, or created by an earlier round whose answer got lost
+                elif attempt:
+                    self.created[starts_at] = found
+                    self.failed.pop(starts_at, None)
+                else:
+                    self.skipped[starts_at] = found
+            await asyncio.gather(*(create(starts_at) for starts_at in todo))
+
+            pending = [starts_at for starts_at in todo if self.failed.get(starts_at, (None, False))[1]]
+            if not pending:
+                break
+
+    def settled(self):
+        return len(self.created) + len(self.skipped) + len(self.failed)
@@ -0,0 +1,196 @@
+import asyncio
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import discord
+
+import config
+from utils.errors import BusyException
+from utils.perf import recorder
+
+# Blocking work of commands and background jobs (parsing, file writes) runs here instead of the loop's default
+# executor, so a burst of it can't take every thread. Browsers have their own pool, see utils/webdriver_pool.py
+executor = ThreadPoolExecutor(max_workers=config.BLOCKING_WORKERS, thread_name_prefix='blocking')
+
+
+async def run_blocking(fn, *args):
+    """
+    Run a blocking call on the bounded executor
+    """
+    return await asyncio.get_event_loop().run_in_executor(executor, fn, *args)
+
+
+class CommandScheduler:
+    """
+    Admission control for commands: at most `slots` run at once, and at most `guild_slots` of them per server
+
+    Commands that can't start right away wait in per-server queues, served round robin across servers and, within a
+    server, round robin across users, so one busy server (or one user spamming it) only delays itself. A server that
+    already has `guild_queue` commands waiting, or a full `queue_size`, gets its new commands refused.
+    """
+
+    def __init__(self, slots, guild_slots, guild_queue, queue_size):
+        self.slots = slots
+        self.guild_slots = guild_slots
+        self.guild_queue = guild_queue
+        self.queue_size = queue_size
+        self.active = 0
+        self.running = Counter()  # guild -> running commands
+        self.queues = OrderedDict()  # guild -> OrderedDict of user -> deque of futures, in round robin order
+        self.waiting = 0
+        self.started = 0
+        self.queued = 0  # Commands that had to wait
+        self.rejected = 0
+
+    def _can_start(self, guild):
+        return self.active < self.slots and self.running[guild] < self.guild_slots
+
+    def _start(self, guild):
+        self.active += 1
+        self.running[guild] += 1
+        self.started += 1
+
+    def _dispatch(self):
+        while self.active < self.slots:
+            # First server in round robin order that is below its share
+            guild = next((guild for guild in self.queues if self.running[guild] < self.guild_slots), None)
+            if guild is None:
+                return
+            users = self.queues[guild]
+            user, futures = next(iter(users.items()))
+            future = futures.popleft()
+            self.waiting -= 1
+            # Served: the user goes to the back of their server's queue, the server to the back of the line
+            if futures:
+                users.move_to_end(user)
+            else:
+                del users[user]
+            if users:
+                self.queues.move_to_end(guild)
+            else:
+                del self.queues[guild]
+            if future.done():  # Cancelled while waiting, dropped here and its acquire() finds it gone
+                continue
+            self._start(guild)
+            future.set_result(None)
+
+    def _remove(self, guild, user, future):
+        users = self.queues.get(guild, {})
+        if future not in users.get(user, ()):  # Already popped by _dispatch
+            return
+        users[user].remove(future)
+        self.waiting -= 1
+        if not users[user]:
+            del users[user]
+        if not users:
+            del self.queues[guild]
+
+    def position(self, target):
+        """
+        :return: 1 based place of a waiting future in the round robin order, ignoring the per server limit
+        """
+        line = deque((guild, deque((user, deque(futures)) for user, futures in users.items()))
+                     for guild, users in self.queues.items())
+        place = 0
+        while line:
+            guild, users = line.popleft()
+            user, futures = users.popleft()
+            place += 1
+            if futures.popleft() is target:
+                return place
+            if futures:
+                users.append((user, futures))
+            if users:
+                line.append((guild, users))
+        return place
+
+    async def acquire(self, guild, user, on_queued=None):
+        """
+        Wait for a slot, call release(guild) once the command is done
+        :param guild: server id (None for direct messages)
+        :param user: user id
+        :param on_queued: coroutine function called with the queue position when the command has to wait
+        :return: seconds spent waiting
+        :raises BusyException: when the server's queue or the whole queue is full
+        """
+        # Nobody from this server is waiting ahead
+        if guild not in self.queues and self._can_start(guild):
+            self._start(guild)
+            return 0.0
+
+        users = self.queues.get(guild, {})
+        if self.waiting >= self.queue_size or sum(map(len, users.values())) >= self.guild_queue:
+            self.rejected += 1
+            raise BusyException(f'Too many commands are waiting{" in this server" if guild else ""}, '
+                                f'please try again in a moment')
+
+        start = perf_counter()
+        future = asyncio.get_event_loop().create_future()
+        self.queues.setdefault(guild, OrderedDict()).setdefault(user, deque()).append(future)
+        self.waiting += 1
+        self.queued += 1
+        try:
+            if on_queued is not None:
+                await on_queued(self.position(future))
+            await future
+        except BaseException:
+            if future.done() and not future.cancelled():
+                # Got a slot just as it was cancelled, hand it to the next one
+                self.release(guild)
+            else:  # Still queued (cancelling the waiting task cancels the future too)
+                self._remove(guild, user, future)
+            raise
+        return perf_counter() - start
+
+    def release(self, guild):
+        self.active -= 1
+        self.running[guild] -= 1
+        if not self.running[guild]:
+            del self.running[guild]
+        self._dispatch()
+
+    def stats(self):
+        return {
+            'slots': self.slots,
+            'running': self.active,
+            'waiting': self.waiting,
+            'guilds_waiting': len(self.queues),
+            'started': self.started,
+            'queued': self.queued,
+            'rejected': self.rejected
+        }
+
+
+scheduler = CommandScheduler(config.COMMAND_SLOTS, config.COMMAND_GUILD_SLOTS, config.COMMAND_GUILD_QUEUE,
+                             config.COMMAND_QUEUE_SIZE)
+
+
+# Hooks registered on the bot in main.py
+
+async def before_invoke(ctx):
+    guild = ctx.guild.id if ctx.guild is not None else None
+    notices = []
+
+    async def on_queued(position):
+        try:
+            notices.append(await ctx.send(f'Busy, queued at position {position}'))
+        except discord.HTTPException:  # The command still runs when its turn comes
+            pass
+
+    waited = await scheduler.acquire(guild, ctx.author.id, on_queued)
+    ctx.scheduled_guild = guild
+    recorder.queue_wait(ctx.command.qualified_name, waited)
+    # The command's own reply follows right away, the notice has served its purpose
+    for notice in notices:
+        try:
+            await notice.delete()
+        except discord.HTTPException:
+            pass
+
+
+async def after_invoke(ctx):
+    if hasattr(ctx, 'scheduled_guild'):
+        guild = ctx.scheduled_guild
+        del ctx.scheduled_guild  # A slot is only released once
+        scheduler.release(guild)
@@ -0,0 +1,41 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key: the first caller starts the work, everyone who asks for
+    the same key while it is running awaits the same future and gets its result or its exception
+    """
+
+    def __init__(self):
+        self.inflight = {}
+        self.calls = 0  # Upstream calls actually made
+        self.saved = 0  # Callers that piggybacked on an in-flight call instead
+
+    async def do(self, key, fn):
+        """
+        :param key: hashable identifying the work, e.g. ('lichess', 'username')
+        :param fn: coroutine function doing the work, only called when nothing is in flight for key
+        :return: result of the (shared) call
+        """
+        future = self.inflight.get(key)
+        if future is None:
+            self.calls += 1
+            future = asyncio.ensure_future(fn())
+            self.inflight[key] = future
+            future.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.saved += 1
+
+        # Shielded so one caller being cancelled doesn't cancel the call for everyone else
+        return await asyncio.shield(future)
+
+    def _finish(self, key, future):
+        if self.inflight.get(key) is future:
+            del self.inflight[key]
+        # Mark the exception as retrieved in case every waiter was cancelled
+        if not future.cancelled():
+            future.exception()
+
+    def stats(self):
+        return {'calls': self.calls, 'saved': self.saved, 'inflight': len(self.inflight)}
@@ -0,0 +1,177 @@
+import asyncio
+import datetime
+from time import monotonic
+
+import aiohttp
+import discord
+
+from utils.lichess_api import LichessError, lichess
+
+
+class EditThrottle:
+    """
+    Spaces out message edits per channel, Discord rate limits edits per channel rather than per message
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.last = {}
+
+    def ready(self, channel_id):
+        return monotonic() - self.last.get(channel_id, float('-inf')) >= self.interval
+
+    def wait_time(self, channel_id):
+        return max(0.0, self.last.get(channel_id, float('-inf')) + self.interval - monotonic())
+
+    def edited(self, channel_id):
+        self.last[channel_id] = monotonic()
+
+
+class TournamentTracker:
+    """
+    Follows a running arena or swiss and keeps one message with its top standings up to date
+
+    Standings are polled every poll interval, but the message is only edited when they changed and the channel's
+    edit window is open. Changes seen in between are coalesced into the next edit. The tournament's info, which only
+    says when it finishes, is refetched every info_every polls to keep trackers within their share of the limiter.
+    """
+
+    def __init__(self, tournament_id, kind, message, throttle, poll_interval=5, info_every=6, size=20,
+                 max_duration=6 * 3600, max_failures=5):
+        """
+        :param string kind: 'arena' or 'swiss'
+        :param message: Discord message kept up to date
+        :param EditThrottle throttle: shared by every tracker so they respect the channel limit together
+        :param float poll_interval: seconds between polls of lichess
+        :param int info_every: polls between two fetches of the tournament info
+        :param int size: standings shown
+        :param float max_duration: seconds after which tracking stops even if the tournament hasn't finished
+        :param int max_failures: consecutive failed polls after which tracking stops
+        """
+        self.tournament_id = tournament_id
+        self.kind = kind
+        self.message = message
+        self.throttle = throttle
+        self.poll_interval = poll_interval
+        self.info_every = info_every
+        self.size = size
+        self.max_duration = max_duration
+        self.max_failures = max_failures
+        self.info = None  # Last fetched tournament info
+        self.shown = None  # What the message shows now, compared against every poll
+        self.ranks = {}  # username -> rank as last shown, for the movement arrows
+        self.polls = 0
+        self.edits = 0
+        self.skipped = 0
+
+    async def poll(self):
+        """
+        :return: (tournament info, top standings), the info is the last fetched one between its refreshes
+        """
+        if self.kind == 'arena':
+            get_info, standings = lichess.get_tournament, lichess.stream_results
+        else:
+            get_info, standings = lichess.get_swiss, lichess.stream_swiss_results
+        rows = self._rows(standings(self.tournament_id, self.size))
+        if self.info is None or self.polls % self.info_every == 0:
+            self.info, rows = await asyncio.gather(get_info(self.tournament_id), rows)
+        else:
+            rows = await rows
+        self.polls += 1
+        return self.info, rows
+
+    @staticmethod
+    async def _rows(standings):
+        # Swiss results have points instead of score
+        return [(row['rank'], row['username'], row.get('score', row.get('points')))
+                async for row in standings]
+
+    def finished(self, info):
+        return info.get('isFinished', False) if self.kind == 'arena' else info.get('status') == 'finished'
+
+    def status(self, info):
+        if self.finished(info):
+            return 'Final standings'
+        if self.kind == 'arena':
+            if not info.get('isStarted', True):
+                return 'Starts in {}'.format(datetime.timedelta(seconds=info.get('secondsToStart', 0)))
+            return 'Live, {} left'.format(datetime.timedelta(seconds=info.get('secondsToFinish', 0)))
+        return 'Live, round {} of {}'.format(info.get('round', 0), info.get('nbRounds', '?'))
+
+    def render(self, info, rows):
+        url = f'https://lichess.org/tournament/{self.tournament_id}' if self.kind == 'arena' \
+            else f'https://lichess.org/swiss/{self.tournament_id}'
+        stat_embed = discord.Embed(
+            title=f"Standings for {info.get('fullName', info.get('name', self.tournament_id))}",
+            description=self.status(info),
+            color=discord.Color.dark_blue()
+        )
+        stat_embed.set_author(name='lichess.org',
+                              icon_url='https://lichess1.org/assets/_QubGrC/logo/lichess-favicon-256.png',
+                              url=url)
+
+        if rows:
+            ranks = []
+            for rank, username, score in rows:
+                # Movement since the previous edit
+                before = self.ranks.get(username)
+                ranks.append(f'{rank}' + ('' if before is None or before == rank else ' ▲' if rank < before else ' ▼'))
+            stat_embed.add_field(name='Rank', value='\n'.join(ranks), inline=True)
+            stat_embed.add_field(name='Username', value='\n'.join(row[1] for row in rows), inline=True)
+            stat_embed.add_field(name='Score', value='\n'.join(str(row[2]) for row in rows), inline=True)
+        else:
+            stat_embed.add_field(name='Standings', value='Nobody has joined yet')
+
+        stat_embed.set_footer(text='{players} players | Updated {time:%H:%M:%S} UTC'.format(
+            players=info.get('nbPlayers', len(rows)), time=datetime.datetime.utcnow()))
+        return stat_embed
+
+    async def run(self):
+        """
+        Poll until the tournament finishes, tracking stops after max_duration or on repeated failures
+        """
+        deadline = monotonic() + self.max_duration
+        failures = 0
+        pending = None
+        channel_id = self.message.channel.id
+
+        while True:
+            try:
+                info, rows = await self.poll()
+                failures = 0
+            except (LichessError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                failures += 1
+                print(f'Tracking {self.tournament_id} failed ({failures}/{self.max_failures}): {e!r}')
+                if failures >= self.max_failures:
+                    return
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            finished = self.finished(info)
+            # The arena clock alone doesn't warrant an edit, the footer says when the standings were taken
+            state = (rows, finished, info.get('nbPlayers'), info.get('round'))
+            if state == self.shown:
+                self.skipped += 1
+                pending = None
+            else:
+                pending = (info, rows, state)
+
+            if pending is not None:
+                if finished:
+                    # Always get the final standings out
+                    await asyncio.sleep(self.throttle.wait_time(channel_id))
+                if self.throttle.ready(channel_id):
+                    info, rows, state = pending
+                    try:
+                        await self.message.edit(embed=self.render(info, rows))
+                    except discord.NotFound:  # Message deleted, nobody is watching anymore
+                        return
+                    self.throttle.edited(channel_id)
+                    self.shown = state
+                    self.ranks = {username: rank for rank, username, _ in rows}
+                    self.edits += 1
+                    pending = None
+
+            if finished or monotonic() > deadline:
+                return
+            await asyncio.sleep(self.poll_interval)
@@ -0,0 +1,181 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PoolTimeout(Exception):
+    def __init__(self, message="All browsers are busy, try again in a moment"):
+        super().__init__(message)
+
+
+class Worker:
+    """
+    One browser and the number of pages it has loaded since it was (re)started
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.driver = None
+        self.pages = 0
+
+
+class WebDriverPool:
+    """
+    Bounded pool of WebDriver instances whose blocking calls all run in a dedicated thread executor
+
+    Usage:
+        async with pool.acquire() as worker:
+            result = await pool.run(worker, scrape, username)   # scrape(driver, username) runs in a thread
+    """
+
+    def __init__(self, factory, size=None, max_pages=50, acquire_timeout=30):
+        """
+        :param factory: callable returning a new driver (called from a worker thread)
+        :param int size: number of browsers, defaults to the number of cores
+        :param int max_pages: pages a browser may load before it is recycled to cap memory growth
+        :param float acquire_timeout: seconds to wait for a free browser before raising PoolTimeout
+        """
+        self.factory = factory
+        self.size = size or os.cpu_count() or 1
+        self.max_pages = max_pages
+        self.acquire_timeout = acquire_timeout
+        self.executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix='webdriver')
+        self.idle = None
+        self.workers = [Worker(i) for i in range(self.size)]
+        self.waiting = 0
+        self.recycled = 0
+        self.closed = False
+
+    def _get_idle(self):
+        # Queue is created lazily so it binds to the bot's running loop
+        if self.idle is None:
+            self.idle = asyncio.Queue()
+            for worker in self.workers:
+                self.idle.put_nowait(worker)
+        return self.idle
+
+    async def _call(self, fn, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+    def _healthy(self, worker):
+        if worker.driver is None:
+            return False
+        try:
+            # Any round trip to the browser will do, a crashed browser or geckodriver raises here
+            worker.driver.current_url
+        except Exception:
+            return False
+        return True
+
+    def _quit(self, worker):
+        if worker.driver is not None:
+            try:
+                worker.driver.quit()
+            except Exception:
+                pass
+        worker.driver = None
+        worker.pages = 0
+
+    def _prepare(self, worker):
+        if worker.driver is not None and not self._healthy(worker):
+            print(f'WebDriver worker {worker.index} failed health check, restarting')
+            self._quit(worker)
+        if worker.driver is None:
+            worker.driver = self.factory()
+
+    def acquire(self):
+        return _Lease(self)
+
+    async def run(self, worker, fn, *args):
+        """
+        Run fn(driver, *args) on the worker's browser in the pool's executor
+        """
+        worker.pages += 1
+        return await self._call(fn, worker.driver, *args)
+
+    async def _acquire(self):
+        if self.closed:
+            raise RuntimeError('WebDriver pool is closed')
+        idle = self._get_idle()
+        # Shielded so wait_for can't drop a worker the get took just as the wait ended (Python < 3.12),
+        # the get is settled below instead
+        getter = asyncio.ensure_future(idle.get())
+        self.waiting += 1
+        try:
+            worker = await asyncio.wait_for(asyncio.shield(getter), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            worker = self._settle(getter)
+            if worker is None:
+                raise PoolTimeout()
+        except BaseException:
+            worker = self._settle(getter)
+            if worker is not None:
+                idle.put_nowait(worker)
+            raise
+        finally:
+            self.waiting -= 1
+
+        try:
+            await self._call(self._prepare, worker)
+        except BaseException:
+            self._get_idle().put_nowait(worker)
+            raise
+        return worker
+
+    @staticmethod
+    def _settle(getter):
+        """
+        :return: worker a pending get obtained, None if it hadn't (it is cancelled, leaving the worker queued)
+        """
+        if getter.done() and not getter.cancelled():
+            return getter.result()
+        getter.cancel()
+        return None
+
+    async def _release(self, worker):
+        if self.closed:
+            # Pool executor is already shut down, quit on the loop's default executor instead
+            await asyncio.get_event_loop().run_in_executor(None, self._quit, worker)
+            return
+        if worker.pages >= self.max_pages:
+            await self._call(self._quit, worker)
+            self.recycled += 1
+        self._get_idle().put_nowait(worker)
+
+    async def warm(self):
+        """
+        Launch a browser ahead of the first lookup
+        """
+        async with self.acquire():
+            pass
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'running': sum(worker.driver is not None for worker in self.workers),
+            'idle': self._get_idle().qsize(),
+            'waiting': self.waiting,
+            'recycled': self.recycled
+        }
+
+    async def close(self):
+        self.closed = True
+        # Idle browsers are quit now, busy ones as they are released
+        idle = self._get_idle()
+        while not idle.empty():
+            await self._call(self._quit, idle.get_nowait())
+        self.executor.shutdown(wait=False)
+
+
+class _Lease:
+    def __init__(self, pool):
+        self.pool = pool
+        self.worker = None
+
+    async def __aenter__(self):
+        self.worker = await self.pool._acquire()
+        return self.worker
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.pool._release(self.worker)